@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cache of parsed annotation tables (miRBase GFF3, SNV tables).
+
+Parsing the annotation files takes longer than the rest of a
+filterMiRAWpredictionsByDMRs.py run, and the same files are used for every
+DMR file and distance setting. loadTables() stores whatever the parser
+returns as a pickle in the cache folder
+
+    annotationcache/<kind>__<md5 of the file>.pkl
+
+and returns the stored tables on the next run, as long as the content of
+the file hasn't changed. Delete the folder to clear the cache.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+import compressedIO
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+CACHE_FOLDER_NAME = "annotationcache"
+CACHE_EXTENSION = ".pkl"
+# change this when the parsed tables change, so old cache files are not used
+CACHE_VERSION = "1"
+MD5_BLOCK_SIZE = 1 << 20
+
+
+def fileDigest(filePath):
+    '''md5 of the file content (of its compressed copy, if only that exists)'''
+    md5 = hashlib.md5(CACHE_VERSION.encode())
+    with open(compressedIO.resolvePath(filePath), 'rb') as fIn:
+        for block in iter(lambda: fIn.read(MD5_BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def cachePath(cacheFolder, kind, sourceFile):
+    return os.path.join(cacheFolder, kind + "__" + fileDigest(sourceFile) + CACHE_EXTENSION)
+
+
+def loadTables(kind, sourceFile, parser, cacheFolder=None):
+    '''
+    return parser(sourceFile), from the cache if sourceFile has been parsed before.
+    With no cacheFolder the file is always parsed
+    '''
+    if not cacheFolder:
+        return parser(sourceFile)
+
+    cacheFile = cachePath(cacheFolder, kind, sourceFile)
+    if os.path.isfile(cacheFile):
+        try:
+            with open(cacheFile, 'rb') as fC:
+                tables = pickle.load(fC)
+            logging.info("--loaded " + kind + " tables from cache <" + cacheFile + ">")
+            return tables
+        except Exception as e:
+            # e.g. written by a different pandas version
+            logging.warning("--can't read cache file <" + cacheFile + "> (" + repr(e) + "), parsing <"
+                            + sourceFile + "> again")
+
+    tables = parser(sourceFile)
+    if not os.path.isdir(cacheFolder):
+        os.makedirs(cacheFolder, exist_ok=True)
+    # write to a temporary file first, so parallel runs never read a partial cache file
+    fd, tmpFile = tempfile.mkstemp(dir=cacheFolder, suffix=CACHE_EXTENSION + ".tmp")
+    with os.fdopen(fd, 'wb') as fC:
+        pickle.dump(tables, fC, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpFile, cacheFile)
+    logging.info("--cached " + kind + " tables in <" + cacheFile + ">")
+    return tables
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Time each stage of the miRAW wrapper pipeline on synthetic data
+
+    python benchmarkPipeline.py -o /tmp/bench -s small -r 3
+    python benchmarkPipeline.py -o /tmp/bench -s medium -S cutoffFilter,showPairing
+    python benchmarkPipeline.py -o /tmp/bench -s small -c /tmp/bench/benchmark_20210301_101244.json
+
+-o working folder (the synthetic data is generated in <folder>/data_<scale>)
+-s scale of the synthetic data (see syntheticData.py)
+-r number of times each stage is run
+-S comma separated list of stages to run [default: all]
+-c compare the timings with an earlier benchmark_*.json file
+
+each stage is run as a separate process, the same way it is run in
+production. The results are written to
+
+    <folder>/benchmark_<date>_<time>.json   full results for this run
+    <folder>/benchmark_history.tsv          one line per stage and repeat, appended
+                                            to on each run, so timings can be
+                                            compared between versions
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+import syntheticData
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = "benchmark_history.tsv"
+HISTORY_COLUMNS = ["time", "version", "scale", "mirnas", "utrs", "stage", "repeat",
+                   "wall", "cpu", "exitCode", "inputRows"]
+STDERR_TAIL = 2000
+
+# stage name -> (script, input key in the synthetic data index)
+STAGES = [
+    ("miRAWbatch", "miRAWbatch.py", "unifiedFile"),
+    ("miRAWResultFilterer", "miRAWResultFilterer.py", "positiveTargetSites"),
+    ("cutoffFilter", "cutoffFilter.py", "allTargetSites"),
+    ("showPairing", "showPairing.py", "allTargetSites"),
+    ("extractConflicts", "extractConflicts.py", "allTargetSites"),
+    ("pooling", "filterAndPoolMiRAWpredictions.py", "pooledSites"),
+    ("dmrAnnotation", "filterMiRAWpredictionsByDMRs.py", "groupedPredictions"),
+    ("dmrAnnotationCached", "filterMiRAWpredictionsByDMRs.py", "groupedPredictions"),
+]
+# stages that are run once before they are timed, so every repeat finds a warm cache
+WARM_UP_STAGES = ["dmrAnnotationCached"]
+ANNOTATION_CACHE_FOLDER = "annotationcache"
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='benchmark the miRAW wrapper pipeline')
+
+    parser.add_argument("-o", "--outFolder", dest='outFolder',
+                        help="working folder for data and results")
+    parser.add_argument("-s", "--scale", dest='scale', default=syntheticData.DEFAULT_SCALE,
+                        choices=sorted(syntheticData.SCALES), help="size of the synthetic data [default: %(default)s]")
+    parser.add_argument("--mirnas", dest='mirnas', type=int,
+                        help="number of miRNAs (overrides the scale)")
+    parser.add_argument("--utrs", dest='utrs', type=int,
+                        help="number of 3'UTRs (overrides the scale)")
+    parser.add_argument("--seed", dest='seed', type=int, default=syntheticData.DEFAULT_SEED,
+                        help="random seed for the synthetic data [default: %(default)s]")
+    parser.add_argument("-r", "--repeats", dest='repeats', type=int, default=1,
+                        help="number of runs of each stage [default: %(default)s]")
+    parser.add_argument("-S", "--stages", dest='stages',
+                        help="comma separated list of stages [default: all]")
+    parser.add_argument("-c", "--compare", dest='compareFile',
+                        help="earlier benchmark .json file to compare with")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking arguments:")
+    if not args.outFolder:
+        logging.error("----you need to specify a working folder using the -o/--outFolder parameter")
+        printHelpAndExit()
+    args.outFolder = os.path.abspath(args.outFolder)
+    if not os.path.isdir(args.outFolder):
+        os.makedirs(args.outFolder)
+    stageNames = [stage[0] for stage in STAGES]
+    if args.stages:
+        args.stages = args.stages.split(",")
+        for stage in args.stages:
+            if stage not in stageNames:
+                logging.error("--unknown stage <" + stage + ">, choose from " + ",".join(stageNames))
+                sys.exit(1)
+    else:
+        args.stages = stageNames
+    if args.compareFile and not os.path.isfile(args.compareFile):
+        logging.error("--can't find benchmark file at <" + args.compareFile + ">")
+        sys.exit(1)
+    logging.info("--OK")
+
+
+def codeVersion():
+    '''git commit of the code being benchmarked (or the module version)'''
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=SCRIPT_FOLDER,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return __version__
+
+
+def stageCommand(stage, files, workFolder):
+    '''the command line for a stage, using the synthetic data files'''
+    script = os.path.join(SCRIPT_FOLDER, dict((s[0], s[1]) for s in STAGES)[stage])
+    experiment = files["experimentFolder"]["file"]
+    if stage == "miRAWbatch":
+        batchFolder = os.path.join(workFolder, "batch")
+        return [script, "-e", "bench", "-o", batchFolder, "-r", batchFolder, "-d", "model.bin",
+                "-c", "Regular", "-t", "3", "-m", files["miRNAFasta"]["file"], "-3", files["utrFasta"]["file"]]
+    if stage == "miRAWResultFilterer":
+        # miRAWResultFilterer takes the MFE cutoff as a positive number, a negative one is ignored
+        return [script, "-t", files["targetPredictionOutput"]["file"], "-s", files["positiveTargetSites"]["file"],
+                "-u", files["unifiedFile"]["file"], "-e", "10", "-p", "0.8"]
+    if stage == "cutoffFilter":
+        return [script, "-f", files["allTargetSites"]["file"], "-P", "0.8", "-E", "-10"]
+    if stage == "showPairing":
+        return [script, "-f", experiment, "-a", "-p", "-n"]
+    if stage == "extractConflicts":
+        return [script, "-f", experiment]
+    if stage == "pooling":
+        return [script, "-r", files["resultFiles"]["file"], "-p", "0.5", "-e", "-5"]
+    if stage in ("dmrAnnotation", "dmrAnnotationCached"):
+        command = [script, "-p", files["groupedPredictions"]["file"], "-g", files["miRBaseGFF3"]["file"],
+                   "-3", files["utrSNVs"]["file"], "-m", files["miRNASNVs"]["file"], "-d", files["DMRs"]["file"],
+                   "-D", str(syntheticData.DMR_DISTANCE)]
+        # dmrAnnotation always parses the annotation files, dmrAnnotationCached
+        # times loading them from the annotation cache
+        if stage == "dmrAnnotation":
+            return command + ["--nocache"]
+        return command + ["-C", os.path.join(workFolder, ANNOTATION_CACHE_FOLDER)]
+
+
+def childCPUTime():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def runStage(stage, command, workFolder):
+    '''run one stage and return (wall time, cpu time, exit code, stderr tail)'''
+    logging.info("--running <" + stage + ">")
+    cpuStart = childCPUTime()
+    wallStart = time.perf_counter()
+    completed = subprocess.run([sys.executable] + command, cwd=workFolder,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    wall = time.perf_counter() - wallStart
+    cpu = childCPUTime() - cpuStart
+    stderrTail = completed.stderr.decode(errors="replace")[-STDERR_TAIL:]
+    if completed.returncode != 0:
+        logging.warning("----<" + stage + "> exited with code <" + str(completed.returncode) + ">")
+    logging.info("----wall " + "{:.3f}".format(wall) + "s, cpu " + "{:.3f}".format(cpu) + "s")
+    return wall, cpu, completed.returncode, stderrTail
+
+
+def runBenchmark(args):
+    dataFolder = os.path.join(args.outFolder, "data_" + args.scale)
+    generateStart = time.perf_counter()
+    data = syntheticData.generate(dataFolder, args.scale, args.mirnas, args.utrs, args.seed)
+    generateTime = time.perf_counter() - generateStart
+
+    results = {"time": str(datetime.now()),
+               "version": codeVersion(),
+               "host": socket.gethostname(),
+               "python": platform.python_version(),
+               "scale": args.scale,
+               "mirnas": data.nMiRNAs,
+               "utrs": data.nUTRs,
+               "seed": data.seed,
+               "generateTime": generateTime,
+               "stages": []}
+    for stage, script, inputKey in STAGES:
+        if stage not in args.stages:
+            continue
+        command = stageCommand(stage, data.files, dataFolder)
+        if stage in WARM_UP_STAGES:
+            logging.info("--warming up <" + stage + ">")
+            runStage(stage, command, dataFolder)
+        for repeat in range(args.repeats):
+            wall, cpu, exitCode, stderrTail = runStage(stage, command, dataFolder)
+            entry = {"stage": stage, "repeat": repeat, "wall": wall, "cpu": cpu,
+                     "exitCode": exitCode, "inputRows": data.files[inputKey]["rows"],
+                     "command": " ".join(command)}
+            if exitCode != 0:
+                entry["stderr"] = stderrTail
+            results["stages"].append(entry)
+    return results
+
+
+def writeResults(results, outFolder):
+    resultsFile = os.path.join(outFolder, "benchmark_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    with open(resultsFile, 'w') as fR:
+        json.dump(results, fR, indent=2)
+    logging.info("results written to <" + resultsFile + ">")
+
+    historyFile = os.path.join(outFolder, HISTORY_FILE)
+    newHistory = not os.path.isfile(historyFile)
+    with open(historyFile, 'a') as fH:
+        if newHistory:
+            fH.write("\t".join(HISTORY_COLUMNS) + "\n")
+        for entry in results["stages"]:
+            row = dict(results)
+            row.update(entry)
+            fH.write("\t".join(str(row[column]) for column in HISTORY_COLUMNS) + "\n")
+    logging.info("history appended to <" + historyFile + ">")
+    return resultsFile
+
+
+def bestTimes(results):
+    '''fastest successful wall time for each stage'''
+    best = {}
+    for entry in results["stages"]:
+        if entry["exitCode"] != 0:
+            continue
+        best[entry["stage"]] = min(entry["wall"], best.get(entry["stage"], entry["wall"]))
+    return best
+
+
+def compareResults(results, compareFile):
+    with open(compareFile, 'r') as fC:
+        earlier = json.load(fC)
+    logging.info("comparing with <" + compareFile + "> (version " + str(earlier.get("version")) + ")")
+    if (earlier.get("mirnas"), earlier.get("utrs")) != (results["mirnas"], results["utrs"]):
+        logging.warning("--the data sets have different sizes, timings are not directly comparable")
+    before = bestTimes(earlier)
+    after = bestTimes(results)
+    for stage in [s[0] for s in STAGES]:
+        if stage in before and stage in after:
+            logging.info("--" + stage + "\t" + "{:.3f}".format(before[stage]) + "s -> "
+                         + "{:.3f}".format(after[stage]) + "s\t(x" + "{:.2f}".format(after[stage] / before[stage]) + ")")
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    results = runBenchmark(args)
+    writeResults(results, args.outFolder)
+    if args.compareFile:
+        compareResults(results, args.compareFile)
+    failures = [entry["stage"] for entry in results["stages"] if entry["exitCode"] != 0]
+    logging.info("finished")
+    # the timings are still written, but a failed stage fails the run, so a
+    # broken stage can't pass as a fast one in a scripted benchmark
+    if failures:
+        logging.error("stages that failed: " + ",".join(sorted(set(failures))))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
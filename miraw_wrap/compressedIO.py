@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shared file access layer for the miRAW wrapper modules.
+
+Unified files and miRAW result files (e.g. allTargetSites.csv) can be
+stored compressed. The compression type is detected from the file extension
+
+    .gz   gzip
+    .bgz  block gzip (concatenated gzip members, readable by gzip/zcat)
+    .zst  zstandard (needs the optional 'zstandard' package)
+
+anything else is read and written as plain text.
+
+gzip and block gzip output is compressed in blocks by a pool of worker
+threads, zstandard uses its own multithreaded compressor. The number of
+threads can be set with the MIRAW_IO_THREADS environment variable.
+
+Paths are resolved transparently, so asking for
+    folder/folder.allTargetSites.csv
+will open
+    folder/folder.allTargetSites.csv.gz
+if only the compressed version exists.
+"""
+
+import io
+import os
+import gzip
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+COMPRESSION_NONE = None
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_BGZIP = "bgzip"
+COMPRESSION_ZSTD = "zstd"
+
+COMPRESSION_EXTENSIONS = collections.OrderedDict([
+    (".gz", COMPRESSION_GZIP),
+    (".bgz", COMPRESSION_BGZIP),
+    (".zst", COMPRESSION_ZSTD),
+])
+
+DEFAULT_THREADS = int(os.environ.get("MIRAW_IO_THREADS", min(4, os.cpu_count() or 1)))
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+BLOCK_SIZE = 1 << 20
+
+
+def compressionType(filePath):
+    '''return the compression type for a file, based on its extension'''
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(filePath)[1].lower(), COMPRESSION_NONE)
+
+
+def splitCompressionExtension(filePath):
+    '''
+    split a file path into the uncompressed path and the compression extension
+      e.g. 'a/b.allTargetSites.csv.gz' -> ('a/b.allTargetSites.csv', '.gz')
+    '''
+    base, ext = os.path.splitext(filePath)
+    if ext.lower() in COMPRESSION_EXTENSIONS:
+        return base, ext
+    return filePath, ""
+
+
+def resolvePath(filePath):
+    '''
+    return the path of the file that should be read for filePath
+    if filePath doesn't exist, but a compressed version does, the
+    compressed version is returned. Otherwise filePath is returned unchanged
+    '''
+    if os.path.isfile(filePath):
+        return filePath
+    for ext in COMPRESSION_EXTENSIONS:
+        if os.path.isfile(filePath + ext):
+            return filePath + ext
+    return filePath
+
+
+def fileExists(filePath):
+    '''True if filePath, or a compressed version of it, exists'''
+    return os.path.isfile(resolvePath(filePath))
+
+
+def deriveOutputPath(inputPath, newBasePath):
+    '''
+    give newBasePath the same compression extension as inputPath
+    so output files are written in the same format as the input
+    '''
+    return newBasePath + splitCompressionExtension(inputPath)[1]
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    '''
+    binary writer that compresses data in fixed size blocks using a pool
+    of worker threads. Each block becomes a separate gzip member, so the
+    output is a valid gzip stream (this is the layout used by bgzip)
+    '''
+
+    def __init__(self, fileObj, threads=DEFAULT_THREADS, level=DEFAULT_GZIP_LEVEL, blockSize=BLOCK_SIZE):
+        super(ParallelGzipWriter, self).__init__()
+        self.fileObj = fileObj
+        self.level = level
+        self.blockSize = blockSize
+        self.threads = max(1, threads)
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.blockSize:
+            self._submitBlock(bytes(self.buffer[:self.blockSize]))
+            del self.buffer[:self.blockSize]
+        return len(data)
+
+    def _submitBlock(self, block):
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level))
+        # keep the number of blocks in memory bounded
+        while len(self.pending) > 2 * self.threads:
+            self.fileObj.write(self.pending.popleft().result())
+
+    def _drain(self):
+        if self.buffer:
+            self._submitBlock(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fileObj.write(self.pending.popleft().result())
+
+    def flush(self):
+        if not self.closed:
+            self._drain()
+            self.fileObj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super(ParallelGzipWriter, self).close()
+        finally:
+            self.executor.shutdown()
+            self.fileObj.close()
+
+
+def _openCompressedRead(filePath, compression):
+    if compression in (COMPRESSION_GZIP, COMPRESSION_BGZIP):
+        return gzip.open(filePath, 'rb')
+    if compression == COMPRESSION_ZSTD:
+        _checkZstandard(filePath)
+        return zstandard.ZstdDecompressor().stream_reader(open(filePath, 'rb'), closefd=True)
+    return open(filePath, 'rb')
+
+
+def _openCompressedWrite(filePath, compression, mode, threads, level):
+    rawMode = 'ab' if mode.startswith('a') else 'wb'
+    if compression in (COMPRESSION_GZIP, COMPRESSION_BGZIP):
+        if threads > 1 or compression == COMPRESSION_BGZIP:
+            return ParallelGzipWriter(open(filePath, rawMode), threads,
+                                      DEFAULT_GZIP_LEVEL if level is None else level)
+        return gzip.open(filePath, rawMode, DEFAULT_GZIP_LEVEL if level is None else level)
+    if compression == COMPRESSION_ZSTD:
+        _checkZstandard(filePath)
+        compressor = zstandard.ZstdCompressor(level=DEFAULT_ZSTD_LEVEL if level is None else level,
+                                              threads=threads if threads > 1 else 0)
+        return compressor.stream_writer(open(filePath, rawMode), closefd=True)
+    return open(filePath, rawMode)
+
+
+def _checkZstandard(filePath):
+    if zstandard is None:
+        raise IOError("the 'zstandard' package is needed to read or write <" + filePath + ">")
+
+
+def openFile(filePath, mode='r', threads=DEFAULT_THREADS, level=None, encoding=None, newline=None):
+    '''
+    open a plain or compressed file. Supports the modes r, w, a, rb, wb, ab
+    in read mode, the path is resolved with resolvePath() first, so callers
+    can pass the uncompressed file name
+    '''
+    if 'r' in mode:
+        filePath = resolvePath(filePath)
+    compression = compressionType(filePath)
+    if compression is COMPRESSION_NONE:
+        if 'b' in mode:
+            return open(filePath, mode)
+        return open(filePath, mode, encoding=encoding, newline=newline)
+
+    if 'r' in mode:
+        binaryHandle = _openCompressedRead(filePath, compression)
+        if 'b' in mode:
+            return binaryHandle
+        return io.TextIOWrapper(io.BufferedReader(binaryHandle, BLOCK_SIZE)
+                                if isinstance(binaryHandle, io.RawIOBase) else binaryHandle,
+                                encoding=encoding, newline=newline)
+
+    binaryHandle = _openCompressedWrite(filePath, compression, mode, threads, level)
+    if isinstance(binaryHandle, io.RawIOBase):
+        binaryHandle = io.BufferedWriter(binaryHandle, BLOCK_SIZE)
+    if 'b' in mode:
+        return binaryHandle
+    return io.TextIOWrapper(binaryHandle, encoding=encoding, newline=newline)
+
+
+def compressBlock(data, compression, level=None):
+    '''
+    compress bytes as a self contained gzip member or zstd frame, so blocks
+    can be appended to one file and later read back individually by offset
+    '''
+    if compression in (COMPRESSION_GZIP, COMPRESSION_BGZIP):
+        return gzip.compress(data, DEFAULT_GZIP_LEVEL if level is None else level)
+    if compression == COMPRESSION_ZSTD:
+        _checkZstandard("zstd block")
+        return zstandard.ZstdCompressor(level=DEFAULT_ZSTD_LEVEL if level is None else level).compress(data)
+    return data
+
+
+def decompressBlock(data, compression):
+    '''reverse of compressBlock'''
+    if compression in (COMPRESSION_GZIP, COMPRESSION_BGZIP):
+        return gzip.decompress(data)
+    if compression == COMPRESSION_ZSTD:
+        _checkZstandard("zstd block")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def readTable(filePath, **kwargs):
+    '''pandas.read_csv on a plain or compressed file'''
+    import pandas as pd
+    with openFile(filePath, 'r') as fTable:
+        return pd.read_csv(fTable, **kwargs)
+
+
+def writeTable(dataFrame, filePath, **kwargs):
+    '''DataFrame.to_csv to a plain or compressed file'''
+    with openFile(filePath, 'w') as fTable:
+        dataFrame.to_csv(fTable, **kwargs)
+
+
+def compressFile(filePath, compression=COMPRESSION_GZIP, threads=DEFAULT_THREADS, removeOriginal=True):
+    '''
+    compress an existing plain file and return the path of the compressed file.
+    The file is written to a temporary name and renamed once complete
+    '''
+    ext = [e for e, c in COMPRESSION_EXTENSIONS.items() if c == compression][0]
+    targetPath = filePath + ext
+    tmpPath = filePath + ".part" + ext
+    with open(filePath, 'rb') as fIn:
+        with openFile(tmpPath, 'wb', threads=threads) as fOut:
+            while True:
+                block = fIn.read(BLOCK_SIZE)
+                if not block:
+                    break
+                fOut.write(block)
+    os.rename(tmpPath, targetPath)
+    if removeOriginal:
+        os.remove(filePath)
+    return targetPath
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Estimate the size and cost of a miRAW run, and calibrate the estimate
+by timing miRAW on a small sample of the input
+
+    python miRAWbatch.py -m mature.fa -3 utrs.fa -t 4 --dry-run --calibration miRAW.calibration.json
+    python costModel.py -m mature.fa -3 utrs.fa -j miRAW.jar -d model.bin -c targetScan -o miRAW.calibration.json
+
+miRAW slides a window of MaxSiteLength nt along each 3'UTR in steps of
+SeedAlignmentOffset nt, so the work for a miRNA/3'UTR pair is
+
+    windows = (3'UTR length - MaxSiteLength) / SeedAlignmentOffset + 1
+
+and the estimates are
+
+    CPU seconds   = windows x secondsPerWindow + jobs x jobOverheadSeconds
+    result bytes  = windows x outputBytesPerWindow
+
+the calibration (this script) picks --mirnas miRNAs and --utrs 3'UTRs
+spread evenly over the input files, runs miRAW on --points growing subsets
+of them, and fits the two CPU constants to the CPU time (user + system, of
+miRAW and its threads) of the runs. The constants depend on the machine,
+the model and the candidate site selection model, so calibrate on the same
+kind of node and with the same -d/-c options as the real run. Without a
+calibration file the defaults below are used, which are only a rough guide.
+
+-m/-3          the miRNA and 3'UTR fasta files
+-j/-d/-c       miRAW.jar, the model file and the candidate site selection model
+-W/-S          MaxSiteLength and SeedAlignmentOffset [default 40 and 5]
+--mirnas/--utrs  size of the sample [default 2 and 24]
+--points       number of subsets of the sample that are timed [default 3]
+-w             working folder for the sample runs [default: a temporary folder]
+-o             calibration file to write
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+import fastaReader
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+MAX_SITE_LENGTH = 40
+SEED_ALIGNMENT_OFFSET = 5
+UNIFIED_HEADER = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript"
+# per row, besides the ids, sequences and newline: 5 tabs and the "?" of Positive_Negative
+ROW_SEPARATOR_BYTES = 6
+
+# used when no calibration file is given
+DEFAULT_CALIBRATION = {"secondsPerWindow": 2e-4,
+                       "jobOverheadSeconds": 20.0,
+                       "outputBytesPerWindow": 25.0}
+CALIBRATION_KEYS = list(DEFAULT_CALIBRATION.keys())
+
+SAMPLE_MIRNAS = 2
+SAMPLE_UTRS = 24
+SAMPLE_POINTS = 3
+STDERR_TAIL = 2000
+
+
+def windowCount(utrLength, maxSiteLength=MAX_SITE_LENGTH, seedAlignmentOffset=SEED_ALIGNMENT_OFFSET):
+    '''number of windows miRAW scans on a 3'UTR'''
+    return max(1, (utrLength - maxSiteLength) // max(1, seedAlignmentOffset) + 1)
+
+
+def fastaRecords(fastaFile):
+    '''(id, sequence) for each record'''
+    for name, description, seq in fastaReader.readFasta(fastaFile):
+        yield name, seq
+
+
+class FastaSummary(object):
+    '''the number of records and the id and sequence bytes of (id, sequence) records'''
+
+    def __init__(self, records):
+        self.count = 0
+        self.idBytes = 0
+        self.seqBytes = 0
+        self.lengths = []
+        for name, seq in records:
+            self.count += 1
+            self.idBytes += len(name)
+            self.seqBytes += len(seq)
+            self.lengths.append(len(seq))
+
+    def windows(self, maxSiteLength, seedAlignmentOffset):
+        return [windowCount(length, maxSiteLength, seedAlignmentOffset) for length in self.lengths]
+
+
+def readCalibration(calibrationFile):
+    '''the calibration constants, the defaults if calibrationFile is None'''
+    calibration = dict(DEFAULT_CALIBRATION)
+    calibration["source"] = "default"
+    if calibrationFile:
+        with open(calibrationFile, 'r') as fC:
+            stored = json.load(fC)
+        missing = [key for key in CALIBRATION_KEYS if key not in stored]
+        if missing:
+            raise ValueError("<" + calibrationFile + "> has no " + ", ".join(missing))
+        calibration.update(stored)
+        calibration["source"] = calibrationFile
+    return calibration
+
+
+def estimateRun(miRNAs, utrs, maxSiteLength, seedAlignmentOffset, calibration, newlineBytes=1):
+    '''
+    size and cost of the run for each split mode (-t 1 to 4) of miRAWbatch,
+    from the FastaSummary of the miRNA and 3'UTR files
+    '''
+    pairs = miRNAs.count * utrs.count
+    utrWindows = utrs.windows(maxSiteLength, seedAlignmentOffset)
+    windows = miRNAs.count * sum(utrWindows)
+    # miRNA, gene_name and EnsemblId columns, both sequences and the separators
+    rowBytes = (utrs.count * (miRNAs.idBytes + miRNAs.seqBytes)
+                + miRNAs.count * (2 * utrs.idBytes + utrs.seqBytes)
+                + pairs * (ROW_SEPARATOR_BYTES + newlineBytes))
+    headerBytes = len(UNIFIED_HEADER) + newlineBytes
+    largestUTR = max(utrWindows) if utrWindows else 0
+
+    def mode(split, name, jobs, largestJob):
+        cpuSeconds = windows * calibration["secondsPerWindow"] + jobs * calibration["jobOverheadSeconds"]
+        return {"split": split, "name": name, "jobs": jobs,
+                "unifiedFileBytes": jobs * headerBytes + rowBytes,
+                "largestJobWindows": largestJob,
+                "cpuHours": cpuSeconds / 3600.0}
+
+    return {"miRNAs": miRNAs.count, "utrs": utrs.count, "pairs": pairs, "windows": windows,
+            "maxSiteLength": maxSiteLength, "seedAlignmentOffset": seedAlignmentOffset,
+            "resultBytes": windows * calibration["outputBytesPerWindow"],
+            "calibration": calibration["source"],
+            "modes": [mode(1, "one file, by miRNA", 1, windows),
+                      mode(2, "one file, by 3'UTR", 1, windows),
+                      mode(3, "one file per miRNA", miRNAs.count, sum(utrWindows)),
+                      mode(4, "one file per 3'UTR", utrs.count, miRNAs.count * largestUTR)]}
+
+
+def humanBytes(size):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024 or unit == "TB":
+            return "{:.1f}".format(size) + unit
+        size /= 1024.0
+
+
+def logEstimate(estimate, splitType=None):
+    logging.info("<" + str(estimate["miRNAs"]) + "> miRNAs x <" + str(estimate["utrs"]) + "> 3'UTRs = <"
+                 + str(estimate["pairs"]) + "> pairs")
+    logging.info("<" + str(estimate["windows"]) + "> windows (MaxSiteLength " + str(estimate["maxSiteLength"])
+                 + ", SeedAlignmentOffset " + str(estimate["seedAlignmentOffset"]) + ")")
+    logging.info("about " + humanBytes(estimate["resultBytes"]) + " of miRAW results")
+    logging.info("split\tjobs\tunifiedFile\tlargest job (windows)\tCPU-hours")
+    for mode in estimate["modes"]:
+        marker = " <-" if splitType is not None and int(splitType) == mode["split"] else ""
+        logging.info(str(mode["split"]) + "\t" + str(mode["jobs"]) + "\t" + humanBytes(mode["unifiedFileBytes"])
+                     + "\t" + str(mode["largestJobWindows"]) + "\t" + "{:.2f}".format(mode["cpuHours"])
+                     + "\t(" + mode["name"] + ")" + marker)
+    if estimate["calibration"] == "default":
+        logging.warning("--CPU-hours and result size use the default calibration, "
+                        "run costModel.py on a sample to tune them")
+    else:
+        logging.info("--calibration from <" + estimate["calibration"] + ">")
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description="time miRAW on a sample to calibrate miRAWbatch's --dry-run estimates")
+
+    parser.add_argument("-m", "--mirnaFile", dest="miRFile",
+                        help="miRNA fasta file")
+    parser.add_argument("-3", "--3UTR", dest="utrFile",
+                        help="3'UTR fasta file")
+    parser.add_argument("-j", "--jarLoc", dest="jarFileLocation", default="miRAW.jar",
+                        help="location of the miRAW.jar file [default: %(default)s]")
+    parser.add_argument("-d", "--dlModel", dest="dlModel",
+                        help="trained model file")
+    parser.add_argument("-c", "--cssm", dest="cssm", default="targetScan",
+                        help="Candidate Site Selection Model [default: %(default)s]")
+    parser.add_argument("-W", "--maximum_site_length", dest="maximumSiteLength", type=int, default=MAX_SITE_LENGTH,
+                        help="MaxSiteLength [default: %(default)s]")
+    parser.add_argument("-S", "--seed_alignment_offset", dest="seedAlignmentOffset", type=int,
+                        default=SEED_ALIGNMENT_OFFSET, help="SeedAlignmentOffset [default: %(default)s]")
+    parser.add_argument("--mirnas", dest="mirnas", type=int, default=SAMPLE_MIRNAS,
+                        help="number of miRNAs in the sample [default: %(default)s]")
+    parser.add_argument("--utrs", dest="utrs", type=int, default=SAMPLE_UTRS,
+                        help="number of 3'UTRs in the sample [default: %(default)s]")
+    parser.add_argument("--points", dest="points", type=int, default=SAMPLE_POINTS,
+                        help="number of subsets of the sample to time [default: %(default)s]")
+    parser.add_argument("-w", "--workFolder", dest="workFolder",
+                        help="folder for the sample runs [default: a temporary folder]")
+    parser.add_argument("-o", "--outFile", dest="outFile", default="miRAW.calibration.json",
+                        help="calibration file to write [default: %(default)s]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking input files:")
+    if not args.miRFile or not args.utrFile:
+        logging.error("----you need to specify the miRNA (-m) and 3'UTR (-3) fasta files")
+        printHelpAndExit()
+    for fastaFile in (args.miRFile, args.utrFile):
+        if not os.path.isfile(fastaFile):
+            logging.error("--can't find <" + fastaFile + ">")
+            sys.exit(1)
+    logging.info("--OK")
+    logging.info("checking miRAW:")
+    if not args.dlModel:
+        logging.error("----you need to specify the trained model file using the -d/--dlModel parameter")
+        printHelpAndExit()
+    if shutil.which("java") is None:
+        logging.error("--can't find java on the PATH")
+        sys.exit(1)
+    if args.mirnas < 1 or args.utrs < 1 or args.points < 2 or args.points > args.utrs:
+        logging.error("--the sample needs at least 1 miRNA, and at least --points (at least 2) 3'UTRs")
+        sys.exit(1)
+    logging.info("--OK")
+
+
+def sampleRecords(fastaFile, size):
+    '''size records spread evenly over the file, read in two passes'''
+    count = sum(1 for _ in fastaRecords(fastaFile))
+    picks = set(int(i * count / size) for i in range(min(size, count)))
+    return [record for i, record in enumerate(fastaRecords(fastaFile)) if i in picks]
+
+
+def childCPUTime():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def folderBytes(folder):
+    return sum(os.path.getsize(os.path.join(root, fileName))
+               for root, dirs, files in os.walk(folder) for fileName in files)
+
+
+def timeSample(name, miRNAs, utrs, args, workFolder):
+    '''run miRAW on all the pairs of miRNAs and utrs, returns the measurements'''
+    unifiedFile = os.path.join(workFolder, name + ".unifiedFile.csv")
+    with open(unifiedFile, 'w') as fU:
+        fU.write(UNIFIED_HEADER + "\n")
+        for mName, mSeq in miRNAs:
+            for uName, uSeq in utrs:
+                fU.write("\t".join([mName, uName, uName, "?", mSeq, uSeq]) + "\n")
+    propertiesFile = os.path.join(workFolder, name + ".properties")
+    with open(propertiesFile, 'w') as fP:
+        fP.write("ExperimentName=" + name + "\n")
+        fP.write("ExperimentFolder=" + workFolder + "\n")
+        fP.write("UnifiedFile=" + unifiedFile + "\n")
+        fP.write("DLModel=" + args.dlModel + "\n")
+        fP.write("CandidateSiteFinder.Type=" + args.cssm + "\n")
+        fP.write("MaxSiteLength=" + str(args.maximumSiteLength) + "\n")
+        fP.write("SeedAlignmentOffset=" + str(args.seedAlignmentOffset) + "\n")
+
+    windows = len(miRNAs) * sum(windowCount(len(seq), args.maximumSiteLength, args.seedAlignmentOffset)
+                                for _, seq in utrs)
+    logging.info("--<" + name + ">: " + str(len(miRNAs) * len(utrs)) + " pairs, " + str(windows) + " windows")
+    cpuStart = childCPUTime()
+    wallStart = time.perf_counter()
+    completed = subprocess.run(["java", "-jar", args.jarFileLocation, "GenePrediction", "predict", propertiesFile],
+                               cwd=workFolder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    wall = time.perf_counter() - wallStart
+    cpu = childCPUTime() - cpuStart
+    if completed.returncode != 0:
+        logging.error("----miRAW exited with code <" + str(completed.returncode) + ">: "
+                      + completed.stderr.decode(errors="replace")[-STDERR_TAIL:])
+        return None
+    outputBytes = folderBytes(os.path.join(workFolder, name))
+    logging.info("----wall " + "{:.2f}".format(wall) + "s, cpu " + "{:.2f}".format(cpu) + "s, "
+                 + humanBytes(outputBytes) + " of results")
+    return {"name": name, "pairs": len(miRNAs) * len(utrs), "windows": windows,
+            "wall": wall, "cpu": cpu, "outputBytes": outputBytes}
+
+
+def fitLine(xs, ys):
+    '''least squares (intercept, slope) of ys against xs'''
+    n = float(len(xs))
+    meanX = sum(xs) / n
+    meanY = sum(ys) / n
+    spread = sum((x - meanX) ** 2 for x in xs)
+    if spread == 0:
+        return 0.0, meanY / meanX if meanX else 0.0
+    slope = sum((x - meanX) * (y - meanY) for x, y in zip(xs, ys)) / spread
+    return meanY - slope * meanX, slope
+
+
+def calibrate(args, workFolder):
+    miRNAs = sampleRecords(args.miRFile, args.mirnas)
+    utrs = sampleRecords(args.utrFile, args.utrs)
+    logging.info("sample of <" + str(len(miRNAs)) + "> miRNAs and <" + str(len(utrs)) + "> 3'UTRs")
+    points = []
+    for point in range(1, args.points + 1):
+        subset = utrs[:max(1, len(utrs) * point // args.points)]
+        measured = timeSample("calibration" + str(point), miRNAs, subset, args, workFolder)
+        if measured is None:
+            return None
+        points.append(measured)
+
+    overhead, perWindow = fitLine([p["windows"] for p in points], [p["cpu"] for p in points])
+    if perWindow <= 0:
+        # the sample is too small to see the cost of a window above the noise
+        logging.warning("--the CPU time doesn't grow with the number of windows, try a larger sample")
+        perWindow = sum(p["cpu"] for p in points) / sum(p["windows"] for p in points)
+        overhead = 0.0
+    return {"secondsPerWindow": perWindow,
+            "jobOverheadSeconds": max(0.0, overhead),
+            "outputBytesPerWindow": sum(p["outputBytes"] for p in points) / float(sum(p["windows"] for p in points)),
+            "time": str(datetime.now()),
+            "host": socket.gethostname(),
+            "jar": os.path.abspath(args.jarFileLocation),
+            "dlModel": args.dlModel,
+            "cssm": args.cssm,
+            "maxSiteLength": args.maximumSiteLength,
+            "seedAlignmentOffset": args.seedAlignmentOffset,
+            "points": points}
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    workFolder = args.workFolder or tempfile.mkdtemp(prefix="miRAWcalibration.")
+    os.makedirs(workFolder, exist_ok=True)
+    try:
+        calibration = calibrate(args, workFolder)
+    finally:
+        if not args.workFolder:
+            shutil.rmtree(workFolder, ignore_errors=True)
+    if calibration is None:
+        return 1
+    with open(args.outFile, 'w') as fC:
+        json.dump(calibration, fC, indent=2)
+    logging.info("<" + "{:.3g}".format(calibration["secondsPerWindow"]) + "> CPU seconds per window, <"
+                 + "{:.1f}".format(calibration["jobOverheadSeconds"]) + "> seconds per job, <"
+                 + "{:.1f}".format(calibration["outputBytesPerWindow"]) + "> result bytes per window")
+    logging.info("calibration written to <" + args.outFile + ">")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
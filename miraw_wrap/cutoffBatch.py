@@ -32,6 +32,9 @@ import datetime
 from os import listdir
 from os.path import isfile, join
 
+import hashedLayout
+import sharding
+
 
 __author__ = "Yafei Xing"
 __copyright__ = "Copyright 2018, AMG-OUS"
@@ -72,8 +75,17 @@ parser.add_argument("-P","--probCutoff",dest='probabilityCutoff',
 parser.add_argument("-E","--enerCutoff",dest='energyCutoff',
                     help="to indicate whether the files will be filetered by free energy")
 
+parser.add_argument("-M", "--manifest", dest='experimentManifest',
+                    help="experiment manifest (.experiments.tsv) listing the miRAW result folders")
+
+parser.add_argument("--shard", dest="shard",
+                    help="only write the commands for shard i of N (i/N), see sharding.py")
+
 args = parser.parse_args()
 
+# with --shard, counts the experiments this shard takes (see sharding.py)
+shardRecord = None
+
 
 def printLongHelpAndExit():
     logging.info("+" + "-" * 78 + "+")
@@ -96,6 +108,12 @@ def printLongHelpAndExit():
     logging.info("+                                                                              +")
     logging.info("+      the cutoff value for free energy                   (-E/--enerCutoff)    +")
     logging.info("+                                                                              +")
+    logging.info("+      use -M to read the miRAW result folders from the experiment manifest    +")
+    logging.info("+      written by miRAWbatch (<exptName>.experiments.tsv) instead of listing   +")
+    logging.info("+      the folder (needed when miRAWbatch was run with -F/--fanout)            +")
+    logging.info("+                                                                              +")
+    logging.info("+      use --shard i/N to only write the commands for shard i of N. The        +")
+    logging.info("+      script is named <exptName>.shard<i>of<N>.sh (see sharding.py)           +")
     logging.info("+" + "-" * 78 + "+")
 
 
@@ -177,6 +195,18 @@ def checkOutFolder():
     logging.info("--OK")
 
 
+def checkShard():
+    if args.shard:
+        logging.info("checking shard:")
+        try:
+            args.shard = sharding.parseShard(args.shard)
+        except ValueError as e:
+            logging.error("----" + str(e))
+            printHelpAndExit()
+        args.exptName = sharding.shardName(args.exptName, args.shard)
+        logging.info("--OK")
+
+
 def checkArgs():
     
     if args.HelpMe :
@@ -185,17 +215,35 @@ def checkArgs():
     checkProgramLocation()
     checkExptName()
     checkOutFolder()
+    hashedLayout.checkExperimentManifest(args.experimentManifest)
+    checkShard()
     checkBindingEnergyCutOff()
     checkProbCutOff()
 
 
+def experimentFolders(folder):
+    # with -M the result folders are read from the manifest, otherwise
+    # every subfolder of the folder is a result folder
+    # with --shard only the folders whose feature hashes to the shard are kept
+    global shardRecord
+    folders, shardRecord = sharding.shardExperiments(hashedLayout.listExperiments(folder, args.experimentManifest),
+                                                     args.shard, "cutoffBatch")
+    return folders
+
+
+def writeShardRecord():
+    if shardRecord is not None:
+        shardRecord.write(os.path.join(args.targetFolder, args.exptName + sharding.SHARD_RECORD_EXTENSION),
+                          script=os.path.join(args.targetFolder, args.exptName + '.sh'))
+
+
 def writeScript():
 
     #python cutoffFilter.py -f filepath/file -P value -E value
     with open(os.path.join(args.targetFolder, args.exptName  + '.sh'), "w") as f:
         if args.fileTail:
-            for foldername in next(os.walk(args.targetFolder))[1]:
-                folderpath = os.path.join(args.targetFolder, foldername)
+            for folderpath in experimentFolders(args.targetFolder):
+                foldername = os.path.basename(folderpath)
                 content = "python " + funcLocation + " -f " + folderpath + "/" + foldername + args.fileTail
                 if args.probabilityCutoff:
                     content = content + " -P " + args.probabilityCutoff
@@ -205,6 +253,8 @@ def writeScript():
         else:
 
             filenames = [file for file in listdir(args.targetFolder) if isfile(join(args.targetFolder,file)) and file[-4:]=='.csv']
+            global shardRecord
+            filenames, shardRecord = sharding.shardExperiments([(file, file) for file in filenames], args.shard, "cutoffBatch")
         
             for file in filenames:
                 content = "python " + funcLocation + " -f " + join(args.targetFolder,file)
@@ -218,6 +268,7 @@ def writeScript():
 
 checkArgs()
 writeScript()
+writeShardRecord()
 
 
 
@@ -24,6 +24,8 @@ import csv
 import datetime
 import re
 
+import compressedIO
+
 __author__ = "Yafei Xing"
 __copyright__ = "Copyright 2018, AMG-OUS"
 __version__ = "1.0.1"
@@ -84,14 +86,17 @@ def checkTargetsFile(): #check the validity of the commanded files
     global foldername, targetFiles
     logging.info("check target file")
     if args.fileToProcess:
-        foldername=args.fileToProcess
-        ind = foldername.rfind("/")
-        filename = foldername[ind+1:len(foldername)]
-        ind_dot = foldername.rfind(".")
-        file_tail = foldername[ind_dot+1:len(foldername)]
-        targetFiles=foldername[0:ind_dot]+".cutoffFiltered."+file_tail
+        foldername=compressedIO.resolvePath(args.fileToProcess)
+        # keep the compression extension (if any) out of the file tail
+        # so the filtered file is written in the same format as the input
+        basename, compressionExt = compressedIO.splitCompressionExtension(foldername)
+        ind = basename.rfind("/")
+        filename = basename[ind+1:len(basename)]
+        ind_dot = basename.rfind(".")
+        file_tail = basename[ind_dot+1:len(basename)]
+        targetFiles=basename[0:ind_dot]+".cutoffFiltered."+file_tail+compressionExt
         if not os.path.isfile(foldername):
-            logging.error("--can't find sites file at <" + file + ">")
+            logging.error("--can't find sites file at <" + foldername + ">")
             exit()
     logging.info("--OK")  
 
@@ -128,11 +133,11 @@ def cutoffFiltering(col,cutoff):
     logging.info("Cutoff process")
 
     global foldername, targetFiles
-    with open(foldername, 'r') as fin:
+    with compressedIO.openFile(foldername, 'r') as fin:
         reader = csv.reader(fin, delimiter='\t')
-        with open(targetFiles, 'w') as fout:
+        with compressedIO.openFile(targetFiles, 'w') as fout:
             writer = csv.writer(fout, delimiter='\t')
-            head = reader.next()
+            head = next(reader)
             writer.writerow(head)
             writer.writerows([row for row in reader if all(abs(float(row[col[index]]))>=cutoff[index] for index in range(0,len(col)))])
     logging.info("--done")  
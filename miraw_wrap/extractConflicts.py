@@ -21,6 +21,8 @@ import csv
 import datetime
 import re
 
+import compressedIO
+
 __author__ = "Yafei Xing"
 __copyright__ = "Copyright 2018, AMG-OUS"
 __version__ = "1.0.1"
@@ -78,7 +80,7 @@ def checkTargetsFile(): #check the validity of the commanded files
         ind = foldername.rfind("/")
         filename = foldername[ind:len(foldername)]
         path_filename = foldername + filename
-        targetFiles = [path_filename + tail + '.csv' for tail in file_tail]
+        targetFiles = [compressedIO.resolvePath(path_filename + tail + '.csv') for tail in file_tail]
         for file in targetFiles:
             if not os.path.isfile(file):
                 logging.error("--can't find sites file at <" + file + ">")
@@ -101,9 +103,9 @@ def checkSummary(): #check the prediction summary file to extract conflicted obs
     # 0            1        2       3           4               5               6           7           8
     logging.info("check the summary file")
     global conflictCount, genelist, mirnalist, targetFiles
-    with open(targetFiles[0], 'r') as fin:
+    with compressedIO.openFile(targetFiles[0], 'r') as fin:
         reader = csv.reader(fin, delimiter='\t')
-        reader.next()
+        next(reader)
         for row in reader:
             if int(row[6])>0 and int(row[7])>0:
                 conflictCount = conflictCount+1
@@ -119,16 +121,16 @@ def processFiles(): #remove conflicts in the prediction target files and save th
     logging.info("process all target files")
     global targetFiles, genelist, mirnalist, path_filename, conflictCount
     for i in range(1,4):
-        with open(targetFiles[i], 'r') as fin:
+        with compressedIO.openFile(targetFiles[i], 'r') as fin:
             reader = csv.reader(fin, delimiter='\t')
-            head = reader.next()
-            filename = path_filename+file_tail[i]+".withoutConflicts.csv"
-            fout = open(filename, 'w')
+            head = next(reader)
+            filename = compressedIO.deriveOutputPath(targetFiles[i], path_filename+file_tail[i]+".withoutConflicts.csv")
+            fout = compressedIO.openFile(filename, 'w')
             writer = csv.writer(fout, delimiter='\t')               
             writer.writerow(head)
             if i == 1: #for saving the conflicts
-                filename_add = path_filename+file_tail[i]+".onlyConflicts.csv"
-                f_add = open(filename_add, 'w')
+                filename_add = compressedIO.deriveOutputPath(targetFiles[i], path_filename+file_tail[i]+".onlyConflicts.csv")
+                f_add = compressedIO.openFile(filename_add, 'w')
                 writer_add = csv.writer(f_add, delimiter='\t')
                 writer_add.writerow(head)
             
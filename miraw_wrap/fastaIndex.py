@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Select records from a large fasta file through an offset index
+
+    recordFilter = fastaIndex.RecordFilter(prefixes=["ENSG"], names=readNameList("genes.txt"))
+    for name, description, seq in fastaIndex.selectRecords("ensembl_3utrs.fa", recordFilter):
+
+The first time a fasta file is used, an index in the style of samtools
+faidx is written next to it (<fasta>.fidx). It has one line per record
+
+    NAME    LENGTH  OFFSET  BYTES   DESCRIPTION
+
+the record id, the sequence length, the byte offset of the '>' line and
+the number of bytes up to the next record, and the rest of the '>' line.
+The filters are applied to the index, and only the selected records are
+read from the fasta file, so taking 500 3'UTRs from a 100k record file
+doesn't parse the other 99,500. The size and modification time of the
+fasta file are stored in the index, and the index is rebuilt when they
+change. If the index can't be written next to the file, or writing is
+switched off (saveIndex=False, as in a miRAWbatch dry run), it is kept in
+memory for the run.
+
+the filters, a record has to pass each of the filters that is given
+  prefixes  the record id starts with one of these (e.g. hsa- or ENSG)
+  names     the record id, or one of its '|' separated fields, or a word of
+            the description is in the list (e.g. miRNA or gene names)
+  regex     the regular expression is found in the '>' line
+
+Compressed fasta files can't be read at an offset; they are read from
+start to end with the same filters.
+"""
+
+import os
+import re
+import logging
+import tempfile
+
+import compressedIO
+import fastaReader
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+INDEX_EXTENSION = ".fidx"
+INDEX_COLUMNS = ["NAME", "LENGTH", "OFFSET", "BYTES", "DESCRIPTION"]
+# change this when the index layout changes, so old indexes are rebuilt
+INDEX_VERSION = "1"
+FIELD_SEPARATOR = "|"
+
+
+class IndexEntry(object):
+    '''one record in the index'''
+
+    __slots__ = ["name", "length", "offset", "size", "description"]
+
+    def __init__(self, name, length, offset, size, description):
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.size = size
+        self.description = description
+
+
+def fileSignature(fastaFile):
+    '''what the index records about the fasta file, to tell when it changed'''
+    status = os.stat(fastaFile)
+    return {"version": INDEX_VERSION, "size": str(status.st_size), "mtime": str(status.st_mtime_ns)}
+
+
+def indexPath(fastaFile):
+    return fastaFile + INDEX_EXTENSION
+
+
+def splitHeader(line):
+    '''(id, description) of a '>' line'''
+    fields = line[1:].strip().split(None, 1)
+    if not fields:
+        return "", ""
+    return fields[0], fields[1] if len(fields) > 1 else ""
+
+
+def scanFasta(fastaFile):
+    '''build the index entries by reading the file once'''
+    entries = []
+    offset = 0
+    current = None
+    with open(fastaFile, 'rb') as fIn:
+        for line in fIn:
+            if line.startswith(b">"):
+                if current is not None:
+                    current.size = offset - current.offset
+                    entries.append(current)
+                name, description = splitHeader(line.decode())
+                current = IndexEntry(name, 0, offset, 0, description)
+            elif current is not None:
+                current.length += len(line.strip())
+            offset += len(line)
+    if current is not None:
+        current.size = offset - current.offset
+        entries.append(current)
+    return entries
+
+
+def writeIndex(fastaFile, entries, signature):
+    indexFile = indexPath(fastaFile)
+    # write to a temporary file first, so parallel runs never read a partial index
+    fd, tmpFile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(indexFile)), suffix=INDEX_EXTENSION + ".tmp")
+    with os.fdopen(fd, 'w') as fIdx:
+        for key in sorted(signature):
+            fIdx.write("#" + key + "=" + signature[key] + "\n")
+        fIdx.write("\t".join(INDEX_COLUMNS) + "\n")
+        for entry in entries:
+            fIdx.write("\t".join([entry.name, str(entry.length), str(entry.offset), str(entry.size),
+                                  entry.description.replace("\t", " ")]) + "\n")
+    os.replace(tmpFile, indexFile)
+
+
+def readIndex(fastaFile, signature):
+    '''the index entries, None if there is no index or it is out of date'''
+    indexFile = indexPath(fastaFile)
+    if not os.path.isfile(indexFile):
+        return None
+    stored = {}
+    entries = []
+    with open(indexFile, 'r') as fIdx:
+        line = fIdx.readline()
+        while line.startswith("#"):
+            key, _, value = line[1:].rstrip("\n").partition("=")
+            stored[key] = value
+            line = fIdx.readline()
+        if stored != signature:
+            return None
+        # line is the column header
+        for line in fIdx:
+            name, length, offset, size, description = line.rstrip("\n").split("\t", 4)
+            entries.append(IndexEntry(name, int(length), int(offset), int(size), description))
+    return entries
+
+
+def loadIndex(fastaFile, write=True):
+    '''
+    the index entries of a plain fasta file, (re)building the index if needed.
+    With write=False a new index isn't saved next to the fasta file
+    '''
+    signature = fileSignature(fastaFile)
+    entries = readIndex(fastaFile, signature)
+    if entries is not None:
+        return entries
+    logging.info("--indexing <" + fastaFile + ">")
+    entries = scanFasta(fastaFile)
+    if not write:
+        logging.info("----kept the index for <" + str(len(entries)) + "> records in memory, nothing written")
+        return entries
+    try:
+        writeIndex(fastaFile, entries, signature)
+        logging.info("----wrote index for <" + str(len(entries)) + "> records to <" + indexPath(fastaFile) + ">")
+    except (IOError, OSError) as e:
+        logging.warning("----can't write the index (" + str(e) + "), it is rebuilt on the next run")
+    return entries
+
+
+def readNameList(listFile):
+    '''the names in a list file, one per line (anything after the first tab or space is ignored)'''
+    names = set()
+    with compressedIO.openFile(listFile, 'r') as fList:
+        for line in fList:
+            fields = line.split()
+            if fields and not fields[0].startswith("#"):
+                names.add(fields[0])
+    return names
+
+
+class RecordFilter(object):
+    '''the prefix, name list and regex filters'''
+
+    def __init__(self, prefixes=None, names=None, regex=None):
+        self.prefixes = tuple(prefixes) if prefixes else None
+        self.names = set(names) if names else None
+        self.regex = re.compile(regex) if regex else None
+
+    def active(self):
+        return bool(self.prefixes or self.names or self.regex)
+
+    def matches(self, name, description):
+        if self.prefixes and not name.startswith(self.prefixes):
+            return False
+        if self.names:
+            keys = set([name]) | set(name.split(FIELD_SEPARATOR)) | set(description.replace(FIELD_SEPARATOR, " ").split())
+            if not keys & self.names:
+                return False
+        if self.regex and not self.regex.search((name + " " + description).strip()):
+            return False
+        return True
+
+
+def selectRecords(fastaFile, recordFilter, saveIndex=True):
+    '''
+    (id, description, sequence) of the records that pass the RecordFilter,
+    in the order of the file. Plain files are read through the index, which
+    is only saved next to the file if saveIndex is set
+    '''
+    fastaFile = compressedIO.resolvePath(fastaFile)
+    if compressedIO.compressionType(fastaFile) is not compressedIO.COMPRESSION_NONE:
+        for name, description, seq in fastaReader.readFasta(fastaFile):
+            if recordFilter.matches(name, description):
+                yield name, description, seq
+        return
+
+    entries = [entry for entry in loadIndex(fastaFile, saveIndex)
+               if recordFilter.matches(entry.name, entry.description)]
+    with open(fastaFile, 'rb') as fIn:
+        for entry in entries:
+            fIn.seek(entry.offset)
+            # the block starts with the '>' of the record
+            yield fastaReader.parseRecord(fIn.read(entry.size)[1:])
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read fasta files without Biopython
+
+    for name, description, seq in fastaReader.readFasta("mature.fa"):
+        ...
+
+yields (id, description, sequence) for each record: the id is the first
+word of the '>' line, the description the rest of it, and the sequence has
+all line breaks and spaces removed, i.e. record.id and str(record.seq) of
+Bio.SeqIO. The file (plain or compressed, see compressedIO.py) is read in
+blocks of bytes that are cut into records at each '\\n>', so there is no
+per-line work and no SeqRecord objects are built.
+
+Biopython is only needed as a fallback: set MIRAW_FASTA_PARSER=biopython
+(or pass parser="biopython") to read the records with Bio.SeqIO instead,
+e.g. for a file the native parser gets wrong.
+
+benchmark the native parser against Bio.SeqIO (import time included)
+
+    python fastaReader.py -f ensembl_3utrs.fa -r 3
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import subprocess
+import importlib.util
+
+import compressedIO
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+PARSER_NATIVE = "native"
+PARSER_BIOPYTHON = "biopython"
+PARSERS = [PARSER_NATIVE, PARSER_BIOPYTHON]
+DEFAULT_PARSER = os.environ.get("MIRAW_FASTA_PARSER", PARSER_NATIVE)
+BLOCK_SIZE = 1 << 20
+RECORD_SEPARATOR = b"\n>"
+# removed from the sequence lines
+SEQUENCE_WHITESPACE = b" \t\r\n"
+FASTA_LINE_WIDTH = 60
+
+
+def hasBiopython():
+    return importlib.util.find_spec("Bio") is not None
+
+
+def parseRecord(data):
+    '''(id, description, sequence) of the bytes of one record, without the leading '>' '''
+    header, _, body = data.partition(b"\n")
+    fields = header.strip().split(None, 1)
+    name = fields[0].decode() if fields else ""
+    description = fields[1].decode() if len(fields) > 1 else ""
+    return name, description, body.translate(None, SEQUENCE_WHITESPACE).decode()
+
+
+def parseFasta(fIn, blockSize=BLOCK_SIZE):
+    '''(id, description, sequence) for each record in a binary file object'''
+    # the leading newline makes the first '>' a separator too; anything
+    # before it is not part of a record
+    pending = [b"\n"]
+    preamble = True
+    for block in iter(lambda: fIn.read(blockSize), b""):
+        # a block inside a long record is only collected, so long records
+        # aren't joined again for every block
+        if RECORD_SEPARATOR not in block and not (block.startswith(b">") and pending[-1].endswith(b"\n")):
+            pending.append(block)
+            continue
+        pieces = (b"".join(pending) + block).split(RECORD_SEPARATOR)
+        pending = [pieces.pop()]
+        if preamble:
+            pieces = pieces[1:]
+            preamble = False
+        for piece in pieces:
+            yield parseRecord(piece)
+    if not preamble:
+        yield parseRecord(b"".join(pending))
+
+
+def readFasta(fastaFile, parser=None):
+    '''(id, description, sequence) for each record of a plain or compressed fasta file'''
+    parser = parser or DEFAULT_PARSER
+    if parser == PARSER_BIOPYTHON:
+        # only imported for the fallback, importing Biopython is slow
+        from Bio import SeqIO
+        with compressedIO.openFile(fastaFile, 'r') as fIn:
+            for record in SeqIO.parse(fIn, 'fasta'):
+                description = record.description
+                if description.startswith(record.id):
+                    description = description[len(record.id):].strip()
+                yield record.id, description, str(record.seq)
+        return
+    if parser != PARSER_NATIVE:
+        raise ValueError("unknown fasta parser <" + parser + ">, use one of " + ", ".join(PARSERS))
+    with compressedIO.openFile(fastaFile, 'rb') as fIn:
+        for record in parseFasta(fIn):
+            yield record
+
+
+def writeFasta(records, fOut, width=FASTA_LINE_WIDTH):
+    '''write (id, description, sequence) records to a text file object, as Bio.SeqIO does'''
+    for name, description, seq in records:
+        fOut.write(">" + (name + " " + description if description else name) + "\n")
+        for start in range(0, len(seq), width):
+            fOut.write(seq[start:start + width] + "\n")
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='benchmark the native fasta parser against Bio.SeqIO')
+
+    parser.add_argument("-f", "--fastaFile", dest='fastaFile',
+                        help="fasta file to read (plain or compressed)")
+    parser.add_argument("-r", "--repeats", dest='repeats', type=int, default=3,
+                        help="number of times each parser reads the file [default: %(default)s]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking fasta file:")
+    if not args.fastaFile:
+        logging.error("----you need to specify a fasta file using the -f/--fastaFile parameter")
+        printHelpAndExit()
+    if not compressedIO.fileExists(args.fastaFile):
+        logging.error("--can't find <" + args.fastaFile + ">")
+        sys.exit(1)
+    if args.repeats < 1:
+        logging.error("--the number of repeats (-r) needs to be at least 1")
+        sys.exit(1)
+    logging.info("--OK")
+
+
+def importTime(module):
+    '''seconds to import a module in a new interpreter'''
+    command = ("import time; start = time.perf_counter(); import " + module
+               + "; print(time.perf_counter() - start)")
+    completed = subprocess.run([sys.executable, "-c", command], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if completed.returncode != 0:
+        return None
+    return float(completed.stdout.decode().strip())
+
+
+def timeParser(fastaFile, parserName, repeats):
+    '''(fastest time to read the file, records, residues)'''
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        records = 0
+        residues = 0
+        for name, description, seq in readFasta(fastaFile, parserName):
+            records += 1
+            residues += len(seq)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, records, residues
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    parsers = [(PARSER_NATIVE, "fastaReader")]
+    if not hasBiopython():
+        logging.warning("biopython is not installed, only timing the native parser")
+    else:
+        parsers.append((PARSER_BIOPYTHON, "Bio.SeqIO"))
+
+    times = {}
+    for parserName, module in parsers:
+        imported = importTime(module)
+        elapsed, records, residues = timeParser(args.fastaFile, parserName, args.repeats)
+        times[parserName] = elapsed + (imported or 0.0)
+        logging.info(parserName + "\timport " + ("{:.3f}".format(imported) + "s" if imported is not None else "?")
+                     + "\tread " + "{:.3f}".format(elapsed) + "s\t" + str(records) + " records\t"
+                     + "{:.1f}".format(residues / elapsed / 1e6 if elapsed else 0.0) + " Mnt/s")
+
+    if hasBiopython():
+        same = all(a == b for a, b in zip(readFasta(args.fastaFile, PARSER_NATIVE),
+                                          readFasta(args.fastaFile, PARSER_BIOPYTHON)))
+        same = same and (sum(1 for _ in readFasta(args.fastaFile, PARSER_NATIVE))
+                         == sum(1 for _ in readFasta(args.fastaFile, PARSER_BIOPYTHON)))
+        logging.info("import + read: native is x" + "{:.1f}".format(times[PARSER_BIOPYTHON] / times[PARSER_NATIVE])
+                     + " faster than Bio.SeqIO")
+        if not same:
+            logging.error("the parsers return different records")
+            return 1
+        logging.info("both parsers return the same records")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -33,6 +33,11 @@ from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 from Bio.Data.CodonTable import list_possible_proteins
 
+import compressedIO
+import stageProfiler
+import interactionMatrix
+import targetEnrichment
+
 
 __all__ = []
 __version__ = 0.1
@@ -41,7 +46,11 @@ __updated__ = '2020-12-19'
 
 DEBUG = 1
 TESTRUN = 0
-PROFILE = 0
+
+# q-value cut-off used for the enrichment summary in the log
+ENRICHMENT_FDR = 0.05
+
+pooledInteractions = None
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
@@ -81,6 +90,7 @@ def initLogger(md5string):
     logging.info("project log file is <" + logfileName + ">")         
     logging.info("+" + "*"*78 + "+")   
     logging.debug("debug mode is on")
+    return logfileName
     
 
 def parseArgs(argv):
@@ -117,6 +127,11 @@ def parseArgs(argv):
         parser.add_argument("-d", "--downregulated", dest="downregulated", action="store", help="list of upregulated proteins [default: %(default)s]")
         parser.add_argument("-p", "--probability", dest="probability", action="store", help="cut-off for min probability [default: %(default)s]")
         parser.add_argument("-e", "--energy", dest="energy", action="store", help="cut-off for min binding energy [default: %(default)s]")
+        parser.add_argument("-N", "--network", action="store_true", help="also write the pooled predictions as a sparse miRNA x gene matrix, degree tables, a Cytoscape edge list and a GraphML file")
+        parser.add_argument("-c", "--cotargets", dest="cotargets", action="store", type=int, help="with -N, write miRNA pairs sharing at least this many target genes [default: %(default)s]")
+        parser.add_argument("-t", "--enrichment", dest="enrichment", action="store", choices=targetEnrichment.TESTS, help="test each miRNA's targets for enrichment of the up/down-regulated proteins [default: %(default)s]")
+        parser.add_argument("--profile", action="store_true", help="write per stage timing and memory use to a .profile.json file in logfiles")
+        parser.add_argument("--cprofile", action="store_true", help="as --profile, and also dump cProfile stats for each stage")
         parser.add_argument("-H", "--HelpMe", action="store_true", help="print detailed help")
 
         # Process arguments
@@ -133,10 +148,21 @@ def parseArgs(argv):
         global downregulatedProtFile
         global probability
         global energy 
+        global profileRun
+        global cProfileRun
+        global networkRun
+        global minCoTargets
+        global enrichmentTest
+        
+        networkRun = args.network
+        minCoTargets = args.cotargets
+        profileRun = args.profile or args.cprofile
+        cProfileRun = args.cprofile
         
         
         if args.resultfiles:
-            resultfiles = args.resultfiles
+            # output file names are built from this, so drop any compression extension
+            resultfiles = compressedIO.splitCompressionExtension(args.resultfiles)[0]
             print("miRAW results file list is <" + resultfiles + ">")
         else:
             print("----you need to specify an miRAW results filelist using the -r/----resultfiles parameter") 
@@ -181,6 +207,14 @@ def parseArgs(argv):
             probability = 0.0
             print("no minimum energy threshold specified")
             
+            
+        enrichmentTest = args.enrichment
+        if enrichmentTest:
+            if upregulatedProtFile == "NONE" and downregulatedProtFile == "NONE":
+                print("----the -t/--enrichment test needs an up- and/or down-regulated protein list (-u/-d)")
+                printHelpAndExit()
+            print("testing the targets of each miRNA for enrichment (" + enrichmentTest + " test)")
+            
 
     except KeyboardInterrupt:
         ### handle keyboard interrupt ###
@@ -196,6 +230,7 @@ def parseArgs(argv):
 
 
 
+@stageProfiler.stage
 def loadFeatureList():
 
     global dfFeatureList
@@ -210,12 +245,16 @@ def loadFeatureList():
         featureList = fFL.read().splitlines()
     
     logging.info("read <" + str(len(featureList)) + "> features")
+    stageProfiler.addRows(len(featureList))
 
     
+@stageProfiler.stage
 def mergeMiRNAData():
 
     global dfMiRsVsProteins
     global proteins
+    global upProteins
+    global downProteins
     upProteins = []
     downProteins = []
     proteins = []
@@ -249,6 +288,7 @@ def mergeMiRNAData():
         dfMiRsVsProteins = dfMiRsVsProteins.drop([0], axis=1)
         logging.info("done")
     
+@stageProfiler.stage
 def loadGroupPredictionData():
     
     # INDEX    CHANGE    FILE
@@ -283,7 +323,7 @@ def loadGroupPredictionData():
     logging.info("processing target files")
     targetFiles=[]
     
-    miRNAs=pd.read_csv(resultfiles, sep='\t')
+    miRNAs=compressedIO.readTable(resultfiles, sep='\t')
     miRNAs['miRName']='unknown'
     for index, row in miRNAs.iterrows():
         miRNAs.at[index, 'miRName'] = row['CHANGE'] + "__" + str(row['INDEX']) + "__" + os.path.basename(Path(row['FILE']).parents[0]).split('.')[1]
@@ -296,8 +336,10 @@ def loadGroupPredictionData():
     #        targetFiles.append(targetFile[0])
     #        miRNames.append(os.path.basename(Path(targetFile[0]).parents[0]).split('.')[1])
     logging.info("found <" + str(len(miRNAs))  + "> samples")
+    stageProfiler.addRows(len(miRNAs))
         
 
+@stageProfiler.stage
 def processSamplesByDMR():
     # read target list
     # loop through target list
@@ -317,6 +359,7 @@ def processSamplesByDMR():
     
     outputFileAllPreds = os.path.splitext(resultfiles)[0] + "_allfiltered.tsv" 
     allPreds.to_csv(outputFileAllPreds, sep='\t')
+    stageProfiler.addRows(len(allPreds))
              
              
     # format the filtered predictions for network analysis    
@@ -368,6 +411,70 @@ def processSamplesByDMR():
     
     
 
+def pooledInteractionMatrix():
+    '''miRNA x gene site counts of the pooled predictions, built once'''
+    global pooledInteractions
+    if pooledInteractions is None:
+        pooledInteractions = interactionMatrix.InteractionMatrix.fromPredictions(allPreds['shortmiRName'], allPreds['shortGeneName'])
+    return pooledInteractions
+    
+    
+    
+@stageProfiler.stage
+def writeInteractionNetwork():
+    '''
+    write the pooled predictions as a sparse miRNA x gene matrix of site counts, with
+    degree tables and edge lists for network tools
+    '''
+    outputPrefix = os.path.splitext(resultfiles)[0]
+    interactions = pooledInteractionMatrix()
+    logging.info("interaction matrix has <" + str(interactions.shape[0]) + "> miRNAs x <" + str(interactions.shape[1]) 
+                 + "> genes and <" + str(interactions.nnz) + "> interactions")
+    stageProfiler.addRows(interactions.nnz)
+    for matrixFile in interactions.save(outputPrefix):
+        logging.info("--wrote <" + matrixFile + ">")
+    
+    interactions.miRNADegree().to_csv(outputPrefix + "_miRNADegree.tsv", sep='\t')
+    interactions.geneDegree().to_csv(outputPrefix + "_geneDegree.tsv", sep='\t')
+    
+    edgeFile = outputPrefix + "_edges.tsv"
+    edges = interactionMatrix.writeEdgeList(interactions.edgeBlocks(), edgeFile)
+    logging.info("--wrote <" + str(edges) + "> edges to <" + edgeFile + ">")
+    graphmlFile = outputPrefix + ".graphml"
+    interactionMatrix.writeGraphML(interactions, graphmlFile)
+    logging.info("--wrote network to <" + graphmlFile + ">")
+    
+    if minCoTargets:
+        coTargetFile = outputPrefix + "_miRNACoTargets.tsv"
+        edges = interactionMatrix.writeEdgeList(interactions.projectionEdges(axis=0, minShared=minCoTargets), coTargetFile,
+                                                interaction=interactionMatrix.COTARGET_INTERACTION, weight="sharedGenes")
+        logging.info("--wrote <" + str(edges) + "> miRNA pairs sharing at least <" + str(minCoTargets) 
+                     + "> genes to <" + coTargetFile + ">")
+    
+    
+    
+@stageProfiler.stage
+def testTargetEnrichment():
+    '''
+    test the targets of each miRNA for enrichment of the up- and down-regulated proteins
+    and write one table ranked by p-value for each protein list
+    '''
+    interactions = pooledInteractionMatrix()
+    stageProfiler.addRows(interactions.shape[0])
+    for listName, listProteins in (("Up", upProteins), ("Down", downProteins)):
+        if not listProteins:
+            continue
+        inSet = targetEnrichment.geneSetMask(interactions.genes, listProteins)
+        logging.info(listName.lower() + "-regulated proteins: <" + str(inSet.sum()) + "> of <" + str(len(listProteins)) 
+                     + "> found among <" + str(len(inSet)) + "> target genes")
+        dfEnrichment = targetEnrichment.enrichment(interactions, inSet, enrichmentTest)
+        enrichmentFile = os.path.splitext(resultfiles)[0] + "_enrichment" + listName + ".tsv"
+        dfEnrichment.to_csv(enrichmentFile, sep='\t', index=False)
+        logging.info("--<" + str((dfEnrichment['qValue'] < ENRICHMENT_FDR).sum()) + "> miRNAs with q < " 
+                     + str(ENRICHMENT_FDR) + ", written to <" + enrichmentFile + ">")
+    
+    
+    
              
 def processPredictionFile(predFile, miRName):
     global allPreds
@@ -375,7 +482,7 @@ def processPredictionFile(predFile, miRName):
 
     # read target predictions and filter by probability and energy
     logging.info("miR <" + miRName + "> " )
-    preds = pd.read_csv(predFile, sep='\t')
+    preds = compressedIO.readTable(predFile, sep='\t')
     logging.info("--read <" + str(len(preds)) + "> lines" )
     predsFilter = preds[(preds['FreeEnergy']<float(energy)) & (preds['Prediction']>float(probability))]
     logging.info("--after processing,  <" + str(len(predsFilter)) + "> lines remain" )
@@ -440,6 +547,27 @@ def printLongHelpAndExit():
     logging.info("+                  from matching experimental data                             +")
     logging.info("+                                                                              +")
     logging.info("+                                                                              +")
+    logging.info("+           --profile                                                          +")
+    logging.info("+                write wall/cpu time, peak memory and rows processed           +")
+    logging.info("+                  for each stage to logfiles/<logfile>.profile.json           +")
+    logging.info("+                  (--cprofile also dumps cProfile stats for each stage)       +")
+    logging.info("+                                                                              +")
+    logging.info("+           --network                                                          +")
+    logging.info("+                write the pooled predictions as a sparse miRNA x gene matrix  +")
+    logging.info("+                  of site counts (_interactions.npz, _miRNAIDs.tsv and        +")
+    logging.info("+                  _geneIDs.tsv), miRNA and gene degrees, a Cytoscape edge     +")
+    logging.info("+                  list (_edges.tsv) and a GraphML file                        +")
+    logging.info("+                                                                              +")
+    logging.info("+           --cotargets                                                        +")
+    logging.info("+                with --network, write the miRNA pairs that share at least     +")
+    logging.info("+                  this number of target genes (_miRNACoTargets.tsv)           +")
+    logging.info("+                                                                              +")
+    logging.info("+           --enrichment                                                       +")
+    logging.info("+                hypergeometric or fisher. Test the targets of each miRNA      +")
+    logging.info("+                  for enrichment of the up/down-regulated proteins            +")
+    logging.info("+                  and write the p- and BH q-values ranked by p-value to       +")
+    logging.info("+                  _enrichmentUp.tsv and _enrichmentDown.tsv                   +")
+    logging.info("+                                                                              +")
     logging.info("+      The output files will be                                                +")
     logging.info("+                                                                              +")    
     logging.info("+                                                                              +")
@@ -461,13 +589,21 @@ def main(argv=None): # IGNORE:C0111
 
     md5String = hashlib.md5(b"CBGAMGOUS").hexdigest()
     parseArgs(argv)
-    initLogger(md5String)
+    logfileName = initLogger(md5String)
+    if profileRun:
+        stageProfiler.enable(logfileName, cprofile=cProfileRun)
     loadGroupPredictionData()
     loadFeatureList()
     mergeMiRNAData()
     processSamplesByDMR()
-    
-
+    if networkRun:
+        writeInteractionNetwork()
+    if enrichmentTest:
+        testTargetEnrichment()
+    
+    reportFile = stageProfiler.writeReport()
+    if reportFile:
+        logging.info("profile written to <" + reportFile + ">")
     logging.info("finished")
 
 if __name__ == "__main__":
@@ -479,17 +615,6 @@ if __name__ == "__main__":
     if TESTRUN:
         import doctest
         doctest.testmod()
-    if PROFILE:
-        import cProfile
-        import pstats
-        profile_filename = 'fairpype.virusPipe_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
-        sys.exit(0)
     sys.exit(main())
     
 
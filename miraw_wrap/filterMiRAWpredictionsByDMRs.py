@@ -19,6 +19,7 @@ import os
 from datetime import datetime
 import hashlib
 import logging
+import multiprocessing
 
 import pandas as pd
 import numpy as np
@@ -33,6 +34,10 @@ from plotnine.data import *
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 
+import compressedIO
+import stageProfiler
+import annotationCache
+
 
 
 __all__ = []
@@ -42,7 +47,6 @@ __updated__ = '2020-12-19'
 
 DEBUG = 1
 TESTRUN = 0
-PROFILE = 0
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
@@ -82,6 +86,7 @@ def initLogger(md5string):
     logging.info("project log file is <" + logfileName + ">")         
     logging.info("+" + "*"*78 + "+")   
     logging.debug("debug mode is on")
+    return logfileName
     
 
 def parseArgs(argv):
@@ -125,6 +130,20 @@ def parseArgs(argv):
         parser.add_argument("-D", "--featuredistance", dest="featuredistance", action="store", 
                             help="minimum distance between miRNA and DMR in nucleotides [default: %(default)s]")
 
+        parser.add_argument("-M", "--dmrsamplelist", dest="dmrsamplelist", action="store", 
+                            help="file listing one DMR file (or sample name<tab>DMR file) per line, used instead of -d [default: %(default)s]")
+        parser.add_argument("-j", "--jobs", dest="jobs", action="store", type=int, default=os.cpu_count(), 
+                            help="number of processes for -M [default: %(default)s]")
+        parser.add_argument("-S", "--distancesweep", dest="distancesweep", action="store", 
+                            help="comma separated list of distances: write DMR hits and category statistics for each distance to a single table [default: %(default)s]")
+        parser.add_argument("-C", "--cachefolder", dest="cachefolder", action="store", 
+                            help="folder for parsed GFF3/SNV tables [default: ./" + annotationCache.CACHE_FOLDER_NAME + "]")
+        parser.add_argument("--nocache", action="store_true", 
+                            help="always parse the GFF3 and SNV files, don't use the cache")
+        parser.add_argument("--profile", action="store_true", 
+                            help="write per stage timing and memory use to a .profile.json file in logfiles")
+        parser.add_argument("--cprofile", action="store_true", 
+                            help="as --profile, and also dump cProfile stats for each stage")
         parser.add_argument("-H", "--HelpMe", action="store_true", 
                             help="print detailed help")
 
@@ -140,14 +159,31 @@ def parseArgs(argv):
         global miRBaseGFF3File
         global upregulatedProtFile
         global dmrPosFile
+        global dmrSampleListFile
+        global dmrJobs
         global featureDistance
+        global featureDistances
         global threeUTRSNVFile
         global mirSNVFile
+        global profileRun
+        global cProfileRun
+        global annotationCacheFolder
+        
+        profileRun = args.profile or args.cprofile
+        cProfileRun = args.cprofile
+
+        if args.nocache:
+            annotationCacheFolder = None
+            print("annotation cache is off")
+        else:
+            annotationCacheFolder = args.cachefolder or os.path.join(os.getcwd(), annotationCache.CACHE_FOLDER_NAME)
+            print("annotation cache folder is <" + annotationCacheFolder + ">")
 
         
         
         if args.groupedpredsfile:
-            groupedpredsFile = args.groupedpredsfile
+            # output file names are built from this, so drop any compression extension
+            groupedpredsFile = compressedIO.splitCompressionExtension(args.groupedpredsfile)[0]
             print("grouped miRAW prediction file is <" + groupedpredsFile + ">")
         else:
             print("----you need to specify a grouped miRAW prediction file using the -g/--groupedpredsfile parameter") 
@@ -162,7 +198,16 @@ def parseArgs(argv):
             printHelpAndExit()        
 
 
-        if args.dmrposfile:
+        dmrSampleListFile = None
+        dmrJobs = max(1, args.jobs or 1)
+        if args.dmrsamplelist:
+            dmrSampleListFile = args.dmrsamplelist
+            dmrPosFile = None
+            print("DMR sample list is <" + dmrSampleListFile + ">, using <" + str(dmrJobs) + "> processes")
+            if args.distancesweep:
+                print("----the -M/--dmrsamplelist and -S/--distancesweep parameters can't be used together")
+                printHelpAndExit()
+        elif args.dmrposfile:
             dmrPosFile = args.dmrposfile
             print("DMR position file is <" + dmrPosFile + ">")
         else:
@@ -186,7 +231,12 @@ def parseArgs(argv):
   
 
             
-        if args.featuredistance:
+        featureDistances = []
+        if args.distancesweep:
+            featureDistances = sorted(set(int(d) for d in args.distancesweep.split(",")))
+            featureDistance = None
+            print("sweeping feature spacing over <" + ",".join(str(d) for d in featureDistances) + ">")
+        elif args.featuredistance:
             featureDistance = args.featuredistance
             print("minimum feature spacing set to <" + featureDistance + ">")
         else:
@@ -209,18 +259,48 @@ def parseArgs(argv):
 
 
 
+@stageProfiler.stage
 def loadDMRFeatureList():
 
     global dfDMRFeatureList   
         
     logging.info("loading DMR feature list file <" + dmrPosFile + ">")
-    dfDMRFeatureList = pd.read_csv(dmrPosFile, sep="\t", skiprows=3)
+    dfDMRFeatureList = compressedIO.readTable(dmrPosFile, sep="\t", skiprows=3)
     
     logging.info("read <" + str(len(dfDMRFeatureList)) + "> features")
+    stageProfiler.addRows(len(dfDMRFeatureList))
+
+
+
+def parseMiRBaseGFF3(gff3File):
+    '''
+    returns the mature miRNA features (with MIMATID and the MIID of the pri-miRNA)
+    and the pri-miRNA features (with MIID) in a miRBase GFF3 file
+    '''
+    miRBaseMiRFeatureList = compressedIO.readTable(gff3File, sep="\t", skiprows=14)
+    miRBaseMiRFeatureList.columns = ["chr", "col2", "featureType", "featureStart", 
+                                  "featureStop", "col6", "strand", "col8", "Attributes"]
+    miRBasePreMiRFeatureList=miRBaseMiRFeatureList[miRBaseMiRFeatureList['featureType'] == "miRNA_primary_transcript"].copy()
+    miRBasePreMiRFeatureList["MIID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[0].str.split("=").str[1]
+
+    # we need the MIID to match the SNV information in 'mergeMiRNAData'
+    miRBaseMiRFeatureList=miRBaseMiRFeatureList[miRBaseMiRFeatureList['featureType'] == "miRNA"].copy()
+    miRBaseMiRFeatureList["MIMATID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[0].str.split("=").str[1]
+    miRBaseMiRFeatureList["MIID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[3].str.split("=").str[1]
+    return miRBaseMiRFeatureList, miRBasePreMiRFeatureList
+
+
+
+def parseSNVTable(snvFile):
+    '''SNV table with the start position from the LOC column (chr:start-end) as featureStart'''
+    dfSNVData = compressedIO.readTable(snvFile, sep="\t")
+    dfSNVData["featureStart"]=pd.to_numeric(dfSNVData["LOC"].str.split(":").str[1].str.split("-").str[0])
+    return dfSNVData
 
 
 
  
+@stageProfiler.stage
 def loadMiRBaseFeatureList():
 
     global miRBaseMiRFeatureList
@@ -228,22 +308,15 @@ def loadMiRBaseFeatureList():
 
         
     logging.info("loading DMR feature list file <" + miRBaseGFF3File + ">")
-    miRBaseMiRFeatureList = pd.read_csv(miRBaseGFF3File, sep="\t", skiprows=14)
-    miRBaseMiRFeatureList.columns = ["chr", "col2", "featureType", "featureStart", 
-                                  "featureStop", "col6", "strand", "col8", "Attributes"]
-    miRBasePreMiRFeatureList=miRBaseMiRFeatureList[miRBaseMiRFeatureList['featureType'] == "miRNA_primary_transcript"]
-    miRBasePreMiRFeatureList["MIID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[0].str.split("=").str[1]
-
-    # we need the MIID to match the SNV information in 'mergeMiRNAData'
-    miRBaseMiRFeatureList=miRBaseMiRFeatureList[miRBaseMiRFeatureList['featureType'] == "miRNA"]
-    miRBaseMiRFeatureList["MIMATID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[0].str.split("=").str[1]
-    miRBaseMiRFeatureList["MIID"]=miRBaseMiRFeatureList["Attributes"].str.split(";").str[3].str.split("=").str[1]
-    
+    miRBaseMiRFeatureList, miRBasePreMiRFeatureList = annotationCache.loadTables(
+        "miRBaseGFF3", miRBaseGFF3File, parseMiRBaseGFF3, annotationCacheFolder)
 
     logging.info("read <" + str(len(miRBaseMiRFeatureList)) + "> miRNA features")
+    stageProfiler.addRows(len(miRBaseMiRFeatureList))
 
     
     
+@stageProfiler.stage
 def loadGroupPredictionData():
     
     # Format
@@ -256,40 +329,44 @@ def loadGroupPredictionData():
     # isos/karlsen_isos.MIMAT0000087_hsa-miR-30a-5p_GTAAACA_iso/allTargetSites.csv
     logging.info("loading group prediction data")
     
-    grpPredData=pd.read_csv(groupedpredsFile, sep='\t')
+    grpPredData=compressedIO.readTable(groupedpredsFile, sep='\t')
     grpPredData['MIMATID']=grpPredData['shortmiRName'].str.split("|").str[1]
         
 
     logging.info("found <" + str(len(grpPredData))  + "> predictions")
+    stageProfiler.addRows(len(grpPredData))
         
         
         
+@stageProfiler.stage
 def load3pUTRSNVData():
     
     logging.info("loading 3'UTR SNV data from <" + threeUTRSNVFile + ">")    
     
     global df3pUTRSNVData
-    df3pUTRSNVData = pd.read_csv(threeUTRSNVFile, sep="\t")
-    df3pUTRSNVData["featureStart"]=pd.to_numeric(df3pUTRSNVData["LOC"].str.split(":").str[1].str.split("-").str[0])
+    df3pUTRSNVData = annotationCache.loadTables("SNVs", threeUTRSNVFile, parseSNVTable, annotationCacheFolder)
     logging.info("found <" + str(len(df3pUTRSNVData)) + "> features")    
+    stageProfiler.addRows(len(df3pUTRSNVData))
     
     logging.info("done")
     
     
     
+@stageProfiler.stage
 def loadmiRNASNVData():
     
     logging.info("loading miRNA SNV data from <" + mirSNVFile + ">")    
     
     global dfmiRNASNVData
-    dfmiRNASNVData = pd.read_csv(mirSNVFile, sep="\t")
-    dfmiRNASNVData["featureStart"]=pd.to_numeric(dfmiRNASNVData["LOC"].str.split(":").str[1].str.split("-").str[0])
+    dfmiRNASNVData = annotationCache.loadTables("SNVs", mirSNVFile, parseSNVTable, annotationCacheFolder)
     logging.info("found <" + str(len(dfmiRNASNVData)) + "> features")    
+    stageProfiler.addRows(len(dfmiRNASNVData))
     
     logging.info("done")
     
     
     
+@stageProfiler.stage
 def mergeMiRNAData():
 
     global dfMiRsPredsPlusPos
@@ -318,6 +395,7 @@ def mergeMiRNAData():
     # from this dataframe, i can use the 
     uniqueFullMiRList = dfFullMiRInfo["MIMATID"].unique()
     logging.info("after merging, we have  <" + str(len(uniqueFullMiRList)) + "> unique miRNAs in the prediction list")
+    stageProfiler.addRows(len(dfFullMiRInfo))
     logging.info("done")
     
     # this information still needs to be merged into the grpPredData dataframe
@@ -325,6 +403,7 @@ def mergeMiRNAData():
     
 
     
+@stageProfiler.stage
 def merge3pUTRData():
 # merge the 3'UTR population SNV file with the list of 3'UTRs present in the prediction list so we have
 # have data frame with a list of all 3'UTRs and their genome coordinates. 
@@ -336,68 +415,141 @@ def merge3pUTRData():
 
     dfFull3pUTRInfo = pd.merge(dfunique3pUTRList, df3pUTRSNVData, how="inner", on=["ENSGID", "ENSGID"])
     logging.info("found <" + str(len(dfFull3pUTRInfo)) + "> unique 3'UTRs in the prediction list")
+    stageProfiler.addRows(len(dfFull3pUTRInfo))
     logging.info("done")
     
     
     
+# population columns of the SNV tables
+SNV_POPULATION_COLUMNS = ["EUR", "EAS", "AMR", "SAS", "AFR", "SNVsPerNT", "SubPopsPerNT", "SupPopsPerNT"]
+
+# perturbation category of a (3'UTR, miRNA) prediction, from the DMRcount and AFR columns
+PERTURB_NONE = 0
+PERTURB_DMR = 1
+PERTURB_AFR = 2
+PERTURB_BOTH = 3
+PERTURB_ALL = "all"
+PERTURB_CATEGORIES = [PERTURB_NONE, PERTURB_DMR, PERTURB_AFR, PERTURB_BOTH]
+
+
+def perturbationCategory(df):
+    '''0: no perturbation, 1: DMR only, 2: AFR SNVs only, 3: DMR and AFR SNVs'''
+    return (df['DMRcount'] != 0).astype(np.int8) + 2 * (df['AFR'] != 0).astype(np.int8)
+
+
+
+def countsByPerturbation(df, column, category):
+    '''
+    value_counts() of column over all rows and over the rows of each perturbation
+    category, from a single groupby. Each Series has the same order, names and dtype
+    as df.loc[mask, column].value_counts() would give
+    '''
+    sizes = df.groupby([df[column], category.rename('perturbation')], sort=False).size()
+    # groups are in order of first appearance, which is the order value_counts()
+    # (stable) sorts from, so ties end up in the same order
+    template = df[column].iloc[:0].value_counts()
+    rowCategories = sizes.index.get_level_values(1)
+    counts = {PERTURB_ALL: sizes.groupby(level=0, sort=False).sum()}
+    for c in PERTURB_CATEGORIES:
+        counts[c] = sizes[rowCategories == c].droplevel(1)
+    for key in counts:
+        counts[key] = counts[key].sort_values(ascending=False, kind="stable")
+        counts[key].index.name = template.index.name
+        counts[key].name = template.name
+    return counts
+
+
+
+def countsFrame(counts):
+    dfCounts = pd.DataFrame(counts)
+    dfCounts.columns=['counts']
+    return dfCounts
+
+
+
+def countHistogram(counts, nBins):
+    '''
+    np.histogram(counts, bins=list(range(0, nBins + 1)))[0] for integer counts:
+    one bin per value, the last bin also holds nBins, larger values are dropped
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    hist = np.bincount(counts[counts <= nBins], minlength=nBins + 1)
+    hist[nBins - 1] += hist[nBins]
+    return hist[:nBins]
+
+
+    
+    
+    
+def buildMiRNAIndex():
+    '''row positions of the miRNAs in dfFullMiRInfo by chromosome, used to find the DMR hits of each sample'''
+    global miRNAIndex, miRNAStarts
+    miRNAStarts = dfFullMiRInfo['featureStart_x'].to_numpy(dtype=np.int64)
+    miRNAIndex = dfFullMiRInfo.groupby('chr_x').indices
+    logging.info("indexed <" + str(len(miRNAStarts)) + "> miRNA positions on <" + str(len(miRNAIndex)) + "> chromosomes")
+
+
+
+def findDMRHits(dmrTable, distance):
+    '''
+    for each row of dfFullMiRInfo, the number of DMRs in dmrTable that end 0 to distance nt
+    downstream of the miRNA start, and the distance to the nearest of these (0 if there are none)
+    '''
+    hits = np.zeros(len(miRNAStarts), dtype=np.int64)
+    nearest = np.zeros(len(miRNAStarts), dtype=np.int64)
+    for chrom, ends in dmrTable.groupby('Chr')['End position']:
+        if chrom not in miRNAIndex:
+            continue
+        ends = np.sort(ends.to_numpy(dtype=np.int64))
+        rows = miRNAIndex[chrom]
+        starts = miRNAStarts[rows]
+        first = np.searchsorted(ends, starts, side='left')
+        hits[rows] = np.searchsorted(ends, starts + distance, side='right') - first
+        found = hits[rows] > 0
+        nearest[rows[found]] = ends[first[found]] - starts[found]
+    return hits, nearest
+
+
+
+def miRNAHitTable(rows, hits, distances):
+    '''hits table in the format of the _dmrHits.tsv file for the selected rows of dfFullMiRInfo'''
+    dfHits = pd.DataFrame({"MIMATID": dfFullMiRInfo['MIMATID'].to_numpy()[rows],
+                           "number_of_hits": hits[rows],
+                           "distance": distances[rows]})
+    for column in SNV_POPULATION_COLUMNS:
+        dfHits[column] = dfFullMiRInfo[column].to_numpy()[rows]
+    return dfHits
+
+
+
+def projectHits(dfHits, columns):
+    '''
+    copy the columns of the hits table to the predictions of each miRNA in grpPredData, with
+    one lookup by MIMATID (for a miRNA with several rows, the last row wins, as it did in the
+    per-miRNA loop this replaces)
+    '''
+    hitsByMiR = dfHits.drop_duplicates("MIMATID", keep="last").set_index("MIMATID")
+    matched = grpPredData['MIMATID'].isin(hitsByMiR.index)
+    matchedMiRs = grpPredData.loc[matched, 'MIMATID']
+    for column, hitsColumn in columns:
+        grpPredData.loc[matched, column] = matchedMiRs.map(hitsByMiR[hitsColumn])
+
+
+
+@stageProfiler.stage
 def processSamplesByDMR():
 
 
     #global targetFiles
     #global dmrHits
-    allDMRHits=[]
-    allSNVHits=[]
-    # loop through miRNAs in grpPredData list and see if they have an upstream DMR within "featuredistance" nts
-    # to do this, iterate through every miRNA present in the predicted target list
-    # (we have the coordinates through the mergeMiRNAData method)
-    # 
-    #uniqueMiRList = dfFullMiRInfo["MIMATID"].unique()
-    for index, miR in dfFullMiRInfo.iterrows():   
-        if miR['MIMATID']=="MIMAT0019954":
-            print(miR[['MIMATID']])       
-        dmrHits = dfDMRFeatureList.loc[(dfDMRFeatureList['Chr'] == miR['chr_x']) 
-                                       & (dfDMRFeatureList['End position']-miR['featureStart_x'] <= int(featureDistance))
-                                       & (dfDMRFeatureList['End position']-miR['featureStart_x'] >= 0)]
-        #dmrHits['featureDist']=dmrHits['End position']-miR['featureStart'] 
-        if len(dmrHits) > 0:
-            
-            print(miR['MIMATID'] + "|" + str(len(dmrHits)))
-            allDMRHits.append({"MIMATID":miR['MIMATID'], 
-                               "number_of_hits":len(dmrHits), 
-                               "distance":min(dmrHits['End position'])-miR['featureStart_x'],
-                               "EUR":miR['EUR'],
-                               "EAS":miR['EAS'],
-                               "AMR":miR['AMR'],
-                               "SAS":miR['SAS'],
-                               "AFR":miR['AFR'],
-                               "SNVsPerNT":miR['SNVsPerNT'],
-                               "SubPopsPerNT":miR['SubPopsPerNT'],
-                               "SupPopsPerNT":miR['SupPopsPerNT']}                            
-                               )
-    
-
-
-        elif miR['AFR'] > 0:
-            
-            
-            #print(miR['MIMATID'] + "|" + str(len(dmrHits)))
-            allSNVHits.append({"MIMATID":miR['MIMATID'], 
-                               "number_of_hits":0, 
-                               "distance":0,
-                               "EUR":miR['EUR'],
-                               "EAS":miR['EAS'],
-                               "AMR":miR['AMR'],
-                               "SAS":miR['SAS'],
-                               "AFR":miR['AFR'],
-                               "SNVsPerNT":miR['SNVsPerNT'],
-                               "SubPopsPerNT":miR['SubPopsPerNT'],
-                               "SupPopsPerNT":miR['SupPopsPerNT']}                            
-                               )
-    
-
-
-    dfDMRHits = pd.DataFrame(allDMRHits)
-    dfSNVHits = pd.DataFrame(allSNVHits)
+    # for every miRNA present in the predicted target list (we have the coordinates through
+    # the mergeMiRNAData method) count the upstream DMRs within "featuredistance" nts.
+    # miRNAs without DMR hits but with AFR SNVs are collected separately
+    hits, nearest = findDMRHits(dfDMRFeatureList, int(featureDistance))
+    dmrRows = hits > 0
+    snvRows = ~dmrRows & (dfFullMiRInfo['AFR'].to_numpy() > 0)
+    dfDMRHits = miRNAHitTable(dmrRows, hits, nearest)
+    dfSNVHits = miRNAHitTable(snvRows, np.zeros_like(hits), np.zeros_like(nearest))
     logging.info("found <" + str(len(dfDMRHits["MIMATID"].unique())) + "> miRNAs")
     logging.info("and <" + str(len(dfDMRHits["MIMATID"])) + "> DMR miRNA events")
 
@@ -419,82 +571,51 @@ def processSamplesByDMR():
     grpPredData['SubPopsPerNT']=0.0  
     grpPredData['SupPopsPerNT']=0.0    
     
-    for index, dmrMiR in dfDMRHits.iterrows():
-
-        print(str(index))  
-        if dmrMiR['MIMATID']=="MIMAT0019954":
-            print(dmrMiR[['MIMATID', 'number_of_hits']])    
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'DMRcount']=dmrMiR['number_of_hits']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'DMRdist']=dmrMiR['distance']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'EUR']=dmrMiR['EUR']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'EAS']=dmrMiR['EAS']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'AMR']=dmrMiR['AMR']
-        ''''.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'SAS']=dmrMiR['SAS']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'AFR']=dmrMiR['AFR']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'SNVsPerNT']=dmrMiR['SNVsPerNT']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'SubPopsPerNT']=dmrMiR['SubPopsPerNT']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID'])), 'SupPopsPerNT']=dmrMiR['SupPopsPerNT']
-                
+    projectHits(dfDMRHits, [('DMRcount', 'number_of_hits'), ('DMRdist', 'distance')]
+                + [(column, column) for column in SNV_POPULATION_COLUMNS])
+
     outputFileallfilteredGroupedDMRmod = os.path.splitext(groupedpredsFile)[0] + "_allfilteredGroupedDMRmod.tsv" 
     grpPredData.to_csv(outputFileallfilteredGroupedDMRmod, sep='\t')
-    # grpPredData.loc[(grpPredData['shortmiRName'].str.contains(dmrMiR['MIMATID']))][["shortGeneName", "MIMATID"]]
-    for index, snvMiR in dfSNVHits.iterrows():
-        #print(dmrMiR)
-        #grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'DMRcount']=snvMiR['number_of_hits']
-        #grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'DMRdist']=snvMiR['distance']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'EUR']=snvMiR['EUR']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'EAS']=snvMiR['EAS']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'AMR']=snvMiR['AMR']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'SAS']=snvMiR['SAS']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'AFR']=snvMiR['AFR']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'SNVsPerNT']=snvMiR['SNVsPerNT']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'SubPopsPerNT']=snvMiR['SubPopsPerNT']
-        grpPredData.loc[(grpPredData['shortmiRName'].str.contains(snvMiR['MIMATID'])), 'SupPopsPerNT']=snvMiR['SupPopsPerNT']
-                
+    # miRNAs without DMR hits only get their SNV columns
+    projectHits(dfSNVHits, [(column, column) for column in SNV_POPULATION_COLUMNS])
+
     outputFileallfilteredGroupedDMRmod = os.path.splitext(groupedpredsFile)[0] + "_allfilteredGroupedSNVmod.tsv" 
     grpPredData.to_csv(outputFileallfilteredGroupedDMRmod, sep='\t')
     
     # 1. number of targeted 3'UTRs / miRNA
-    countsByMiRNAsAll = grpPredData['shortmiRName'].value_counts()  # <-- this is DMRs / miRNA
-    
-    dfCountsNoDMR = pd.DataFrame(countsByMiRNAsAll)
-    dfCountsNoDMR.columns=['counts']
+    # every count table below comes from one groupby on (miRNA, perturbation category)
+    # and one on (3'UTR, perturbation category), instead of four masked copies of grpPredData
+    perturbation = perturbationCategory(grpPredData)
+    miRCounts = countsByPerturbation(grpPredData, 'shortmiRName', perturbation)
+    countsByMiRNAsAll = miRCounts[PERTURB_ALL]  # <-- this is DMRs / miRNA
+    countsByMiRNAsNoPerturbs = miRCounts[PERTURB_NONE]
+    countsByMiRNAsDMROnly = miRCounts[PERTURB_DMR]
+    countsByMiRNAsAFROnly = miRCounts[PERTURB_AFR]
+    countsByMiRNAsDMRsAndSNVs = miRCounts[PERTURB_BOTH]
+
     outputFileCountsByMiRNAs = os.path.splitext(groupedpredsFile)[0] + "_countsByMiRNAsAll.tsv"     
-    countNoDMR, division = np.histogram(countsByMiRNAsAll, bins=list(range(0, max(countsByMiRNAsAll)+2)))    
     countsByMiRNAsAll.to_csv(outputFileCountsByMiRNAs, sep='\t')
-    # no DMRs or SNVs
-    countsByMiRNAsNoPerturbs = grpPredData.loc[(grpPredData['DMRcount']==0) & (grpPredData['AFR']==0) ]['shortmiRName'].value_counts()
-    dfCountsNoPerturbs = pd.DataFrame(countsByMiRNAsNoPerturbs)
-    dfCountsNoPerturbs.columns=['counts']
-
-    # DMRs Only
-    countsByMiRNAsDMROnly  = grpPredData.loc[(grpPredData['DMRcount']!=0) & (grpPredData['AFR']==0) ]['shortmiRName'].value_counts()
-    dfCountsDMROnly = pd.DataFrame(countsByMiRNAsDMROnly)
-    dfCountsDMROnly.columns=['counts']
     outputFileCountsByMiRNAs = os.path.splitext(groupedpredsFile)[0] + "_countsByMiRNAsDMR.tsv"     
-    countDMROnly, division = np.histogram(countsByMiRNAsDMROnly, bins=list(range(0, max(countsByMiRNAsAll)+2)))    
     countsByMiRNAsDMROnly.to_csv(outputFileCountsByMiRNAs, sep='\t')
-
-    # SNVs only
-    countsByMiRNAsAFRSNVs = grpPredData.loc[grpPredData['AFR']==0]['shortmiRName'].value_counts()
-    countsByMiRNAsAFROnly  = grpPredData.loc[(grpPredData['DMRcount']==0) & (grpPredData['AFR']!=0) ]['shortmiRName'].value_counts()
-    dfCountsAFROnly = pd.DataFrame(countsByMiRNAsAFROnly)
-    dfCountsAFROnly.columns=['counts']    
-    
-    dfCountsAFRSNVs = pd.DataFrame(countsByMiRNAsAFRSNVs)
-    dfCountsAFRSNVs.columns=['counts']
     outputFileAFRSNVsByMiRNAs = os.path.splitext(groupedpredsFile)[0] + "_countsByMiRNAsAFRSNVs.tsv"     
-    countAFRSNVsOnly, division = np.histogram(countsByMiRNAsAFROnly, bins=list(range(0, max(countsByMiRNAsAFRSNVs)+2)))    
-    countsByMiRNAsAFROnly.to_csv(outputFileAFRSNVsByMiRNAs, sep='\t')
-    
-    # DMRs and SNVs
-    countsByMiRNAsDMRsAndSNVs  = grpPredData.loc[(grpPredData['DMRcount']!=0) & (grpPredData['AFR']!=0) ]['shortmiRName'].value_counts()
-    dfCountsDMRsAndSNVs = pd.DataFrame(countsByMiRNAsDMRsAndSNVs)
-    dfCountsDMRsAndSNVs.columns=['counts']
-    countDMRsAFRSNVsOnly, division = np.histogram(countsByMiRNAsDMRsAndSNVs, bins=list(range(0, max(countsByMiRNAsAFRSNVs)+2)))    
     countsByMiRNAsAFROnly.to_csv(outputFileAFRSNVsByMiRNAs, sep='\t')
-    
-    dfHistCounts = pd.DataFrame(division[:-1])
+
+    dfCountsNoPerturbs = countsFrame(countsByMiRNAsNoPerturbs)
+    dfCountsDMROnly = countsFrame(countsByMiRNAsDMROnly)
+    dfCountsAFROnly = countsFrame(countsByMiRNAsAFROnly)
+    dfCountsDMRsAndSNVs = countsFrame(countsByMiRNAsDMRsAndSNVs)
+
+    # all four columns are binned up to the largest count over all miRNAs. The AFR
+    # columns used to stop at the largest count over the miRNAs without AFR SNVs,
+    # which is the same unless the most targeting miRNA has AFR SNVs (and then the
+    # columns had different lengths and the table couldn't be built)
+    allBins = max(countsByMiRNAsAll) + 1
+    countNoDMR = countHistogram(countsByMiRNAsAll, allBins)
+    countDMROnly = countHistogram(countsByMiRNAsDMROnly, allBins)
+    countAFRSNVsOnly = countHistogram(countsByMiRNAsAFROnly, allBins)
+    countDMRsAFRSNVsOnly = countHistogram(countsByMiRNAsDMRsAndSNVs, allBins)
+    
+    dfHistCounts = pd.DataFrame(np.arange(allBins))
     dfHistCounts["Counts - no DMR"] = countNoDMR.tolist()
     dfHistCounts["Counts - DMR only"] = countDMROnly.tolist()
     dfHistCounts["Counts - AFR only"] = countAFRSNVsOnly.tolist()    
@@ -522,7 +643,7 @@ def processSamplesByDMR():
         
     # pretty histogram
     plotHistogramFileCountsByMiRNAs = os.path.splitext(groupedpredsFile)[0] + "_StackedHistogram.png"
-    bins=list(range(0, max(countsByMiRNAsAll)+2))
+    bins=list(range(0, allBins + 1))
     dfCounts=pd.concat([pd.DataFrame(countsByMiRNAsDMRsAndSNVs), countsByMiRNAsAFROnly], ignore_index=True, axis=1)
     dfCounts=pd.concat([dfCounts, countsByMiRNAsDMROnly], ignore_index=True, axis=1)
     dfCounts=pd.concat([dfCounts, countsByMiRNAsNoPerturbs], ignore_index=True, axis=1)
@@ -547,16 +668,179 @@ def processSamplesByDMR():
     xx=grpPredData.loc[grpPredData['shortGeneName']=="ENSG00000125798|FOXA2"][['shortGeneName','shortmiRName','DMRcount','AFR']]
     
     xx.to_csv(os.path.splitext(groupedpredsFile)[0] + "_xx.tsv", sep='\t')
-    countsBy3pUTRNoPerturb =grpPredData.loc[(grpPredData['DMRcount']==0) & (grpPredData['AFR']==0)]['shortGeneName'].value_counts()
-    countsBy3pUTRDMRsOnly  = grpPredData.loc[(grpPredData['DMRcount']!=0) & (grpPredData['AFR']==0)]['shortGeneName'].value_counts()
-    countsBy3pUTRAFRSNVsOnly = grpPredData.loc[(grpPredData['DMRcount']==0) & (grpPredData['AFR']!=0)]['shortGeneName'].value_counts()
-    countsBy3pUTRNAFRandSNVs = grpPredData.loc[(grpPredData['DMRcount']!=0) & (grpPredData['AFR']!=0)]['shortGeneName'].value_counts()
-    df3pUTRCounts=pd.concat([pd.DataFrame(countsBy3pUTRNoPerturb), countsBy3pUTRDMRsOnly], ignore_index=True, axis=1)
-    df3pUTRCounts=pd.concat([df3pUTRCounts, countsBy3pUTRAFRSNVsOnly], ignore_index=True, axis=1)
-    df3pUTRCounts=pd.concat([df3pUTRCounts, countsBy3pUTRNAFRandSNVs], ignore_index=True, axis=1)
+    utrCounts = countsByPerturbation(grpPredData, 'shortGeneName', perturbation)
+    df3pUTRCounts=pd.concat([pd.DataFrame(utrCounts[PERTURB_NONE]), utrCounts[PERTURB_DMR]], ignore_index=True, axis=1)
+    df3pUTRCounts=pd.concat([df3pUTRCounts, utrCounts[PERTURB_AFR]], ignore_index=True, axis=1)
+    df3pUTRCounts=pd.concat([df3pUTRCounts, utrCounts[PERTURB_BOTH]], ignore_index=True, axis=1)
     df3pUTRCounts.columns=[ "no perturbations", "DMR only", "AFRSNVs only", "Both DMR+AFRSNVs"]
     outputFileCountsBy3pUTRs = os.path.splitext(groupedpredsFile)[0] + "_countsBy3pUTRsDMRmod.tsv" 
     df3pUTRCounts.to_csv(outputFileCountsBy3pUTRs, sep='\t')
+    stageProfiler.addRows(len(grpPredData))
+
+
+
+def readDMRSampleList(sampleListFile):
+    '''
+    (sample name, DMR file) pairs from a file with one DMR file, or sample name<tab>DMR file,
+    per line. Relative paths are relative to the folder of the list file
+    '''
+    samples = []
+    with open(sampleListFile, 'r') as fS:
+        for line in fS:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            dmrFile = fields[-1].strip()
+            if not os.path.isabs(dmrFile):
+                dmrFile = os.path.join(os.path.dirname(os.path.abspath(sampleListFile)), dmrFile)
+            if len(fields) > 1:
+                sampleName = fields[0].strip()
+            else:
+                sampleName = compressedIO.splitCompressionExtension(os.path.basename(dmrFile))[0]
+                sampleName = os.path.splitext(sampleName)[0]
+            samples.append((sampleName, dmrFile))
+    sampleNames = [sample[0] for sample in samples]
+    if len(set(sampleNames)) != len(sampleNames):
+        raise CLIError("sample names in <" + sampleListFile + "> are not unique")
+    return samples
+
+
+
+def processDMRSample(sample):
+    '''
+    processSamplesByDMR for one DMR file, with the outputs named after the sample.
+    Runs in a worker process, so the globals changed here are the worker's copies
+    '''
+    global dmrPosFile, groupedpredsFile, grpPredData
+    sampleName, dmrPosFile = sample
+    baseName, extension = os.path.splitext(sharedGroupedpredsFile)
+    groupedpredsFile = baseName + "__" + sampleName + extension
+    grpPredData = sharedGrpPredData.copy()
+    logging.info("processing sample <" + sampleName + ">")
+
+    loadDMRFeatureList()
+    pyplot.figure()
+    processSamplesByDMR()
+    pyplot.close('all')
+
+    # hits / miRNA for the sample matrix, the last row of a miRNA with hits wins,
+    # as in the projection on to the predictions in processSamplesByDMR
+    hits, nearest = findDMRHits(dfDMRFeatureList, int(featureDistance))
+    sampleHits = pd.Series(hits, index=dfFullMiRInfo['MIMATID'].to_numpy())
+    return sampleName, sampleHits[sampleHits > 0].groupby(level=0).last()
+
+
+
+@stageProfiler.stage
+def processDMRSamples():
+    '''
+    run processSamplesByDMR for every DMR file in the sample list, in parallel, and write
+    the sample x miRNA matrix of DMR hits
+    '''
+    global sharedGrpPredData, sharedGroupedpredsFile
+    sharedGrpPredData = grpPredData.copy()
+    sharedGroupedpredsFile = groupedpredsFile
+
+    samples = readDMRSampleList(dmrSampleListFile)
+    logging.info("processing <" + str(len(samples)) + "> DMR samples")
+    nJobs = min(dmrJobs, len(samples))
+    # the workers inherit the loaded and merged tables, so they need to be forked
+    if nJobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+        logging.info("--using <" + str(nJobs) + "> processes")
+        with multiprocessing.get_context("fork").Pool(nJobs) as pool:
+            results = pool.map(processDMRSample, samples, chunksize=1)
+    else:
+        results = [processDMRSample(sample) for sample in samples]
+
+    allMiRNAs = sorted(dfFullMiRInfo['MIMATID'].unique())
+    dfSampleMatrix = pd.DataFrame(dict(results)).reindex(allMiRNAs).fillna(0).astype(np.int64)
+    dfSampleMatrix.index.name = "MIMATID"
+    outputFileSampleMatrix = os.path.splitext(sharedGroupedpredsFile)[0] + "_dmrSampleMatrix.tsv"
+    dfSampleMatrix.to_csv(outputFileSampleMatrix, sep='\t')
+    logging.info("--wrote sample x miRNA DMR hits to <" + outputFileSampleMatrix + ">")
+    stageProfiler.addRows(len(samples))
+
+
+
+@stageProfiler.stage
+def sweepDMRDistances():
+    '''
+    DMR hits, nearest DMR and the category statistics of processSamplesByDMR for every
+    distance in featureDistances. The DMR end positions are sorted once per chromosome,
+    so the hits for each miRNA and distance come from two binary searches instead of
+    a scan of the DMR table per miRNA and per run.
+
+    A miRNA with more than one row in dfFullMiRInfo uses the last row, as
+    processSamplesByDMR does when it projects the hits on to the predictions
+    '''
+    logging.info("sweeping DMR distances <" + ",".join(str(d) for d in featureDistances) + ">")
+    miRInfo = dfFullMiRInfo.drop_duplicates("MIMATID", keep="last").reset_index(drop=True)
+    starts = miRInfo['featureStart_x'].to_numpy(dtype=np.int64)
+    distances = np.array(featureDistances, dtype=np.int64)
+
+    # hits[d, m]: DMRs ending between 0 and distances[d] nt downstream of the start of miRNA m
+    hits = np.zeros((len(distances), len(miRInfo)), dtype=np.int64)
+    nearestDMR = np.full(len(miRInfo), np.nan)
+    dmrEnds = {chrom: np.sort(ends.to_numpy(dtype=np.int64))
+               for chrom, ends in dfDMRFeatureList.groupby('Chr')['End position']}
+    for chrom, rows in miRInfo.groupby('chr_x').indices.items():
+        if chrom not in dmrEnds:
+            continue
+        ends = dmrEnds[chrom]
+        first = np.searchsorted(ends, starts[rows], side='left')
+        for d, distance in enumerate(distances):
+            hits[d, rows] = np.searchsorted(ends, starts[rows] + distance, side='right') - first
+        found = first < len(ends)
+        nearestDMR[rows[found]] = ends[first[found]] - starts[rows[found]]
+
+    # the AFR value is projected on to the predictions of a miRNA with DMR hits or with AFR > 0
+    afr = miRInfo['AFR'].to_numpy(dtype=np.float64)
+    targetsByMiR = grpPredData.groupby('MIMATID').size()
+    targets = targetsByMiR.reindex(miRInfo['MIMATID']).fillna(0).to_numpy(dtype=np.int64)
+    # predicted miRNAs without position/SNV information are never perturbed
+    otherTargets = targetsByMiR[~targetsByMiR.index.isin(miRInfo['MIMATID'])].to_numpy(dtype=np.int64)
+    categoryNames = {PERTURB_NONE: "no perturbation", PERTURB_DMR: "DMR only",
+                     PERTURB_AFR: "AFRSNVs only", PERTURB_BOTH: "DMR+AFRSNVs"}
+
+    statsRows = []
+    miRTables = []
+    for d, distance in enumerate(distances):
+        dmrFlag = hits[d] > 0
+        afrFlag = (afr != 0) & (dmrFlag | (afr > 0))
+        category = dmrFlag.astype(np.int8) + 2 * afrFlag.astype(np.int8)
+        for c in [PERTURB_ALL] + PERTURB_CATEGORIES:
+            if c == PERTURB_ALL:
+                inCategory = np.ones(len(miRInfo), dtype=bool)
+            else:
+                inCategory = category == c
+            counts = targets[inCategory]
+            if c in (PERTURB_ALL, PERTURB_NONE):
+                counts = np.concatenate([counts, otherTargets])
+            counts = counts[counts > 0]
+            statsRows.append({"featureDistance": distance,
+                              "category": categoryNames.get(c, c),
+                              "miRNAs": len(counts),
+                              "targetingEvents": int(counts.sum()),
+                              "median": np.median(counts) if len(counts) else np.nan,
+                              "average": counts.mean() if len(counts) else np.nan,
+                              "DMRevents": int(hits[d][inCategory].sum())})
+        miRTables.append(pd.DataFrame({"featureDistance": distance,
+                                       "MIMATID": miRInfo['MIMATID'],
+                                       "number_of_hits": hits[d],
+                                       "nearestDMR": nearestDMR,
+                                       "AFR": afr,
+                                       "category": [categoryNames[c] for c in category],
+                                       "targets": targets}))
+
+    dfSweep = pd.DataFrame(statsRows)
+    outputFileSweep = os.path.splitext(groupedpredsFile)[0] + "_dmrSweep.tsv"
+    dfSweep.to_csv(outputFileSweep, sep='\t', index=False)
+    outputFileSweepByMiRNA = os.path.splitext(groupedpredsFile)[0] + "_dmrSweepByMiRNA.tsv"
+    pd.concat(miRTables, ignore_index=True).to_csv(outputFileSweepByMiRNA, sep='\t', index=False)
+    logging.info("--wrote statistics for <" + str(len(distances)) + "> distances to <" + outputFileSweep + ">")
+    logging.info("--and DMR hits by miRNA to <" + outputFileSweepByMiRNA + ">")
+    stageProfiler.addRows(len(miRInfo) * len(distances))
+
 
 
              
@@ -600,6 +884,31 @@ def printLongHelpAndExit():
     logging.info("+                  from matching experimental data                             +")
     logging.info("+                                                                              +")
     logging.info("+                                                                              +")
+    logging.info("+           --profile                                                          +")
+    logging.info("+                write wall/cpu time, peak memory and rows processed           +")
+    logging.info("+                  for each stage to logfiles/<logfile>.profile.json           +")
+    logging.info("+                  (--cprofile also dumps cProfile stats for each stage)       +")
+    logging.info("+                                                                              +")
+    logging.info("+           --dmrsamplelist                                                    +")
+    logging.info("+                file with one DMR file (or sample name<tab>DMR file) per      +")
+    logging.info("+                  line. The predictions and annotation are loaded once and    +")
+    logging.info("+                  the samples are processed in parallel (-j/--jobs)           +")
+    logging.info("+                  the outputs are named <predictions>__<sample>_...           +")
+    logging.info("+                  and the DMR hits of all samples are written to              +")
+    logging.info("+                  <predictions>_dmrSampleMatrix.tsv                           +")
+    logging.info("+                                                                              +")
+    logging.info("+           --distancesweep                                                    +")
+    logging.info("+                comma separated list of distances (e.g. 1000,5000,10000)      +")
+    logging.info("+                  the DMR hits, nearest DMR and category statistics for       +")
+    logging.info("+                  every distance are written to _dmrSweep.tsv and             +")
+    logging.info("+                  _dmrSweepByMiRNA.tsv instead of running the single          +")
+    logging.info("+                  distance analysis (-D is not needed)                        +")
+    logging.info("+                                                                              +")
+    logging.info("+           --cachefolder                                                      +")
+    logging.info("+                folder for the parsed GFF3 and SNV tables, so they are        +")
+    logging.info("+                  only parsed again when the files change                     +")
+    logging.info("+                  (default ./annotationcache, --nocache to turn off)          +")
+    logging.info("+                                                                              +")
     logging.info("+      The output files will be                                                +")
     logging.info("+                                                                              +")    
     logging.info("+                                                                              +")
@@ -621,20 +930,31 @@ def main(argv=None): # IGNORE:C0111
 
     md5String = hashlib.md5(b"CBGAMGOUS").hexdigest()
     parseArgs(argv)
-    initLogger(md5String)
+    logfileName = initLogger(md5String)
+    if profileRun:
+        stageProfiler.enable(logfileName, cprofile=cProfileRun)
     
-    loadDMRFeatureList()
+    if not dmrSampleListFile:
+        loadDMRFeatureList()
     loadGroupPredictionData()
     loadMiRBaseFeatureList()
-    load3pUTRSNVData()
     loadmiRNASNVData() 
        
     mergeMiRNAData()
-    merge3pUTRData()
-        
-    processSamplesByDMR()
+    buildMiRNAIndex()
+    if featureDistances:
+        sweepDMRDistances()
+    else:
+        load3pUTRSNVData()
+        merge3pUTRData()
+        if dmrSampleListFile:
+            processDMRSamples()
+        else:
+            processSamplesByDMR()
     
-
+    reportFile = stageProfiler.writeReport()
+    if reportFile:
+        logging.info("profile written to <" + reportFile + ">")
     logging.info("finished")
 
 if __name__ == "__main__":
@@ -646,17 +966,6 @@ if __name__ == "__main__":
     if TESTRUN:
         import doctest
         doctest.testmod()
-    if PROFILE:
-        import cProfile
-        import pstats
-        profile_filename = 'fairpype.virusPipe_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
-        sys.exit(0)
     sys.exit(main())
     
 
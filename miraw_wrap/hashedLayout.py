@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Two-level hashed folder layout for the files generated by split modes 3/4.
+
+With -F/--fanout, miRAWbatch.py places the unifiedFile, the .properties file
+and the miRAW experiment folder for a feature in
+
+    outFolder/ab/cd/expt.feature.*
+
+where abcd are the first hex digits of the md5 of the feature name, so no
+single folder ends up with hundreds of thousands of entries. The experiment
+folders are listed in an experiment manifest
+
+    FEATURE     EXPERIMENT_FOLDER
+    E1_T1_G1    /remote/3f/a2/expt.E1_T1_G1
+
+which pairbatch.py, cutoffBatch.py and extractConflictBatch.py read with -M
+instead of listing the output folder.
+"""
+
+import os
+import sys
+import hashlib
+import logging
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+FANOUT_LEVELS = 2
+FANOUT_WIDTH = 2
+
+EXPERIMENT_MANIFEST_EXTENSION = ".experiments.tsv"
+EXPERIMENT_MANIFEST_COLUMNS = ["FEATURE", "EXPERIMENT_FOLDER"]
+
+
+def hashedSubfolder(featureName, levels=FANOUT_LEVELS, width=FANOUT_WIDTH):
+    '''relative subfolder for a feature, e.g. "3f/a2"'''
+    digest = hashlib.md5(featureName.encode()).hexdigest()
+    return "/".join(digest[i * width:(i + 1) * width] for i in range(levels))
+
+
+def featureFolder(folder, featureName, fanout=True):
+    '''the folder the files for a feature go to (folder itself if fanout is off)'''
+    if not fanout:
+        return folder
+    return os.path.join(folder, hashedSubfolder(featureName))
+
+
+class ExperimentManifestWriter(object):
+    '''write the FEATURE -> EXPERIMENT_FOLDER table'''
+
+    def __init__(self, manifestFile):
+        self.fManifest = open(manifestFile, 'w')
+        self.fManifest.write("\t".join(EXPERIMENT_MANIFEST_COLUMNS) + "\n")
+
+    def add(self, featureName, experimentFolder):
+        self.fManifest.write(featureName + "\t" + experimentFolder + "\n")
+
+    def close(self):
+        self.fManifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readExperiments(manifestFile):
+    '''return the (feature, experiment folder) pairs in an experiment manifest'''
+    experiments = []
+    with open(manifestFile, 'r') as fM:
+        columns = fM.readline().rstrip("\n").split("\t")
+        featureColumn = columns.index("FEATURE")
+        folderColumn = columns.index("EXPERIMENT_FOLDER")
+        for line in fM:
+            if not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            experiments.append((fields[featureColumn], fields[folderColumn]))
+    return experiments
+
+
+def readExperimentFolders(manifestFile):
+    '''return the list of experiment folders in an experiment manifest'''
+    return [folder for feature, folder in readExperiments(manifestFile)]
+
+
+def checkExperimentManifest(manifestFile):
+    '''stop if an experiment manifest was given (-M) but doesn't exist'''
+    if manifestFile:
+        logging.info("checking experiment manifest:")
+        if not os.path.isfile(manifestFile):
+            logging.error("--can't find experiment manifest at <" + manifestFile + ">")
+            logging.info("--stopping")
+            sys.exit()
+        logging.info("--OK")
+
+
+def listExperiments(folder, manifestFile=None):
+    '''
+    return the (feature, experiment folder) pairs of the manifest, or without
+    a manifest, of every subfolder of folder (named after its feature)
+    '''
+    if manifestFile:
+        return readExperiments(manifestFile)
+    return [(foldername, os.path.join(folder, foldername)) for foldername in next(os.walk(folder))[1]]
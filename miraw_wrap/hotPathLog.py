@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Low overhead logging for loops that run once per row.
+
+Instead of logging every row, a loop keeps a HotPathCounter
+
+    progress = hotPathLog.HotPathCounter("pairing", total=len(rows))
+    for row in rows:
+        progress.tick()
+        if progress.sampled():
+            logging.debug("--row " + str(progress.rows) + " " + row[0])
+        ...
+        progress.count("dropped")
+    progress.finish()
+
+which writes a progress line (rows, rows/s and, if the total is known,
+the ETA) at most every PROGRESS_INTERVAL seconds, a debug line for one row
+in SAMPLE_EVERY when debug logging is on, and a summary line with the
+event counts at the end. Every row is only logged when tracing has been
+switched on with enableTrace() (the --trace option of the scripts).
+"""
+
+import time
+import logging
+from datetime import timedelta
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+PROGRESS_INTERVAL = 10.0
+CHECK_EVERY = 1000
+SAMPLE_EVERY = 10000
+
+tracing = False
+
+
+def enableTrace():
+    '''log every row of every hot loop (this is slow on large files)'''
+    global tracing
+    tracing = True
+    logging.getLogger().setLevel(logging.DEBUG)
+
+
+def formatETA(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+
+class HotPathCounter(object):
+    '''row and event counters for one stage, with periodic progress lines'''
+
+    def __init__(self, stage, total=None, interval=PROGRESS_INTERVAL, sampleEvery=SAMPLE_EVERY):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.sampleEvery = sampleEvery
+        self.rows = 0
+        self.events = {}
+        self.nextCheck = CHECK_EVERY
+        self.sampleDebug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        self.nextSample = 1
+        self.startTime = time.perf_counter()
+        self.lastReport = self.startTime
+
+    def tick(self, rows=1):
+        self.rows += rows
+        if self.rows >= self.nextCheck:
+            self.checkProgress()
+
+    def count(self, event, n=1):
+        self.events[event] = self.events.get(event, 0) + n
+
+    def sampled(self):
+        '''True if the current row should be logged at debug level'''
+        if tracing:
+            return True
+        if self.sampleDebug and self.rows >= self.nextSample:
+            self.nextSample = self.rows + self.sampleEvery
+            return True
+        return False
+
+    def rate(self, now):
+        elapsed = now - self.startTime
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def checkProgress(self):
+        self.nextCheck = self.rows + CHECK_EVERY
+        now = time.perf_counter()
+        if now - self.lastReport < self.interval:
+            return
+        self.lastReport = now
+        rate = self.rate(now)
+        message = "--" + self.stage + ": " + str(self.rows)
+        if self.total:
+            message += "/" + str(self.total) + " (" + "{:.1f}".format(100.0 * self.rows / self.total) + "%)"
+        message += " rows, " + "{:.0f}".format(rate) + " rows/s"
+        if self.total and rate > 0:
+            message += ", ETA " + formatETA((self.total - self.rows) / rate)
+        logging.info(message)
+
+    def finish(self):
+        '''log the summary line for the stage'''
+        now = time.perf_counter()
+        message = "--" + self.stage + ": " + str(self.rows) + " rows in " \
+                  + "{:.2f}".format(now - self.startTime) + "s (" + "{:.0f}".format(self.rate(now)) + " rows/s)"
+        for event in sorted(self.events):
+            message += ", " + event + " " + str(self.events[event])
+        logging.info(message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
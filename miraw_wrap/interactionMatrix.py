@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Sparse miRNA x gene interaction matrix built from pooled miRAW predictions.
+
+miRNAs and genes are coded as integers (rows and columns of the matrix) and
+the values are the number of predicted target sites. A matrix is written as
+
+    <prefix>_interactions.npz   compressed sparse (CSR) site counts
+    <prefix>_miRNAIDs.tsv       row number -> miRNA
+    <prefix>_geneIDs.tsv        column number -> gene
+
+and can be read back with InteractionMatrix.load(prefix), so degrees and
+co-targets don't have to be recalculated from the TSV edge list.
+
+Edge lists (Cytoscape) and GraphML files are written in blocks of rows,
+so the full edge list is never held in memory as text or as a DataFrame.
+"""
+
+import csv
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+MATRIX_SUFFIX = "_interactions.npz"
+MIRNA_IDS_SUFFIX = "_miRNAIDs.tsv"
+GENE_IDS_SUFFIX = "_geneIDs.tsv"
+
+# rows of the matrix written per block by the exporters
+EXPORT_BLOCK_ROWS = 1000
+# rows of the projection calculated per block, the product of a block can be much denser than the input
+PROJECTION_BLOCK_ROWS = 256
+
+MIRNA_NODE = "miRNA"
+GENE_NODE = "gene"
+TARGET_INTERACTION = "targets"
+COTARGET_INTERACTION = "cotargets"
+
+
+class InteractionMatrix(object):
+    '''miRNA x gene site counts, with the miRNA (row) and gene (column) IDs'''
+
+    def __init__(self, matrix, miRNAs, genes):
+        self.matrix = sp.csr_matrix(matrix, dtype=np.int64)
+        self.matrix.sum_duplicates()
+        self.miRNAs = np.asarray(miRNAs, dtype=object)
+        self.genes = np.asarray(genes, dtype=object)
+
+    @classmethod
+    def fromPredictions(cls, miRNAColumn, geneColumn, sites=None):
+        '''
+        build the matrix from one row per predicted site (sites=None) or from one row per
+        (miRNA, gene) pair with the number of sites. IDs are sorted
+        '''
+        miRNACodes, miRNAs = pd.factorize(pd.Series(miRNAColumn), sort=True)
+        geneCodes, genes = pd.factorize(pd.Series(geneColumn), sort=True)
+        if sites is None:
+            sites = np.ones(len(miRNACodes), dtype=np.int64)
+        matrix = sp.coo_matrix((np.asarray(sites, dtype=np.int64), (miRNACodes, geneCodes)),
+                               shape=(len(miRNAs), len(genes)))
+        # duplicate (miRNA, gene) entries are summed by the CSR conversion
+        return cls(matrix.tocsr(), miRNAs.to_numpy(), genes.to_numpy())
+
+    @classmethod
+    def load(cls, prefix):
+        matrix = sp.load_npz(prefix + MATRIX_SUFFIX)
+        miRNAs = pd.read_csv(prefix + MIRNA_IDS_SUFFIX, sep='\t', keep_default_na=False)['miRNA']
+        genes = pd.read_csv(prefix + GENE_IDS_SUFFIX, sep='\t', keep_default_na=False)['gene']
+        return cls(matrix, miRNAs.to_numpy(), genes.to_numpy())
+
+    def save(self, prefix):
+        '''write the matrix and the ID tables, returns the list of files'''
+        sp.save_npz(prefix + MATRIX_SUFFIX, self.matrix, compressed=True)
+        pd.DataFrame({"miRNA": self.miRNAs}).rename_axis("row").to_csv(prefix + MIRNA_IDS_SUFFIX, sep='\t')
+        pd.DataFrame({"gene": self.genes}).rename_axis("column").to_csv(prefix + GENE_IDS_SUFFIX, sep='\t')
+        return [prefix + MATRIX_SUFFIX, prefix + MIRNA_IDS_SUFFIX, prefix + GENE_IDS_SUFFIX]
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    def binary(self):
+        '''1 where a miRNA targets a gene, whatever the number of sites'''
+        targets = self.matrix.copy()
+        targets.data = np.ones_like(targets.data)
+        return targets
+
+    def miRNADegree(self):
+        '''number of targeted genes and number of sites for each miRNA'''
+        return pd.DataFrame({"genes": np.diff(self.matrix.indptr),
+                             "sites": np.asarray(self.matrix.sum(axis=1)).ravel()},
+                            index=pd.Index(self.miRNAs, name="miRNA"))
+
+    def geneDegree(self):
+        '''number of targeting miRNAs and number of sites for each gene'''
+        byGene = self.matrix.tocsc()
+        return pd.DataFrame({"miRNAs": np.diff(byGene.indptr),
+                             "sites": np.asarray(byGene.sum(axis=0)).ravel()},
+                            index=pd.Index(self.genes, name="gene"))
+
+    def coTargets(self, axis=0):
+        '''
+        bipartite projection: number of shared genes for each pair of miRNAs (axis=0) or
+        number of shared miRNAs for each pair of genes (axis=1), as a sparse matrix.
+        The diagonal holds the degree. Use projectionEdges() for large matrices
+        '''
+        targets = self.binary()
+        if axis == 1:
+            targets = targets.T.tocsr()
+        return (targets @ targets.T).tocsr()
+
+    def projectionEdges(self, axis=0, minShared=1, blockRows=PROJECTION_BLOCK_ROWS):
+        '''
+        yields (source, target, shared) arrays for each block of rows of the projection,
+        upper triangle only and only for pairs that share at least minShared partners
+        '''
+        targets = self.binary()
+        ids = self.miRNAs
+        if axis == 1:
+            targets = targets.T.tocsr()
+            ids = self.genes
+        targetsT = targets.T.tocsc()
+        for start in range(0, targets.shape[0], blockRows):
+            block = (targets[start:start + blockRows] @ targetsT).tocoo()
+            rows = block.row + start
+            keep = (block.col > rows) & (block.data >= minShared)
+            if keep.any():
+                yield ids[rows[keep]], ids[block.col[keep]], block.data[keep]
+
+    def edgeBlocks(self, blockRows=EXPORT_BLOCK_ROWS):
+        '''yields (miRNA, gene, sites) arrays for each block of rows of the matrix'''
+        for start in range(0, self.shape[0], blockRows):
+            block = self.matrix[start:start + blockRows].tocoo()
+            yield self.miRNAs[block.row + start], self.genes[block.col], block.data
+
+
+def writeEdgeList(edgeBlocks, edgeFile, interaction=TARGET_INTERACTION, weight="sites"):
+    '''
+    write (source, target, weight) blocks as a TSV edge list that Cytoscape imports
+    directly (source, interaction, target, weight), returns the number of edges
+    '''
+    edges = 0
+    with open(edgeFile, 'w', newline='') as fE:
+        writer = csv.writer(fE, delimiter='\t', lineterminator='\n')
+        writer.writerow(["source", "interaction", "target", weight])
+        for sources, targets, weights in edgeBlocks:
+            writer.writerows(zip(sources, [interaction] * len(sources), targets, weights.tolist()))
+            edges += len(sources)
+    return edges
+
+
+def writeGraphML(interactions, graphmlFile, blockRows=EXPORT_BLOCK_ROWS):
+    '''write the bipartite miRNA-gene network as GraphML, returns the number of edges'''
+    edges = 0
+    with open(graphmlFile, 'w') as fG:
+        fG.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fG.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        fG.write('  <key id="type" for="node" attr.name="type" attr.type="string"/>\n')
+        fG.write('  <key id="sites" for="edge" attr.name="sites" attr.type="int"/>\n')
+        fG.write('  <graph id="miRNAtargets" edgedefault="directed">\n')
+        for nodeType, ids in ((MIRNA_NODE, interactions.miRNAs), (GENE_NODE, interactions.genes)):
+            # miRNA and gene IDs could clash, so node IDs are prefixed with the type
+            fG.writelines('    <node id=' + quoteattr(nodeType + ":" + str(nodeID)) + '><data key="type">'
+                          + nodeType + '</data></node>\n' for nodeID in ids)
+        for miRNAs, genes, sites in interactions.edgeBlocks(blockRows):
+            fG.writelines('    <edge source=' + quoteattr(MIRNA_NODE + ":" + str(miRNA))
+                          + ' target=' + quoteattr(GENE_NODE + ":" + str(gene))
+                          + '><data key="sites">' + escape(str(n)) + '</data></edge>\n'
+                          for miRNA, gene, n in zip(miRNAs, genes, sites.tolist()))
+            edges += len(miRNAs)
+        fG.write('  </graph>\n')
+        fG.write('</graphml>\n')
+    return edges
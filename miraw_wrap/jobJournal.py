@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Persistent record of the state of each miRAW job.
+
+The journal is an append-only file with one JSON record per line:
+
+    {"job": "expt.E1_T1_G1", "state": "done", "exitCode": 0,
+     "time": "2021-03-01 10:12:44", "host": "node12",
+     "outputs": [{"file": "expt.E1_T1_G1.allTargetSites.csv", "size": 1234, "md5": "..."}]}
+
+the current state of a job is the last record written for it. Records
+are flushed and synced as they are written, so if the node dies the
+journal holds everything up to the last completed write (a truncated
+final line is ignored when the journal is read back).
+"""
+
+import os
+import json
+import socket
+import threading
+from datetime import datetime
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+JOURNAL_EXTENSION = ".journal"
+
+
+class JobJournal(object):
+
+    def __init__(self, journalFile):
+        self.journalFile = journalFile
+        self.lock = threading.Lock()
+        self.records = {}
+        self.load()
+
+    def load(self):
+        '''read the journal, keeping the most recent record for each job'''
+        self.records = {}
+        if not os.path.isfile(self.journalFile):
+            return self.records
+        with open(self.journalFile, 'r') as fJ:
+            for line in fJ:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # partially written line from an interrupted run
+                    continue
+                self.records[record["job"]] = record
+        return self.records
+
+    def state(self, jobID):
+        if jobID in self.records:
+            return self.records[jobID]["state"]
+        return STATE_PENDING
+
+    def record(self, jobID, state, exitCode=None, outputs=None):
+        record = {"job": jobID,
+                  "state": state,
+                  "exitCode": exitCode,
+                  "time": str(datetime.now()),
+                  "host": socket.gethostname(),
+                  "outputs": outputs or []}
+        with self.lock:
+            with open(self.journalFile, 'a') as fJ:
+                fJ.write(json.dumps(record) + "\n")
+                fJ.flush()
+                os.fsync(fJ.fileno())
+            self.records[jobID] = record
+        return record
+
+    def summary(self):
+        '''count of jobs in each state'''
+        counts = {}
+        for record in self.records.values():
+            counts[record["state"]] = counts.get(record["state"], 0) + 1
+        return counts
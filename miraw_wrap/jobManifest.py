@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Manifest layout for running miRAW as a job array.
+
+Instead of one .unifiedFile.csv, one .properties file and one script line
+for every miRNA/3'UTR, miRAWbatch can write (-A/--array)
+
+    expt.chunks.unifiedFile.csv     all unified file chunks, one after another
+    expt.template.properties        a single .properties template
+    expt.manifest.tsv               maps a task index to a chunk
+
+The manifest starts with '#key=value' lines giving the location of the
+chunk file, the template and the miRAW jar, followed by a table
+
+    TASK    FEATURE             OFFSET  LENGTH  ROWS
+    0       E1_T1_G1_1_2        0       10344   120
+    1       E2_T2_G2_1_2        10344   11020   120
+
+each chunk is a complete unified file (including the header line). If the
+chunk file is compressed, every chunk is a separate gzip member/zstd frame
+so it can be read on its own. launchMiRAWtask.py materializes the unified
+file and .properties file for task i on demand.
+"""
+
+import os
+from string import Template
+
+import compressedIO
+import hashedLayout
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+MANIFEST_COLUMNS = ["TASK", "FEATURE", "OFFSET", "LENGTH", "ROWS"]
+
+CHUNK_FILE_KEY = "chunkFile"
+TEMPLATE_FILE_KEY = "templateFile"
+JAR_LOCATION_KEY = "jarLocation"
+
+# placeholders in the .properties template
+FEATURE_PLACEHOLDER = "${FEATURE}"
+UNIFIED_FILE_PLACEHOLDER = "${UNIFIED_FILE}"
+# hashed subfolder of the experiment folder (miRAWbatch -F)
+SUBFOLDER_PLACEHOLDER = "${SUBFOLDER}"
+
+
+class ManifestWriter(object):
+    '''write the chunk file and manifest table for a job array'''
+
+    def __init__(self, manifestFile, chunkFile, meta):
+        '''
+        chunkFile is the local path the chunks are written to,
+        meta holds the '#key=value' lines (with the paths used at run time)
+        '''
+        self.manifestFile = manifestFile
+        self.chunkFile = chunkFile
+        self.compression = compressedIO.compressionType(chunkFile)
+        self.offset = 0
+        self.taskCount = 0
+        self.fChunks = open(chunkFile, 'wb')
+        self.fManifest = open(manifestFile, 'w')
+        for key in sorted(meta):
+            self.fManifest.write("#" + key + "=" + meta[key] + "\n")
+        self.fManifest.write("\t".join(MANIFEST_COLUMNS) + "\n")
+
+    def addChunk(self, featureName, chunkText, rows):
+        block = compressedIO.compressBlock(chunkText.encode(), self.compression)
+        self.fChunks.write(block)
+        self.fManifest.write("\t".join([str(self.taskCount), featureName, str(self.offset),
+                                        str(len(block)), str(rows)]) + "\n")
+        self.offset += len(block)
+        self.taskCount += 1
+        return self.taskCount - 1
+
+    def close(self):
+        self.fChunks.close()
+        self.fManifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_manifestCache = {}
+
+
+def readManifest(manifestFile):
+    '''return (meta, tasks) where tasks is a list of dicts, one per manifest row'''
+    if manifestFile in _manifestCache:
+        return _manifestCache[manifestFile]
+    meta = {}
+    tasks = []
+    columns = None
+    with open(manifestFile, 'r') as fM:
+        for line in fM:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if line.startswith("#"):
+                key, value = line[1:].split("=", 1)
+                meta[key] = value
+                continue
+            if columns is None:
+                columns = line.split("\t")
+                continue
+            tasks.append(dict(zip(columns, line.split("\t"))))
+    _manifestCache[manifestFile] = (meta, tasks)
+    return meta, tasks
+
+
+def readTask(manifestFile, taskIndex):
+    meta, tasks = readManifest(manifestFile)
+    if taskIndex < 0 or taskIndex >= len(tasks):
+        raise IndexError("task <" + str(taskIndex) + "> is not in manifest <" + manifestFile
+                         + "> (" + str(len(tasks)) + " tasks)")
+    return meta, tasks[taskIndex]
+
+
+def readChunk(meta, task):
+    '''return the text of the unified file chunk for a task'''
+    chunkFile = meta[CHUNK_FILE_KEY]
+    with open(chunkFile, 'rb') as fChunks:
+        fChunks.seek(int(task["OFFSET"]))
+        block = fChunks.read(int(task["LENGTH"]))
+    return compressedIO.decompressBlock(block, compressedIO.compressionType(chunkFile)).decode()
+
+
+def fillTemplate(templateText, featureName, unifiedFile):
+    return Template(templateText).safe_substitute(FEATURE=featureName, UNIFIED_FILE=unifiedFile,
+                                                  SUBFOLDER=hashedLayout.hashedSubfolder(featureName))
+
+
+_templateCache = {}
+
+
+def taskPropertiesText(meta, task, unifiedFile):
+    templateFile = meta[TEMPLATE_FILE_KEY]
+    if templateFile not in _templateCache:
+        with open(templateFile, 'r') as fT:
+            _templateCache[templateFile] = fT.read()
+    return fillTemplate(_templateCache[templateFile], task["FEATURE"], unifiedFile)
+
+
+def materializeTask(manifestFile, taskIndex, workFolder):
+    '''
+    write the unified file and .properties file for a task into workFolder
+    and return (propertiesFile, unifiedFile, meta, task)
+    '''
+    meta, task = readTask(manifestFile, taskIndex)
+    baseName = os.path.basename(manifestFile).replace(".manifest.tsv", "") + "." + task["FEATURE"]
+    unifiedFile = os.path.join(workFolder, baseName + ".unifiedFile.csv")
+    propertiesFile = os.path.join(workFolder, baseName + ".properties")
+    with open(unifiedFile, 'w') as fU:
+        fU.write(readChunk(meta, task))
+    with open(propertiesFile, 'w') as fP:
+        fP.write(taskPropertiesText(meta, task, unifiedFile))
+    return propertiesFile, unifiedFile, meta, task
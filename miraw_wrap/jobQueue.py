@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run the jobs in a miRAWbatch.py shell script from a work queue on a
+shared filesystem, so any number of workers on any number of nodes can
+take jobs until the whole experiment is finished
+
+    node1$ python jobQueue.py -s /remote/expt.sh -n 4
+    node2$ python jobQueue.py -s /remote/expt.sh -n 8
+    any$   python jobQueue.py -s /remote/expt.sh --status
+
+-s the shell script generated by miRAWbatch.py (one miRAW job per line)
+-q the queue folder (default: the script name + .queue), it must be on a
+   filesystem all the nodes share
+-n number of workers on this node
+--heartbeat seconds between heartbeats of a running job (default 30)
+--stale     a claim whose heartbeat hasn't changed for this many seconds
+            is taken over by another worker (default 300)
+--max-attempts  a job is marked failed after this many claims (default 3)
+--status    print the state of the jobs and stop
+
+There is no coordinator. A job is claimed by creating the file
+
+    <jobID>.claim.<attempt>
+
+with O_CREAT|O_EXCL, so exactly one worker gets each attempt. The owner
+touches the claim every --heartbeat seconds while the job runs. A worker
+that sees a claim keep the same modification time for --stale seconds (of
+its own clock, so the nodes don't need synchronised clocks) takes over the
+job by creating the claim for the next attempt, removes the partial output
+and runs it again. An owner that finds a later claim for its job has lost
+it and stops the job. A finished job gets <jobID>.done (holding the job
+record, as in jobJournal.py) or <jobID>.failed.
+
+The queue folder holds a few files for every job, so it is only listed
+once per pass over the jobs. Between listings a worker walks the jobs from
+where its last claim stopped and only looks at the files of the job in
+hand, and heartbeats and finishing a job only look at the job's own claim.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import mirawJobs
+from jobJournal import STATE_PENDING, STATE_RUNNING, STATE_DONE, STATE_FAILED
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+QUEUE_EXTENSION = ".queue"
+CLAIM_EXTENSION = ".claim."
+DONE_EXTENSION = ".done"
+FAILED_EXTENSION = ".failed"
+
+HEARTBEAT_SECONDS = 30
+STALE_SECONDS = 300
+MAX_ATTEMPTS = 3
+# how often an idle worker looks for work, and a running job is checked
+POLL_SECONDS = 5
+
+
+class JobQueue(object):
+    '''the claim, done and failed files for the jobs of one script'''
+
+    def __init__(self, queueFolder, jobs, staleSeconds=STALE_SECONDS, maxAttempts=MAX_ATTEMPTS):
+        self.queueFolder = queueFolder
+        self.jobs = jobs
+        self.staleSeconds = staleSeconds
+        self.maxAttempts = maxAttempts
+        # claim file -> (modification time, local time it was first seen with it)
+        self.heartbeats = {}
+        self.lock = threading.Lock()
+        # the last listing of the folder, updated as jobs are looked at, and
+        # the next job claim() looks at; shared by the workers of this node
+        self.entries = None
+        self.cursor = 0
+        self.unfinished = False
+        self.claimLock = threading.Lock()
+        if not os.path.isdir(queueFolder):
+            os.makedirs(queueFolder, exist_ok=True)
+
+    def path(self, jobID, extension, attempt=""):
+        return os.path.join(self.queueFolder, jobID + extension + str(attempt))
+
+    def scan(self):
+        '''jobID -> {"done", "failed", "attempt"} for every job in the queue folder'''
+        entries = {job.jobID: {"done": False, "failed": False, "attempt": 0} for job in self.jobs}
+        for fileName in os.listdir(self.queueFolder):
+            if fileName.endswith(DONE_EXTENSION):
+                jobID, key = fileName[:-len(DONE_EXTENSION)], "done"
+            elif fileName.endswith(FAILED_EXTENSION):
+                jobID, key = fileName[:-len(FAILED_EXTENSION)], "failed"
+            elif CLAIM_EXTENSION in fileName:
+                jobID, _, attempt = fileName.rpartition(CLAIM_EXTENSION)
+                if jobID in entries and attempt.isdigit():
+                    entries[jobID]["attempt"] = max(entries[jobID]["attempt"], int(attempt))
+                continue
+            else:
+                continue
+            if jobID in entries:
+                entries[jobID][key] = True
+        return entries
+
+    def isStale(self, claimFile):
+        '''True once the claim's modification time hasn't changed for staleSeconds'''
+        try:
+            mtime = os.stat(claimFile).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            seen = self.heartbeats.get(claimFile)
+            if seen is None or seen[0] != mtime:
+                self.heartbeats[claimFile] = (mtime, now)
+                return False
+            return now - seen[1] > self.staleSeconds
+
+    def createExclusive(self, filePath, text):
+        '''create filePath if nobody else has, True if we did'''
+        try:
+            fd = os.open(filePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as fC:
+            fC.write(text)
+            fC.flush()
+            os.fsync(fC.fileno())
+        return True
+
+    def takenOver(self, jobID, attempt):
+        '''True if another worker has claimed a later attempt of the job'''
+        return os.path.exists(self.path(jobID, CLAIM_EXTENSION, attempt + 1))
+
+    def refresh(self, jobID, entry):
+        '''bring the listed entry of a job up to date from its own files'''
+        if os.path.exists(self.path(jobID, DONE_EXTENSION)):
+            entry["done"] = True
+        elif os.path.exists(self.path(jobID, FAILED_EXTENSION)):
+            entry["failed"] = True
+        else:
+            while self.takenOver(jobID, entry["attempt"]):
+                entry["attempt"] += 1
+
+    def claim(self, owner):
+        '''
+        claim the next job that is pending, or whose owner went silent.
+        Returns (job, attempt), (None, 0) if there is nothing to claim now
+        and None when every job is done or failed
+        '''
+        with self.claimLock:
+            if self.entries is None or self.cursor >= len(self.jobs):
+                self.entries = self.scan()
+                self.cursor = 0
+                self.unfinished = False
+            while self.cursor < len(self.jobs):
+                job = self.jobs[self.cursor]
+                self.cursor += 1
+                entry = self.entries[job.jobID]
+                if entry["done"] or entry["failed"]:
+                    continue
+                self.refresh(job.jobID, entry)
+                if entry["done"] or entry["failed"]:
+                    continue
+                self.unfinished = True
+                attempt = entry["attempt"]
+                if attempt and not self.isStale(self.path(job.jobID, CLAIM_EXTENSION, attempt)):
+                    continue
+                if attempt >= self.maxAttempts:
+                    logging.error("--job <" + job.jobID + "> was claimed <" + str(attempt)
+                                  + "> times, marking it failed")
+                    self.createExclusive(self.path(job.jobID, FAILED_EXTENSION),
+                                         json.dumps(jobRecord(job, STATE_FAILED, None, owner)) + "\n")
+                    entry["failed"] = True
+                    continue
+                if self.createExclusive(self.path(job.jobID, CLAIM_EXTENSION, attempt + 1), owner + "\n"):
+                    entry["attempt"] = attempt + 1
+                    if attempt:
+                        logging.info("--taking over job <" + job.jobID + "> from a silent worker")
+                    return job, attempt + 1
+                # another worker got this attempt first
+                entry["attempt"] = attempt + 1
+            # the pass is over, the next claim lists the folder again
+            return (None, 0) if self.unfinished else None
+
+    def heartbeat(self, job, attempt):
+        '''touch the claim, False if the job has been taken over'''
+        if self.takenOver(job.jobID, attempt):
+            return False
+        try:
+            os.utime(self.path(job.jobID, CLAIM_EXTENSION, attempt), None)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def finish(self, job, attempt, record):
+        '''write the done or failed marker, if the job is still ours'''
+        if self.takenOver(job.jobID, attempt):
+            return False
+        extension = DONE_EXTENSION if record["state"] == STATE_DONE else FAILED_EXTENSION
+        return self.createExclusive(self.path(job.jobID, extension), json.dumps(record) + "\n")
+
+    def states(self):
+        '''jobID -> pending, running, done or failed'''
+        states = {}
+        for jobID, entry in self.scan().items():
+            if entry["done"]:
+                states[jobID] = STATE_DONE
+            elif entry["failed"]:
+                states[jobID] = STATE_FAILED
+            elif entry["attempt"]:
+                states[jobID] = STATE_RUNNING
+            else:
+                states[jobID] = STATE_PENDING
+        return states
+
+
+def jobRecord(job, state, exitCode, owner, outputs=None):
+    '''the same fields as a jobJournal record'''
+    return {"job": job.jobID,
+            "state": state,
+            "exitCode": exitCode,
+            "time": str(datetime.now()),
+            "host": socket.gethostname(),
+            "worker": owner,
+            "outputs": outputs or []}
+
+
+def runClaimedJob(queue, job, attempt, heartbeatSeconds, timeout=None):
+    '''
+    run the job, touching its claim every heartbeatSeconds. Returns the exit
+    code, or None if another worker took the job over
+    '''
+    logging.info("--running job <" + job.jobID + "> (attempt " + str(attempt) + ")")
+    # own process group, so the whole shell pipeline can be stopped
+    process = subprocess.Popen(job.command, shell=True, start_new_session=True)
+    started = lastBeat = time.monotonic()
+    while True:
+        try:
+            return process.wait(timeout=min(POLL_SECONDS, heartbeatSeconds))
+        except subprocess.TimeoutExpired:
+            pass
+        now = time.monotonic()
+        if timeout and now - started > timeout:
+            logging.error("--job <" + job.jobID + "> timed out after " + str(timeout) + "s")
+            stopProcess(process)
+            return -1
+        if now - lastBeat >= heartbeatSeconds:
+            lastBeat = now
+            if not queue.heartbeat(job, attempt):
+                logging.error("--job <" + job.jobID + "> was taken over by another worker, stopping it")
+                stopProcess(process)
+                return None
+
+
+def stopProcess(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=POLL_SECONDS)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def worker(queue, owner, heartbeatSeconds, timeout=None):
+    '''claim and run jobs until every job is done or failed, returns the number of jobs this worker failed'''
+    failures = 0
+    while True:
+        claimed = queue.claim(owner)
+        if claimed is None:
+            return failures
+        job, attempt = claimed
+        if job is None:
+            # the remaining jobs are running elsewhere, wait in case their owner goes silent
+            time.sleep(POLL_SECONDS)
+            continue
+        # output from an earlier, interrupted attempt
+        if job.outputFolder and os.path.isdir(job.outputFolder):
+            logging.info("--removing partial output for <" + job.jobID + ">")
+            shutil.rmtree(job.outputFolder, ignore_errors=True)
+        exitCode = runClaimedJob(queue, job, attempt, heartbeatSeconds, timeout)
+        if exitCode is None:
+            continue
+        if exitCode == 0:
+            mirawJobs.writeCompletionMarker(job.outputFolder)
+            record = jobRecord(job, STATE_DONE, exitCode, owner, mirawJobs.collectOutputs(job.outputFolder))
+        else:
+            record = jobRecord(job, STATE_FAILED, exitCode, owner)
+        if not queue.finish(job, attempt, record):
+            logging.info("--job <" + job.jobID + "> was taken over by another worker")
+        elif exitCode == 0:
+            logging.info("--job <" + job.jobID + "> done")
+        else:
+            failures += 1
+            logging.error("--job <" + job.jobID + "> failed with exit code <" + str(exitCode) + ">")
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='run miRAW jobs from a work queue on a shared filesystem')
+
+    parser.add_argument("-s", "--script", dest='scriptFile',
+                        help="shell script generated by miRAWbatch")
+    parser.add_argument("-q", "--queue", dest='queueFolder',
+                        help="queue folder on the shared filesystem [default: script + .queue]")
+    parser.add_argument("-n", "--workers", dest='workers', type=int, default=1,
+                        help="number of workers on this node")
+    parser.add_argument("-T", "--timeout", dest='timeout', type=int,
+                        help="maximum run time for a job in seconds")
+    parser.add_argument("--heartbeat", dest='heartbeat', type=float, default=HEARTBEAT_SECONDS,
+                        help="seconds between heartbeats [default: " + str(HEARTBEAT_SECONDS) + "]")
+    parser.add_argument("--stale", dest='stale', type=float, default=STALE_SECONDS,
+                        help="take over jobs without a heartbeat for this many seconds [default: "
+                             + str(STALE_SECONDS) + "]")
+    parser.add_argument("--max-attempts", dest='maxAttempts', type=int, default=MAX_ATTEMPTS,
+                        help="mark a job failed after this many claims [default: " + str(MAX_ATTEMPTS) + "]")
+    parser.add_argument("--status", action="store_true",
+                        help="print the job states and stop")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking script file:")
+    if not args.scriptFile:
+        logging.error("----you need to specify a script file using the -s/--script parameter")
+        printHelpAndExit()
+    if not os.path.isfile(args.scriptFile):
+        logging.error("--can't find script file at <" + args.scriptFile + ">")
+        sys.exit(1)
+    if not args.queueFolder:
+        args.queueFolder = args.scriptFile + QUEUE_EXTENSION
+    logging.info("--queue is <" + args.queueFolder + ">")
+    if args.workers < 1:
+        logging.error("--the number of workers (-n) needs to be at least 1")
+        sys.exit(1)
+    if args.stale <= 2 * args.heartbeat:
+        logging.error("--the stale time (--stale) needs to be more than twice the heartbeat (--heartbeat)")
+        sys.exit(1)
+    logging.info("--OK")
+
+
+def printStatus(queue):
+    counts = {}
+    for state in queue.states().values():
+        counts[state] = counts.get(state, 0) + 1
+    for state in sorted(counts):
+        logging.info("--" + state + "\t" + str(counts[state]))
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+
+    jobs = mirawJobs.readJobScript(args.scriptFile)
+    logging.info("read <" + str(len(jobs)) + "> jobs from <" + args.scriptFile + ">")
+    queue = JobQueue(args.queueFolder, jobs, args.stale, args.maxAttempts)
+
+    if args.status:
+        printStatus(queue)
+        return 0
+
+    owners = [socket.gethostname() + ":" + str(os.getpid()) + ":" + str(i) for i in range(args.workers)]
+    threads = [threading.Thread(target=worker, args=(queue, owner, args.heartbeat, args.timeout))
+               for owner in owners]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    printStatus(queue)
+    if any(state == STATE_FAILED for state in queue.states().values()):
+        logging.error("some jobs failed, see the .failed files in <" + args.queueFolder + ">")
+        return 1
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run one task from a job array manifest written by miRAWbatch.py -A
+
+    python launchMiRAWtask.py -m /remote/expt.manifest.tsv -i $SLURM_ARRAY_TASK_ID
+
+-m the manifest file
+-i the task index (0 based)
+-w folder for the unified file and .properties file of the task
+   (default: $TMPDIR). Both are removed once miRAW has finished
+-k keep the unified file and .properties file
+--dry write the task files and print the miRAW command without running it
+
+miRAW writes its results to ExperimentFolder/ExperimentName as usual,
+so the output is the same as for a script generated without -A.
+"""
+
+import os
+import sys
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import jobManifest
+import mirawJobs
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='run one task from a miRAW job array manifest')
+
+    parser.add_argument("-m", "--manifest", dest='manifestFile',
+                        help="manifest file written by miRAWbatch -A")
+    parser.add_argument("-i", "--task", dest='taskIndex', type=int,
+                        help="task index")
+    parser.add_argument("-w", "--workFolder", dest='workFolder',
+                        help="folder for the task files [default: $TMPDIR]")
+    parser.add_argument("-k", "--keep", action="store_true",
+                        help="keep the task files after the run")
+    parser.add_argument("--dry", action="store_true",
+                        help="write the task files and print the command, but don't run miRAW")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking manifest:")
+    if not args.manifestFile:
+        logging.error("----you need to specify a manifest using the -m/--manifest parameter")
+        printHelpAndExit()
+    if not os.path.isfile(args.manifestFile):
+        logging.error("--can't find manifest at <" + args.manifestFile + ">")
+        sys.exit(1)
+    if args.taskIndex is None:
+        logging.error("----you need to specify a task using the -i/--task parameter")
+        printHelpAndExit()
+    if not args.workFolder:
+        args.workFolder = os.environ.get("TMPDIR", tempfile.gettempdir())
+    if not os.path.isdir(args.workFolder):
+        os.makedirs(args.workFolder)
+    logging.info("--OK")
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+
+    propertiesFile, unifiedFile, meta, task = jobManifest.materializeTask(
+        args.manifestFile, args.taskIndex, args.workFolder)
+    logging.info("task <" + str(args.taskIndex) + "> is <" + task["FEATURE"] + "> ("
+                 + task["ROWS"] + " rows)")
+
+    # with hashed subfolders (miRAWbatch -F) the experiment folder may not exist yet
+    experimentFolder = mirawJobs.readPropertiesFile(propertiesFile).get(mirawJobs.EXPERIMENT_FOLDER_KEY)
+    if experimentFolder and not os.path.isdir(experimentFolder):
+        os.makedirs(experimentFolder, exist_ok=True)
+
+    javaCommand = ["java", "-jar", meta[jobManifest.JAR_LOCATION_KEY], "GenePrediction", "predict", propertiesFile]
+    if args.dry:
+        logging.info(" ".join(javaCommand))
+        return 0
+
+    try:
+        exitCode = subprocess.call(javaCommand)
+    finally:
+        if not args.keep:
+            os.remove(unifiedFile)
+            os.remove(propertiesFile)
+    if exitCode != 0:
+        logging.error("--miRAW exited with code <" + str(exitCode) + ">")
+    return exitCode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,9 +7,12 @@ import csv
 from datetime import datetime
 import hashlib
 
+import compressedIO
+import stageProfiler
+import hotPathLog
+
 DEBUG = 1
 TESTRUN = 0
-PROFILE = 0
 
 MY_NEWLINE = "\n"
 if os.name== "Windows":
@@ -111,6 +114,7 @@ def initLogger(md5string):
     logging.info("project log file is <" + logfileName + ">")
     logging.info("+" + "*" * 78 + "+")
     logging.debug("debug mode is on")
+    return logfileName
 
 
 #GeneName    GeneId    miRNA    Prediction    HighestPredVal    LowestPredVal    PosSites    NegSites    RemovedSites        miRNA    miRNA
@@ -247,6 +251,12 @@ def parseArgs(argv):
                             help="keep positive predictions, remove negative prediction")
         parser.add_argument("-N", "--extract_neg_preds", action="store_true",
                             help="keep negative predictions, remove positive predictions")
+        parser.add_argument("--profile", action="store_true",
+                            help="write per stage timing and memory use to a .profile.json file in logfiles")
+        parser.add_argument("--cprofile", action="store_true",
+                            help="as --profile, and also dump cProfile stats for each stage")
+        parser.add_argument("--trace", action="store_true",
+                            help="log every row and comparison (slow on large files)")
         global args
         args = parser.parse_args()
         if args.HelpMe:
@@ -325,6 +335,15 @@ def printLongHelpAndExit():
     logging.info("+          for example, high numbered/low confidence                           +")
     logging.info("+          or miRNAs in which you are particularly interested)                 +")
     logging.info("+                                                                              +")
+    logging.info("+      profile the run                             (--profile)                 +")
+    logging.info("+         (writes wall/cpu time, peak memory and rows processed for            +")
+    logging.info("+          each stage to logfiles/<logfile>.profile.json                       +")
+    logging.info("+          use --cprofile to also dump cProfile stats for each stage)          +")
+    logging.info("+                                                                              +")
+    logging.info("+      log every row                               (--trace)                   +")
+    logging.info("+         (by default only progress lines, one debug line in 10000 rows        +")
+    logging.info("+          and a summary are logged for the row by row steps)                  +")
+    logging.info("+                                                                              +")
     logging.info("+   filtering is performed in the order                                        +")
     logging.info("+      listFilter->Conflicts->PosCutOff->NegCutOff->ExtractPos/Neg Preds       +")
     logging.info("+                ->BindingEnergy                                               +")
@@ -443,7 +462,7 @@ def checkTargetPredictionFile():
     global miRAWtargetPredictionFile, filteredTargetPredictionFile, logFileName
     logging.info("check TargetPredictionFile")
     if args.targetPredFile:
-        miRAWtargetPredictionFile=args.targetPredFile
+        miRAWtargetPredictionFile=compressedIO.resolvePath(args.targetPredFile)
         filteredTargetPredictionFile=miRAWtargetPredictionFile.replace(TARGET_FILE_EXTENSION, \
                                                                        FILTERED_TARGET_FILE_EXTENSION)
         logging.info("--Target Prediction File is " + miRAWtargetPredictionFile)
@@ -460,7 +479,7 @@ def checkPositiveTargetsFile():
     global filteredPositiveSitesDetailedFile
     logging.info("check PositiveTargetsFile")
     if args.targetSiteFile:
-        miRAWpositiveSitesFile=args.targetSiteFile
+        miRAWpositiveSitesFile=compressedIO.resolvePath(args.targetSiteFile)
         filteredPositiveSitesFile=miRAWpositiveSitesFile.replace(SITES_FILE_EXTENSION, \
                                                                        FILTERED_SITES_FILE_EXTENSION)
         filteredPositiveSitesDetailedFile=miRAWpositiveSitesFile.replace(SITES_FILE_EXTENSION, \
@@ -479,7 +498,7 @@ def checkUnifiedInputFile():
     global miRAWunifiedFile, filteredUnifiedFile
     logging.info("check unifiedFile")
     if args.unifiedInputFile:
-        miRAWunifiedFile=args.unifiedInputFile
+        miRAWunifiedFile=compressedIO.resolvePath(args.unifiedInputFile)
         filteredUnifiedFile=miRAWunifiedFile.replace(UNIFIED_FILE_EXTENSION, \
                                                                        FILTERED_UNIFIED_FILE_EXTENSION)
         logging.info("--Unified Input File is " + miRAWunifiedFile)
@@ -497,6 +516,7 @@ def checkForBadFlagCombinations():
         
 
 
+@stageProfiler.stage
 def readPositiveSitesFile():
     logging.info("read PositiveSiteFile")
     global miRAWpositiveSitesFile, positiveSiteLines
@@ -544,7 +564,7 @@ def readPositiveSitesFile():
     gReason = []
     gAdditionalProperties = []
 
-    with open(miRAWpositiveSitesFile, 'r') as fP:
+    with compressedIO.openFile(miRAWpositiveSitesFile, 'r') as fP:
         positiveSiteLines = fP.readlines()
         p=0
         for line in positiveSiteLines:
@@ -582,17 +602,19 @@ def readPositiveSitesFile():
                 
     logging.info("--read <" + str(len(positiveSiteLines)) + "> lines")            
     logging.info("--read <" + str(len(dropPredictions)) + "> target pairs")
+    stageProfiler.addRows(len(positiveSiteLines) - 1)
     logging.info("--done")
         
  
     
     
     
+@stageProfiler.stage
 def readUnifiedFile():
     logging.info("read UnifiedFile")
     global utrSequences
     
-    with open(miRAWunifiedFile, 'r') as fF:
+    with compressedIO.openFile(miRAWunifiedFile, 'r') as fF:
         utrLines = fF.readlines()
         u=0
         for line in utrLines:
@@ -601,6 +623,7 @@ def readUnifiedFile():
                 if not utrID in utrSequences:
                     utrSequences[utrID] = line.split("\t")[UNIFIED_UTRSEQ_COL]
             u+=1       
+        stageProfiler.addRows(len(utrLines) - 1)
     logging.info("--read " + str(len(utrSequences)) + " 3'UTR sequence(s)")
     logging.info("--done")     
 
@@ -609,11 +632,12 @@ def readUnifiedFile():
 
     
     
+@stageProfiler.stage
 def readTargetPredictionFile():
     logging.info("read TargetPredictionFile")
     global miRAWtargetPredictionFile      
 
-    with open(miRAWtargetPredictionFile,'r') as fT:
+    with compressedIO.openFile(miRAWtargetPredictionFile,'r') as fT:
  
         targetLines = fT.readlines()
         l=0
@@ -634,6 +658,7 @@ def readTargetPredictionFile():
                 #dropPredictions.append(0)
             l+=1
     logging.info("--read " + str(len(geneNames)) + "3'UTR/miRNA prediction pairs")
+    stageProfiler.addRows(len(geneNames))
     logging.info("--done")     
             
             
@@ -656,15 +681,21 @@ def filterByList():
     logging.info("filter by list")
     global filterDropCount, filteredMiRNAList, totalDrops
     filterDropCount = 0
+    trace = hotPathLog.tracing
+    progress = hotPathLog.HotPathCounter("filter by list", total=len(filteredMiRNAList) * len(miRNANames))
     for filterMiRName in filteredMiRNAList:
         filterMiRName = filterMiRName.strip()
+        progress.tick(len(miRNANames))
         r = 0
         for miRNAName in miRNANames:
-            logging.debug(filterMiRName + "\t" + miRNAName)
+            if trace:
+                logging.debug(filterMiRName + "\t" + miRNAName)
             if(filterMiRName == miRNAName):
                 dropPredictions[r] = 1
                 filterDropCount += 1
             r += 1
+    progress.count("dropped", filterDropCount)
+    progress.finish()
 
     logging.info("--Dropped " + str(filterDropCount) + " entries")
     totalDrops += filterDropCount
@@ -700,11 +731,18 @@ def filterByMFEAndProbability():
 
     r = 0
     keepCount = 0
+    progress = hotPathLog.HotPathCounter("filter by MFE", total=len(dropPredictions))
     while r < len(dropPredictions):
+        progress.tick()
         if float(gMFE[r]) < -bindingEnergyCutoff and float(gPrediction[r]) > positiveProbabilityCutoff:
             dropPredictions[r]=1
             keepCount += 1
+        if progress.sampled():
+            logging.debug("--" + gGeneName[r] + "\t" + gMiRNA[r] + "\tMFE " + gMFE[r]
+                          + "\tprediction " + gPrediction[r] + "\tkeep " + str(dropPredictions[r]))
         r += 1
+    progress.count("kept", keepCount)
+    progress.finish()
 
     logging.info("--kept " + str(keepCount) + " entries")
 
@@ -804,8 +842,8 @@ def summarizeFiltering():
 
 def grabTargetPairLines(queryLine): 
     global positiveSiteLocations, positiveSiteLines
-    logging.info(queryLine)
-    logging.info(positiveSiteLocations[queryLine])
+    if hotPathLog.tracing:
+        logging.debug(queryLine + "\t" + str(positiveSiteLocations[queryLine]))
     
     lineNo = positiveSiteLocations[queryLine]
     queryLines = []
@@ -829,8 +867,10 @@ def writeFilteredDetailedData():
     logging.info(" write filtered detailed Data")
     
     r = 0
-    with open(filteredPositiveSitesDetailedFile,'w') as fD:
+    progress = hotPathLog.HotPathCounter("write detailed data", total=len(dropPredictions))
+    with compressedIO.openFile(filteredPositiveSitesDetailedFile,'w') as fD:
         while r<len(dropPredictions):
+            progress.tick()
             if dropPredictions[r]==0:
                 targetQuery=geneIDs[r]+ UTR_QUERY_DELIMITER + miRNANames[r]
                 
@@ -851,7 +891,9 @@ def writeFilteredDetailedData():
                 for targetLine in targetLines:
                     utrStart = int(targetLine.split("\t")[0])-1
                     utrStop = int(targetLine.split("\t")[1])-1
-                    logging.info(str(utrStart) + ":" + str(utrStop))
+                    if progress.sampled():
+                        logging.debug("--" + targetQuery + "\t" + str(utrStart) + ":" + str(utrStop))
+                    progress.count("site lines")
                     fD.write(predictionOutputString + "\t" + \
                              targetLine.strip() + "\t" + \
                              miRNASequences[miRNANames[r]] + "\t" + \
@@ -859,11 +901,13 @@ def writeFilteredDetailedData():
                              MY_NEWLINE)
 
             r += 1
+    progress.finish()
     logging.info("--finished")
     
     
 
 
+@stageProfiler.stage
 def writeFilteredPositiveData():
     logging.info(" write filtered Positive Site Data")
 
@@ -890,11 +934,13 @@ def writeFilteredPositiveData():
     filterLine = "__e" + str(bindingEnergyCutoff) + "_p_" + str(positiveProbabilityCutoff)
     filteredTargetPredictionFile = miRAWpositiveSitesFile.replace(".csv", filterLine + ".csv")
     r = 0
-    with open(filteredTargetPredictionFile, 'w') as fT:
+    with compressedIO.openFile(filteredTargetPredictionFile, 'w') as fT:
         fT.write(headerString + MY_NEWLINE)
         #fT.write(HEADER_LINE + MY_NEWLINE)
         fT.write(positiveTargetsHeaderLine )
+        progress = hotPathLog.HotPathCounter("write positive sites", total=len(dropPredictions))
         while r < len(dropPredictions):
+            progress.tick()
             if dropPredictions[r] == 1:
                 fT.write(gGeneName[r] + "\t" + \
                          gMiRNA[r] + "\t" + \
@@ -917,6 +963,8 @@ def writeFilteredPositiveData():
                          gReason[r] + "\t" + MY_NEWLINE)
 
             r += 1
+        progress.finish()
+    stageProfiler.addRows(dropPredictions.count(1))
     logging.info("--finished")
 
 
@@ -939,6 +987,7 @@ def checkArgs():
     checkForBadFlagCombinations()
 
 
+@stageProfiler.stage
 def filterData():
     global extractConflictPredictions, keepConflictPredictions
     logging.info("filterData")
@@ -962,6 +1011,7 @@ def filterData():
     #    filterByPositive()
     #if extractNegativePredictions:
     #    filterByNegative()
+    stageProfiler.addRows(len(dropPredictions))
     summarizeFiltering()
 
 
@@ -971,7 +1021,11 @@ def main(argv=None):  # IGNORE:C0111
 
     parseArgs(argv)
     checkArgs()
-    initLogger(md5String)
+    logfileName = initLogger(md5String)
+    if args.trace:
+        hotPathLog.enableTrace()
+    if args.profile or args.cprofile:
+        stageProfiler.enable(logfileName, cprofile=args.cprofile)
     readUnifiedFile()
     readPositiveSitesFile()
     readTargetPredictionFile()
@@ -979,6 +1033,9 @@ def main(argv=None):  # IGNORE:C0111
     filterData()
     writeFilteredPositiveData()
     #writeFilteredDetailedData()
+    reportFile = stageProfiler.writeReport()
+    if reportFile:
+        logging.info("profile written to <" + reportFile + ">")
 
 if __name__ == "__main__":
     if DEBUG:
@@ -990,18 +1047,6 @@ if __name__ == "__main__":
         import doctest
 
         doctest.testmod()
-    if PROFILE:
-        import cProfile
-        import pstats
-
-        profile_filename = 'fairpype.virusPipe_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
-        sys.exit(0)
     sys.exit(main())
 
 
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-process access to a miRAW result folder.
+
+    from miRAWResults import MiRAWResults
+
+    results = MiRAWResults("/data/miRAW_targets/karlsen_isos.MIMAT0000087_hsa-miR-30a-5p_GTAAACA_iso")
+    selected = results.sites.probability(0.8).mfe(15).withoutConflicts()
+    len(selected)
+    df = selected.toPandas(["GeneName", "miRNA", "Prediction", "MFE"])
+    mfe = selected.toNumpy("MFE")
+
+The result files (targetPredictionOutput.csv, allTargetSites.csv,
+positiveTargetSites.csv and negativeTargetSites.csv, optionally compressed)
+are found when the folder is opened, but a column is only read the first
+time it is needed. The filters return a new Selection and are combined into
+one mask when the selection is counted or materialised. Columns and the
+mask of each filter are kept by the MiRAWResults object, so the same filter
+is not evaluated twice in a session.
+
+The filters work as in miRAWResultFilterer.py and extractConflicts.py
+
+    probability(p)        Prediction > p
+    mfe(e)                MFE < -|e|
+    miRNAs(names)         miRNA in names (exclude=True to drop them)
+    genes(names)          any '|' separated field of GeneName in names
+    withoutConflicts()    drop the (3'UTR, miRNA) pairs with positive and negative
+    onlyConflicts()       sites in targetPredictionOutput.csv (or keep only them)
+"""
+
+import os
+import operator
+import functools
+
+import numpy as np
+import pandas as pd
+
+import compressedIO
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+# table name -> file name ending
+RESULT_FILES = {
+    "predictions": "targetPredictionOutput.csv",
+    "sites": "allTargetSites.csv",
+    "positives": "positiveTargetSites.csv",
+    "negatives": "negativeTargetSites.csv",
+}
+GENE_COLUMN = "GeneName"
+MIRNA_COLUMN = "miRNA"
+PREDICTION_COLUMN = "Prediction"
+MFE_COLUMN = "MFE"
+POSITIVE_SITES_COLUMN = "PosSites"
+NEGATIVE_SITES_COLUMN = "NegSites"
+# site prediction columns that are read as text
+TEXT_COLUMNS = ["GeneName", "GeneId", "miRNA", "SiteTranscript", "MatureMiRNATranscript", "BracketNotation",
+                "Filtering", "Reason", "AdditionalProperties"]
+
+
+def findResultFile(resultFolder, ending):
+    '''the file in resultFolder whose name (without compression extension) ends with ending, or None'''
+    matches = sorted(fileName for fileName in os.listdir(resultFolder)
+                     if compressedIO.splitCompressionExtension(fileName)[0].endswith(ending))
+    if not matches:
+        return None
+    # prefer <prefix>.allTargetSites.csv over e.g. <prefix>.pairing.allTargetSites.csv
+    return os.path.join(resultFolder, min(matches, key=len))
+
+
+class ResultTable(object):
+    '''one result file, read column by column on first access'''
+
+    def __init__(self, results, name, filePath):
+        self.results = results
+        self.name = name
+        self.filePath = filePath
+        self._header = None
+        self._columns = {}
+        self._masks = {}
+
+    @property
+    def header(self):
+        if self._header is None:
+            with compressedIO.openFile(self.filePath, 'r') as fT:
+                self._header = fT.readline().rstrip("\r\n").split("\t")
+        return self._header
+
+    def readColumns(self, columns):
+        '''read the columns that haven't been read yet, in one pass over the file'''
+        missing = [column for column in columns if column not in self._columns]
+        if not missing:
+            return
+        unknown = [column for column in missing if column not in self.header]
+        if unknown:
+            raise KeyError("<" + self.filePath + "> has no column(s) " + ", ".join(unknown))
+        dtypes = {column: str for column in missing if column in TEXT_COLUMNS}
+        table = compressedIO.readTable(self.filePath, sep='\t', usecols=missing, dtype=dtypes,
+                                       keep_default_na=False, na_values=[""])
+        for column in missing:
+            self._columns[column] = table[column].to_numpy()
+
+    def column(self, column):
+        self.readColumns([column])
+        return self._columns[column]
+
+    def __len__(self):
+        return len(self.column(self.header[0]))
+
+    def memoMask(self, key, build):
+        '''the mask for key, built once'''
+        if key not in self._masks:
+            self._masks[key] = build()
+        return self._masks[key]
+
+    def validRows(self):
+        '''
+        rows that are sites (or predictions). Detailed files have extra lines starting
+        with the site position, these are skipped as in miRAWResultFilterer.py
+        '''
+        def build():
+            first = pd.Series(self.column(self.header[0]), dtype=str)
+            return ~first.str.isdigit().to_numpy()
+        return self.memoMask(("valid",), build)
+
+    def pairKeys(self):
+        '''(3'UTR, miRNA) of every row, as one string'''
+        def build():
+            return pd.Series(self.column(GENE_COLUMN), dtype=str) + "\t" + pd.Series(self.column(MIRNA_COLUMN), dtype=str)
+        return self.memoMask(("pairKeys",), build)
+
+    def selection(self):
+        return Selection(self, ())
+
+    def clearCache(self):
+        self._columns.clear()
+        self._masks.clear()
+
+
+class Selection(object):
+    '''a result table and a chain of filters, evaluated when needed'''
+
+    def __init__(self, table, filters):
+        self.table = table
+        self.filters = filters
+
+    def _with(self, *spec):
+        return Selection(self.table, self.filters + (spec,))
+
+    def probability(self, cutoff):
+        '''keep Prediction > cutoff'''
+        return self._with("probability", float(cutoff))
+
+    def mfe(self, cutoff):
+        '''keep MFE < -|cutoff|'''
+        return self._with("mfe", abs(float(cutoff)))
+
+    def miRNAs(self, names, exclude=False):
+        '''keep the miRNAs in names (exclude=True: drop them)'''
+        return self._with("miRNAs", frozenset(name.strip() for name in names), bool(exclude))
+
+    def genes(self, names, exclude=False):
+        '''keep the 3'UTRs with a GeneName field in names (exclude=True: drop them)'''
+        return self._with("genes", frozenset(name.strip() for name in names), bool(exclude))
+
+    def withoutConflicts(self):
+        return self._with("conflicts", False)
+
+    def onlyConflicts(self):
+        return self._with("conflicts", True)
+
+    def filterMask(self, spec):
+        table = self.table
+        kind = spec[0]
+        if kind == "probability":
+            build = lambda: table.column(PREDICTION_COLUMN).astype(np.float64) > spec[1]
+        elif kind == "mfe":
+            build = lambda: table.column(MFE_COLUMN).astype(np.float64) < -spec[1]
+        elif kind == "miRNAs":
+            build = lambda: np.isin(table.column(MIRNA_COLUMN), list(spec[1])) != spec[2]
+        elif kind == "genes":
+            def build():
+                fields = pd.Series(table.column(GENE_COLUMN), dtype=str).str.split("|").explode()
+                found = fields.isin(spec[1]).groupby(level=0).any().to_numpy()
+                return found != spec[2]
+        elif kind == "conflicts":
+            def build():
+                conflicts = self.table.results.conflictPairs()
+                return table.pairKeys().isin(list(conflicts)).to_numpy() == spec[1]
+        else:
+            raise ValueError("unknown filter <" + kind + ">")
+        return table.memoMask(spec, build)
+
+    def mask(self):
+        '''one boolean mask for all the filters'''
+        key = ("selection", frozenset(self.filters))
+        return self.table.memoMask(key, lambda: functools.reduce(
+            operator.and_, [self.filterMask(spec) for spec in self.filters], self.table.validRows()))
+
+    def rows(self):
+        return np.flatnonzero(self.mask())
+
+    def __len__(self):
+        return int(self.mask().sum())
+
+    def toNumpy(self, column):
+        return self.table.column(column)[self.mask()]
+
+    def toPandas(self, columns=None):
+        '''the selected rows as a DataFrame, with all columns unless columns is given'''
+        columns = list(columns) if columns else self.table.header
+        self.table.readColumns(columns)
+        rows = self.rows()
+        return pd.DataFrame({column: self.table.column(column)[rows] for column in columns}, index=rows)
+
+    def __repr__(self):
+        return "Selection(" + self.table.name + ", " + str(list(self.filters)) + ")"
+
+
+class MiRAWResults(object):
+    '''the result files of one miRAW run'''
+
+    def __init__(self, resultFolder):
+        self.resultFolder = resultFolder
+        self.tables = {}
+        for name, ending in RESULT_FILES.items():
+            filePath = findResultFile(resultFolder, ending)
+            if filePath:
+                self.tables[name] = ResultTable(self, name, filePath)
+        if not self.tables:
+            raise IOError("no miRAW result files found in <" + resultFolder + ">")
+        self._conflicts = None
+
+    def table(self, name):
+        if name not in self.tables:
+            raise KeyError("no " + RESULT_FILES[name] + " file in <" + self.resultFolder + ">")
+        return self.tables[name]
+
+    @property
+    def predictions(self):
+        return self.table("predictions").selection()
+
+    @property
+    def sites(self):
+        return self.table("sites").selection()
+
+    @property
+    def positives(self):
+        return self.table("positives").selection()
+
+    @property
+    def negatives(self):
+        return self.table("negatives").selection()
+
+    def conflictPairs(self):
+        '''(3'UTR, miRNA) pairs with both positive and negative sites, as in extractConflicts.py'''
+        if self._conflicts is None:
+            predictions = self.table("predictions")
+            conflicted = (predictions.column(POSITIVE_SITES_COLUMN).astype(np.int64) > 0) \
+                & (predictions.column(NEGATIVE_SITES_COLUMN).astype(np.int64) > 0) & predictions.validRows()
+            self._conflicts = frozenset(predictions.pairKeys()[conflicted])
+        return self._conflicts
+
+    def clearCache(self):
+        '''forget the columns and masks read so far'''
+        for table in self.tables.values():
+            table.clearCache()
+        self._conflicts = None
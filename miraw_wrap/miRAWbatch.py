@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 import argparse
+import re
 import sys
 import os
 import logging
 import datetime
-from Bio import SeqIO
+
+import compressedIO
+import jobManifest
+import hashedLayout
+import sharding
+import costModel
+import unifiedSplit
+import fastaIndex
+import fastaReader
 
 buildUnifiedFile = False
 
@@ -37,6 +46,12 @@ miRseqList = []
 UTRheaderList = []
 UTRseqList = []
 
+# --dry-run calibration constants (see costModel.py)
+calibration = None
+
+# with --shard, counts the pairs or features this shard writes (see sharding.py)
+shardRecord = None
+
 
 splitData = False
 MY_NEWLINE = "\n"
@@ -92,6 +107,39 @@ def parseArgs():
     parser.add_argument("-E", "--energy_filtering", action="store_true",
                         help="perform energy filtering on results")
 
+    parser.add_argument("-Z", "--compress", dest="compressUnifiedFile", choices=["gz", "bgz", "zst"],
+                        help="compress generated unifiedFiles (gz, bgz or zst)")
+    parser.add_argument("-A", "--array", dest="jobArray", action="store_true",
+                        help="write a job array manifest instead of one file per split (-t 3/4)")
+    parser.add_argument("-F", "--fanout", dest="fanout", action="store_true",
+                        help="put the files for each split in hashed subfolders (-t 3/4)")
+    parser.add_argument("-L", "--launcherLoc", dest="launcherLocation",
+                        help="location of launchMiRAWtask.py on the remote computer")
+    parser.add_argument("--shard", dest="shard",
+                        help="only write shard i of N (i/N, -t 1-4), see sharding.py")
+    parser.add_argument("--dry-run", dest="dryRun", action="store_true",
+                        help="read the fastA files and estimate the size and cost of the run, write nothing")
+    parser.add_argument("--calibration", dest="calibrationFile",
+                        help="calibration file written by costModel.py, for the --dry-run estimates")
+    parser.add_argument("--miRPrefix", dest="miRPrefix",
+                        help="comma separated id prefixes (e.g. hsa-) of the miRNAs to use")
+    parser.add_argument("--miRList", dest="miRList",
+                        help="file with the ids or names of the miRNAs to use, one per line")
+    parser.add_argument("--miRRegex", dest="miRRegex",
+                        help="only use the miRNAs whose fastA header matches this regular expression")
+    parser.add_argument("--utrPrefix", dest="utrPrefix",
+                        help="comma separated id prefixes (e.g. ENSG) of the 3'UTRs to use")
+    parser.add_argument("--utrList", dest="utrList",
+                        help="file with the ids or gene names of the 3'UTRs to use, one per line")
+    parser.add_argument("--utrRegex", dest="utrRegex",
+                        help="only use the 3'UTRs whose fastA header matches this regular expression")
+    parser.add_argument("--chunks", dest="chunks", type=int,
+                        help="split an existing unifiedFile (-u, -t 0) into N chunks with about the same work")
+    parser.add_argument("--maxRows", dest="maxRows", type=int,
+                        help="most rows in each file when splitting an existing unifiedFile (-u)")
+    parser.add_argument("--maxBytes", dest="maxBytes", type=int,
+                        help="most bytes in each file when splitting an existing unifiedFile (-u)")
+
     args = parser.parse_args()
     return args
 
@@ -156,6 +204,45 @@ def printLongHelpAndExit():
     logging.info("+                                                                              +")
     logging.info("+          allowed values are (True/False)                                     +")
     logging.info("+                                                                              +")
+    logging.info("+      - compress the generated unifiedFiles       (-Z/--compress)             +")
+    logging.info("+          allowed values are (gz/bgz/zst). The shell script unpacks           +")
+    logging.info("+          each file just before miRAW runs and removes it afterwards          +")
+    logging.info("+                                                                              +")
+    logging.info("+      - write a job array manifest                (-A/--array)                +")
+    logging.info("+          only with -t 3/4. Writes one chunk file, one template               +")
+    logging.info("+          .properties file and a manifest instead of one unifiedFile          +")
+    logging.info("+          and .properties file per split. Each task is run with               +")
+    logging.info("+          launchMiRAWtask.py -m <manifest> -i <task>                          +")
+    logging.info("+      - location of launchMiRAWtask.py            (-L/--launcherLoc)          +")
+    logging.info("+          default is the folder containing miRAWbatch.py                      +")
+    logging.info("+      - use hashed subfolders                     (-F/--fanout)               +")
+    logging.info("+          only with -t 3/4. The files and miRAW results for each split        +")
+    logging.info("+          go to outFolder/ab/cd/ instead of outFolder. The result folders     +")
+    logging.info("+          are listed in <exptName>.experiments.tsv                            +")
+    logging.info("+      - only write shard i of N                   (--shard i/N)               +")
+    logging.info("+          with -t 1/2 the (miRNA, 3'UTR) pairs, with -t 3/4 the splits        +")
+    logging.info("+          are assigned to shards by a hash of their names. Outputs are        +")
+    logging.info("+          named <exptName>.shard<i>of<N>. Check the shards are complete       +")
+    logging.info("+          with sharding.py                                                    +")
+    logging.info("+      - estimate the run, write nothing           (--dry-run)                 +")
+    logging.info("+          reads -m/-3 and reports pairs, windows, unifiedFile bytes           +")
+    logging.info("+          and CPU-hours for each split mode. Use --calibration with           +")
+    logging.info("+          a file written by costModel.py to tune the CPU-hours                +")
+    logging.info("+      - split an existing unifiedFile (-u)        (-t 3/4, --chunks N)        +")
+    logging.info("+          -t 3/4 write one file per miRNA/3'UTR, -t 0 --chunks N writes       +")
+    logging.info("+          N chunks with about the same number of windows. The file is         +")
+    logging.info("+          read one row at a time                                              +")
+    logging.info("+      - most rows/bytes per file                  (--maxRows/--maxBytes)      +")
+    logging.info("+          with -u, larger miRNAs/3'UTRs continue in <name>.part2, ...         +")
+    logging.info("+      - only use some of the miRNAs               (--miRPrefix/--miRList/     +")
+    logging.info("+                                                   --miRRegex)                +")
+    logging.info("+        or 3'UTRs                                 (--utrPrefix/--utrList/     +")
+    logging.info("+                                                   --utrRegex)                +")
+    logging.info("+          id prefixes (comma separated), a file of ids or names (one per      +")
+    logging.info("+          line) and/or a regular expression on the fastA header. The          +")
+    logging.info("+          records are found through an index (<fastA>.fidx), which is         +")
+    logging.info("+          rebuilt when the fastA file changes                                 +")
+    logging.info("+                                                                              +")
     logging.info("+      - target site size (in nucleotides)         (--max_site_length)         +")
     logging.info("+          default 40nt                                                        +")
     logging.info("+      - step_size (in nucleotides)                (--seed_alignment_offset)   +")
@@ -278,17 +365,19 @@ def checkUnifiedFile(args):
                 logging.error("----can't find miRNA file at <" + args.miRFile + ">")
                 exit()
 
+        elif args.miRFile or args.utrFile:
+            logging.info("--missing miR or 3'UTR file")
+            logging.error("----you must specify both a miRFile and a 3'UTR file")
+            printHelpAndExit()
         else:
-            if os.path.isfile(args.miRFile) or os.path.isfile(args.utrFile):
-                logging.info("--missing miR or 3'UTR file")
-                logging.error("----you must specify both a miRFile and a 3'UTR file")
-                printHelpAndExit()
-            else:
-                logging.info("--using existing unifiedFile")
+            logging.error("----you need to specify a unified file using the -u/--unifiedFile parameter")
+            printHelpAndExit()
 
     else:
-        logging.info("----you need to specify a unified file using the -u/--unifiedFile parameter")
-        printHelpAndExit()
+        if not compressedIO.fileExists(args.unifiedFile):
+            logging.error("----can't find unifiedFile at <" + args.unifiedFile + ">")
+            sys.exit(1)
+        logging.info("--using existing unifiedFile")
     logging.info("--OK")
 
 
@@ -390,6 +479,80 @@ def checkSplit(args):
     logging.info("--OK")
 
 
+def checkJobArray(args):
+    logging.info("checking job array:")
+    if not args.jobArray:
+        logging.info("--OFF")
+        return
+    if not args.splitType or int(args.splitType) not in (SPLIT_BY_MIRNA, SPLIT_BY_UTR):
+        logging.error("----a job array manifest (-A/--array) can only be written for split 3 or 4")
+        printHelpAndExit()
+    if not args.launcherLocation:
+        args.launcherLocation = os.path.join(os.path.dirname(os.path.abspath(__file__)), "launchMiRAWtask.py")
+    logging.info("--launcher is <" + args.launcherLocation + ">")
+    logging.info("--OK")
+
+
+def checkFanout(args):
+    logging.info("checking fanout:")
+    if not args.fanout:
+        logging.info("--OFF")
+        return
+    if not args.splitType or int(args.splitType) not in (SPLIT_BY_MIRNA, SPLIT_BY_UTR):
+        logging.error("----hashed subfolders (-F/--fanout) can only be used for split 3 or 4")
+        printHelpAndExit()
+    logging.info("--OK")
+
+
+def checkShard(args):
+    logging.info("checking shard:")
+    if not args.shard:
+        logging.info("--OFF")
+        return
+    try:
+        args.shard = sharding.parseShard(args.shard)
+    except ValueError as e:
+        logging.error("----" + str(e))
+        printHelpAndExit()
+    if not args.splitType or int(args.splitType) == UNIFIEDFILE_EXISTS:
+        logging.error("----a shard (--shard) can only be written for split 1 to 4")
+        printHelpAndExit()
+    # each shard gets its own script, manifests and unifiedFiles
+    args.exptName = sharding.shardName(args.exptName, args.shard)
+    logging.info("--outputs are named <" + args.exptName + ">")
+    logging.info("--OK")
+
+
+def checkResplit(args):
+    logging.info("checking resplit:")
+    if not args.unifiedFile:
+        if args.chunks or args.maxRows or args.maxBytes:
+            logging.error("------chunks, --maxRows and --maxBytes can only be used with an existing unifiedFile (-u)")
+            printHelpAndExit()
+        logging.info("--OFF")
+        return
+    if not args.splitType:
+        args.splitType = str(UNIFIEDFILE_EXISTS)
+    if int(args.splitType) not in (UNIFIEDFILE_EXISTS, SPLIT_BY_MIRNA, SPLIT_BY_UTR):
+        logging.error("----an existing unifiedFile (-u) can only be split with -t 0, 3 or 4")
+        printHelpAndExit()
+    if args.jobArray or args.shard:
+        logging.error("-----A/--array and --shard can't be used with an existing unifiedFile (-u)")
+        printHelpAndExit()
+    if args.chunks and int(args.splitType) != UNIFIEDFILE_EXISTS:
+        logging.error("------chunks can only be used with -t 0, -t 3/4 already give one file per miRNA/3'UTR")
+        printHelpAndExit()
+    for option, value in (("--chunks", args.chunks), ("--maxRows", args.maxRows), ("--maxBytes", args.maxBytes)):
+        if value is not None and value < 1:
+            logging.error("----" + option + " needs to be a positive number <" + str(value) + ">")
+            printHelpAndExit()
+    if not isResplit(args):
+        logging.info("--OFF")
+        return
+    logging.info("--split <" + args.unifiedFile + ">")
+    logging.info("--OK")
+
+
 def checkEnergyFiltering(args):
     logging.info("EnergyFiltering")
     global filterByAccessibilityEnergy
@@ -404,11 +567,11 @@ def checkEnergyFiltering(args):
 
 def checkWindowSize(args):
     logging.info("checking MaxSiteLength:")
-    global maxSiteLength
+    global maximumSiteLength
     if args.maximumSiteLength:
         logging.info(args.maximumSiteLength)
         if(int(args.maximumSiteLength) > 0):
-            maxSiteLength=int(args.maximumSiteLength)
+            maximumSiteLength=int(args.maximumSiteLength)
         else:
             logging.info("--MaxSiteLength needs to be a positive number <" + args.maximumSiteLength + ">")
             return()
@@ -432,12 +595,67 @@ def checkStepSize(args):
 
 
 
+def checkRecordFilters(args):
+    # the filters become args.miRFilter and args.utrFilter (see fastaIndex.py)
+    logging.info("checking fastA filters:")
+    for label, fastaFile, prefixes, listFile, regex, dest in (
+            ("miRNA", args.miRFile, args.miRPrefix, args.miRList, args.miRRegex, "miRFilter"),
+            ("3'UTR", args.utrFile, args.utrPrefix, args.utrList, args.utrRegex, "utrFilter")):
+        if (prefixes or listFile or regex) and not fastaFile:
+            logging.error("----the " + label + " filters can only be used with a " + label + " fastA file")
+            printHelpAndExit()
+        names = None
+        if listFile:
+            if not os.path.isfile(listFile):
+                logging.error("----can't find the " + label + " list <" + listFile + ">")
+                sys.exit(1)
+            names = fastaIndex.readNameList(listFile)
+            logging.info("--<" + str(len(names)) + "> " + label + " names in <" + listFile + ">")
+        try:
+            recordFilter = fastaIndex.RecordFilter(prefixes.split(",") if prefixes else None, names, regex)
+        except re.error as e:
+            logging.error("----the " + label + " regular expression <" + regex + "> is not valid: " + str(e))
+            sys.exit(1)
+        setattr(args, dest, recordFilter)
+        logging.info("--" + label + "s: " + ("filtered" if recordFilter.active() else "all"))
+    logging.info("--OK")
+
+
+def checkDryRun(args):
+    global calibration
+    logging.info("checking dry run:")
+    if not args.miRFile or not args.utrFile:
+        logging.error("----you need to specify a miRNA (-m) and a 3'UTR (-3) file for a dry run")
+        printHelpAndExit()
+    for fastaFile in (args.miRFile, args.utrFile):
+        if not os.path.isfile(fastaFile):
+            logging.error("----can't find <" + fastaFile + ">")
+            sys.exit(1)
+    try:
+        calibration = costModel.readCalibration(args.calibrationFile)
+    except (IOError, ValueError) as e:
+        logging.error("----can't read the calibration: " + str(e))
+        sys.exit(1)
+    if args.shard:
+        logging.info("--each of the shards gets about 1/N of the estimate")
+    logging.info("--nothing will be written")
+    logging.info("--OK")
+
+
 def checkArgs(args):
 
     if args.HelpMe :
         printLongHelpAndExit()
         exit()
 
+    # a dry run only needs the fastA files and the window settings
+    if args.dryRun:
+        checkDryRun(args)
+        checkRecordFilters(args)
+        checkWindowSize(args)
+        checkStepSize(args)
+        return
+
     checkProgramLocation(args)
     checkExptName(args)
     checkOutFolder(args)
@@ -446,25 +664,70 @@ def checkArgs(args):
     checkCSSM(args)
     checkDLModel(args)
     checkSplit(args)
+    checkJobArray(args)
+    checkFanout(args)
+    checkShard(args)
+    checkResplit(args)
+    checkRecordFilters(args)
     checkEnergyFiltering(args)
     checkWindowSize(args)
     checkStepSize(args)
 
 
 
+# with filters, the records are read through an offset index of the fastA
+# file, so only the selected records are parsed (see fastaIndex.py)
+def selectedRecords(fastaFile, recordFilter, saveIndex=True):
+    return ((name, seq) for name, description, seq in fastaIndex.selectRecords(fastaFile, recordFilter, saveIndex))
+
+
 def readMiRNAFile(args):
+    if args.miRFilter.active():
+        for name, seq in selectedRecords(args.miRFile, args.miRFilter):
+            miRheaderList.append(name)
+            miRseqList.append(seq)
+        logging.info("--selected <" + str(len(miRheaderList)) + "> miRNAs")
+        return
 
-    inFile = open(args.miRFile,'r')
-    for record in SeqIO.parse(inFile,'fasta'):
-        miRheaderList.append(record.id)
-        miRseqList.append(str(record.seq))
+    for name, description, seq in fastaReader.readFasta(args.miRFile):
+        miRheaderList.append(name)
+        miRseqList.append(seq)
 
 
 def readUTRFile(args):
-    inFile = open(args.utrFile,'r')
-    for record in SeqIO.parse(inFile,'fasta'):
-        UTRheaderList.append(record.id)
-        UTRseqList.append(str(record.seq))
+    if args.utrFilter.active():
+        for name, seq in selectedRecords(args.utrFile, args.utrFilter):
+            UTRheaderList.append(name)
+            UTRseqList.append(seq)
+        logging.info("--selected <" + str(len(UTRheaderList)) + "> 3'UTRs")
+        return
+
+    for name, description, seq in fastaReader.readFasta(args.utrFile):
+        UTRheaderList.append(name)
+        UTRseqList.append(seq)
+
+
+
+# miRAW reads plain text unifiedFiles, so when the -Z option is set the
+# files are written compressed and the script line unpacks the file next to
+# the compressed copy, runs miRAW and then removes the unpacked file again.
+# The line exits with miRAW's (or the unpacking's) exit code, not rm's, so
+# runMiRAWjobs still sees failed jobs
+def unifiedFileExtension(args):
+    if args.compressUnifiedFile:
+        return "." + args.compressUnifiedFile
+    return ""
+
+
+def writeJavaCommand(fSh, propertiesFile, unifiedFile, args):
+    #java -jar miRAW.jar GenePrediction predict ./Results/firstTry/firstTry.EF.properties
+    javaCommand = "java -jar " + jarLocation + " GenePrediction predict " + propertiesFile
+    if not args.compressUnifiedFile:
+        fSh.write(javaCommand + MY_NEWLINE)
+        return
+    unpackCommand = "zstd" if args.compressUnifiedFile == "zst" else "gzip"
+    fSh.write("(" + unpackCommand + " -dc " + unifiedFile + unifiedFileExtension(args) + " > " + unifiedFile
+              + " && " + javaCommand + "; rc=$?; rm -f " + unifiedFile + "; exit $rc)" + MY_NEWLINE)
 
 
 
@@ -473,24 +736,25 @@ def writeUnifiedFileBymiRNA(args):
     #
     logging.info("writeUnifiedFileBymiRNA")
     headerLine = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript" + MY_NEWLINE
-    writePropertiesFileForFeature("byMiRs")
-    featuresFile = os.path.join(args.remoteFolder, args.exptName  + "." + "byMiRs" + '.unifiedFile.csv' )
-    with open(featuresFile, "w") as f:
+    writePropertiesFileForFeature("byMiRs", args)
+    featuresFile = os.path.join(args.outFolder, args.exptName  + "." + "byMiRs" + '.unifiedFile.csv' )
+    remoteFeaturesFile = os.path.join(args.remoteFolder, args.exptName  + "." + "byMiRs" + '.unifiedFile.csv' )
+    with compressedIO.openFile(featuresFile + unifiedFileExtension(args), "w") as f:
         f.write(headerLine)
         m = 0
         for mHeader in miRheaderList:
             u = 0
             for uHeader in UTRheaderList:
-                f.write('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
+                if inShard(sharding.pairKey(mHeader, uHeader)):
+                    f.write('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
                 u+=1
             m+=1
 
 
     logging.info("--write Script File")
-    #java -jar miRAW.jar GenePrediction predict ./Results/firstTry/firstTry.EF.properties
     with open(os.path.join(args.outFolder, args.exptName  + '.sh'), "w") as f:
-        f.write("java -jar " + jarLocation + " GenePrediction predict "
-                + os.path.join(args.outFolder, args.exptName  + "." + "byMiRs"  + ".properties") + MY_NEWLINE)
+        writeJavaCommand(f, os.path.join(args.remoteFolder, args.exptName  + "." + "byMiRs"  + ".properties"),
+                         remoteFeaturesFile, args)
 
 
 
@@ -531,23 +795,25 @@ def writeUnifiedFileByUTR(args):
     #
     logging.info("writeUnifiedFileByUTR")
     headerLine = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript" + MY_NEWLINE
-    featuresFile = os.path.join(args.remoteFolder, args.exptName  + "." + "by3pUTRs" + '.unifiedFile.csv' )
-    with open(featuresFile, "w") as f:
+    writePropertiesFileForFeature("by3pUTRs", args)
+    featuresFile = os.path.join(args.outFolder, args.exptName  + "." + "by3pUTRs" + '.unifiedFile.csv' )
+    remoteFeaturesFile = os.path.join(args.remoteFolder, args.exptName  + "." + "by3pUTRs" + '.unifiedFile.csv' )
+    with compressedIO.openFile(featuresFile + unifiedFileExtension(args), "w") as f:
         f.write(headerLine)
         u = 0
         for uHeader in UTRheaderList:
             m = 0
             for mHeader in miRheaderList:
-                f.write('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
+                if inShard(sharding.pairKey(mHeader, uHeader)):
+                    f.write('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
                 m+=1
             u+=1
 
 
     logging.info("--write Script File")
-    #java -jar miRAW.jar GenePrediction predict ./Results/firstTry/firstTry.EF.properties
     with open(os.path.join(args.outFolder, args.exptName  + '.sh'), "w") as f:
-        f.write("java -jar " + jarLocation + " GenePrediction predict "
-                + os.path.join(args.outFolder, args.exptName  + ".properties") + MY_NEWLINE)
+        writeJavaCommand(f, os.path.join(args.remoteFolder, args.exptName  + "." + "by3pUTRs"  + ".properties"),
+                         remoteFeaturesFile, args)
 
     logging.info("done")
 # miRNAs are in the outer loop
@@ -558,15 +824,22 @@ def splitUnifiedFileBymiRNA(args):
     #
     logging.info("splitUnifiedFileBymiRNA")
     headerLine = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript" + MY_NEWLINE
+    if args.jobArray:
+        writeJobArray(args, chunksBymiRNA(headerLine))
+        return
     m = 0
-    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh:
+    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh, \
+            hashedLayout.ExperimentManifestWriter(experimentManifestFile(args)) as fExpts:
         for mHeader in miRheaderList:
+            if not inShard(mHeader.replace("|", "_")):
+                m+=1
+                continue
             logging.info("--<" + mHeader + ">")
-            #os.path.join(args.outFolder, args.exptName  + '.sh'), "w"
-            featuresFile = os.path.join(args.outFolder, args.exptName  + "." + mHeader + '.unifiedFile.csv' )
-            remotePropertiesFile = os.path.join(args.remoteFolder, args.exptName  + "." + uHeader + '.properties' )
-            propertiesFile = os.path.join(args.outFolder, args.exptName  + "." + mHeader + '.properties' )
-            with open(featuresFile, 'w') as f:
+            localFolder, remoteFolder = featureFolders(mHeader.replace("|", "_"), args)
+            featuresFile = os.path.join(localFolder, args.exptName  + "." + mHeader.replace("|", "_") + '.unifiedFile.csv' )
+            remoteFeaturesFile = os.path.join(remoteFolder, args.exptName  + "." + mHeader.replace("|", "_") + '.unifiedFile.csv' )
+            remotePropertiesFile = os.path.join(remoteFolder, args.exptName  + "." + mHeader.replace("|", "_") + '.properties' )
+            with compressedIO.openFile(featuresFile + unifiedFileExtension(args), 'w') as f:
                 f.write(headerLine)
                 u = 0
                 for uHeader in UTRheaderList:
@@ -574,7 +847,8 @@ def splitUnifiedFileBymiRNA(args):
                     u+=1
 
             writePropertiesFileForFeature(mHeader.replace("|", "_"), args)
-            fSh.write("java -jar " + jarLocation + " GenePrediction predict " + remotePropertiesFile + MY_NEWLINE)
+            writeJavaCommand(fSh, remotePropertiesFile, remoteFeaturesFile, args)
+            fExpts.add(mHeader.replace("|", "_"), os.path.join(remoteFolder, args.exptName  + "." + mHeader.replace("|", "_")))
             m+=1
     #java -jar miRAW.jar GenePrediction predict ./Results/firstTry/firstTry.EF.properties
 
@@ -587,14 +861,23 @@ def splitUnifiedFileByUTR(args):
     #
     logging.info("splitUnifiedFileByUTR")
     headerLine = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript" + MY_NEWLINE
+    if args.jobArray:
+        writeJobArray(args, chunksByUTR(headerLine))
+        return
     u = 0
-    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh:
+    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh, \
+            hashedLayout.ExperimentManifestWriter(experimentManifestFile(args)) as fExpts:
         logging.info("")
         for uHeader in UTRheaderList:
+            if not inShard(uHeader.replace("|", "_")):
+                u+=1
+                continue
             logging.info("--<" + uHeader + ">")
-            localFeaturesFile = os.path.join(args.outFolder, args.exptName  + "." + uHeader.replace("|", "_") + '.unifiedFile.csv' )
-            remotePropertiesFile = os.path.join(args.remoteFolder, args.exptName  + "." + uHeader.replace("|", "_") + '.properties' )
-            with open(localFeaturesFile, 'w') as f:
+            localFolder, remoteFolder = featureFolders(uHeader.replace("|", "_"), args)
+            localFeaturesFile = os.path.join(localFolder, args.exptName  + "." + uHeader.replace("|", "_") + '.unifiedFile.csv' )
+            remoteFeaturesFile = os.path.join(remoteFolder, args.exptName  + "." + uHeader.replace("|", "_") + '.unifiedFile.csv' )
+            remotePropertiesFile = os.path.join(remoteFolder, args.exptName  + "." + uHeader.replace("|", "_") + '.properties' )
+            with compressedIO.openFile(localFeaturesFile + unifiedFileExtension(args), 'w') as f:
                 m = 0
                 f.write(headerLine)
                 for mHeader in miRheaderList:
@@ -603,13 +886,135 @@ def splitUnifiedFileByUTR(args):
 
             writePropertiesFileForFeature(uHeader.replace("|", "_"), args)
 
-            fSh.write("java -jar " + jarLocation + " GenePrediction predict " + remotePropertiesFile + MY_NEWLINE)
+            writeJavaCommand(fSh, remotePropertiesFile, remoteFeaturesFile, args)
+            fExpts.add(uHeader.replace("|", "_"), os.path.join(remoteFolder, args.exptName  + "." + uHeader.replace("|", "_")))
             u+=1
 
 
     logging.info("done")
 
 
+# job array layout (-A): all chunks go into one file, the manifest maps the
+# task index to the offset of its chunk and a single template .properties
+# file is filled in for each task by launchMiRAWtask.py (see jobManifest.py)
+def chunksBymiRNA(headerLine):
+    m = 0
+    for mHeader in miRheaderList:
+        if not inShard(mHeader.replace("|", "_")):
+            m+=1
+            continue
+        rows = [headerLine]
+        u = 0
+        for uHeader in UTRheaderList:
+            rows.append('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
+            u+=1
+        yield mHeader.replace("|", "_"), "".join(rows), len(rows) - 1
+        m+=1
+
+
+def chunksByUTR(headerLine):
+    u = 0
+    for uHeader in UTRheaderList:
+        if not inShard(uHeader.replace("|", "_")):
+            u+=1
+            continue
+        rows = [headerLine]
+        m = 0
+        for mHeader in miRheaderList:
+            rows.append('\t'.join([mHeader, uHeader, uHeader, "?", miRseqList[m], UTRseqList[u]]) + MY_NEWLINE)
+            m+=1
+        yield uHeader.replace("|", "_"), "".join(rows), len(rows) - 1
+        u+=1
+
+
+def writeJobArray(args, chunks):
+    logging.info("--write job array manifest")
+    chunkName = args.exptName + ".chunks.unifiedFile.csv" + unifiedFileExtension(args)
+    templateName = args.exptName + ".template.properties"
+    manifestName = args.exptName + ".manifest.tsv"
+    meta = {jobManifest.CHUNK_FILE_KEY: os.path.join(args.remoteFolder, chunkName),
+            jobManifest.TEMPLATE_FILE_KEY: os.path.join(args.remoteFolder, templateName),
+            jobManifest.JAR_LOCATION_KEY: jarLocation}
+
+    # with -F the experiment folders are placed in hashed subfolders
+    # which launchMiRAWtask.py creates when the task runs
+    experimentFolder = args.remoteFolder
+    if args.fanout:
+        experimentFolder = os.path.join(args.remoteFolder, jobManifest.SUBFOLDER_PLACEHOLDER)
+
+    with jobManifest.ManifestWriter(os.path.join(args.outFolder, manifestName),
+                                    os.path.join(args.outFolder, chunkName), meta) as manifest, \
+            hashedLayout.ExperimentManifestWriter(experimentManifestFile(args)) as fExpts:
+        for featureName, chunkText, rows in chunks:
+            manifest.addChunk(featureName, chunkText, rows)
+            fExpts.add(featureName, os.path.join(featureFolders(featureName, args, create=False)[1],
+                                                 args.exptName + "." + featureName))
+        taskCount = manifest.taskCount
+    logging.info("--wrote <" + str(taskCount) + "> tasks")
+
+    with open(os.path.join(args.outFolder, templateName), "w") as f:
+        writePropertiesLines(f, args.exptName + "." + jobManifest.FEATURE_PLACEHOLDER,
+                             jobManifest.UNIFIED_FILE_PLACEHOLDER, experimentFolder, args)
+
+    launchCommand = "python " + args.launcherLocation + " -m " + os.path.join(args.remoteFolder, manifestName)
+    # one line per task, so the script can be run with runMiRAWjobs.py or a local loop
+    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh:
+        for task in range(taskCount):
+            fSh.write(launchCommand + " -i " + str(task) + MY_NEWLINE)
+    # a single script for a scheduler job array
+    with open(os.path.join(args.outFolder, args.exptName + '.array.sh'), "w") as fSh:
+        fSh.write("#!/bin/bash" + MY_NEWLINE)
+        fSh.write("# submit as a job array, e.g." + MY_NEWLINE)
+        fSh.write("#   sbatch --array=0-" + str(taskCount - 1) + " " + args.exptName + ".array.sh" + MY_NEWLINE)
+        fSh.write("# or run task i locally with" + MY_NEWLINE)
+        fSh.write("#   bash " + args.exptName + ".array.sh i" + MY_NEWLINE)
+        fSh.write("TASK=${SLURM_ARRAY_TASK_ID:-$1}" + MY_NEWLINE)
+        fSh.write(launchCommand + " -i $TASK" + MY_NEWLINE)
+
+
+# with -F the files for each split go to a hashed subfolder (see hashedLayout.py)
+# returns the (local, remote) folder for a feature
+def featureFolders(featureName, args, create=True):
+    localFolder = hashedLayout.featureFolder(args.outFolder, featureName, args.fanout)
+    remoteFolder = hashedLayout.featureFolder(args.remoteFolder, featureName, args.fanout)
+    if create and not os.path.isdir(localFolder):
+        os.makedirs(localFolder)
+    return localFolder, remoteFolder
+
+
+# with --shard only the pairs (-t 1/2) or features (-t 3/4) that hash to the
+# shard are written, see sharding.py
+def inShard(key):
+    return shardRecord is None or shardRecord.take(key)
+
+
+def startShardRecord(args):
+    global shardRecord
+    if not args.shard:
+        return
+    if int(args.splitType) in (WRITE_BY_MIRNA, WRITE_BY_UTR):
+        universe = [miRheaderList, UTRheaderList]
+    elif int(args.splitType) == SPLIT_BY_MIRNA:
+        universe = [miRheaderList]
+    else:
+        universe = [UTRheaderList]
+    shardRecord = sharding.ShardRecord("miRAWbatch.split" + str(int(args.splitType)), args.shard, universe)
+
+
+def writeShardRecord(args):
+    if shardRecord is None:
+        return
+    experimentManifest = ""
+    if int(args.splitType) in (SPLIT_BY_MIRNA, SPLIT_BY_UTR):
+        experimentManifest = experimentManifestFile(args)
+    shardRecord.write(os.path.join(args.outFolder, args.exptName + sharding.SHARD_RECORD_EXTENSION),
+                      experimentManifest, os.path.join(args.outFolder, args.exptName + '.sh'))
+
+
+def experimentManifestFile(args):
+    return os.path.join(args.outFolder, args.exptName + hashedLayout.EXPERIMENT_MANIFEST_EXTENSION)
+
+
 # format of .properties file used during miRAW testing and evaluation
 
 # ########################################
@@ -654,44 +1059,73 @@ def writePropertiesFile(args):
 
 def writePropertiesFileForFeature(featureName, args):
 
-    unifiedFilePath = os.path.join(args.remoteFolder, args.exptName  + "." + featureName + ".unifiedFile.csv")
+    localFolder, remoteFolder = featureFolders(featureName, args)
+    unifiedFilePath = os.path.join(remoteFolder, args.exptName  + "." + featureName + ".unifiedFile.csv")
 
 
 
-    with open(os.path.join(args.outFolder, args.exptName  + "." + featureName + '.properties'), "w") as f:
-        f.write("########################################" + MY_NEWLINE)
-        f.write("# miRAW target prediction              #" + MY_NEWLINE)
-        f.write("#                                      #" + MY_NEWLINE)
-        f.write("#   generated from rawWrap             #" + MY_NEWLINE)
-        f.write("#  " + str(datetime.datetime.now()) + "          #" + MY_NEWLINE)
-        f.write("#                                      #" + MY_NEWLINE)
-        f.write("########################################" + MY_NEWLINE)
-        f.write("ExperimentName="+ args.exptName + "." + featureName + MY_NEWLINE)
-        f.write("ExperimentFolder=" + args.remoteFolder + MY_NEWLINE)
-        f.write("UnifiedFile=" + unifiedFilePath + MY_NEWLINE)
-        f.write("DLModel=" + args.dlModel + MY_NEWLINE)
-        f.write("CandidateSiteFinder.Type=" + args.cssm + MY_NEWLINE)
-        f.write("MaxSiteLength=" + str(maximumSiteLength) + MY_NEWLINE)
-        f.write("SeedAlignmentOffset=" + str(seedAlignmentOffset) + MY_NEWLINE)
-        if(filterByAccessibilityEnergy):
-            f.write(FILTER_ACCESSIBILITY_ENERGY_STRING + MY_NEWLINE)
+    with open(os.path.join(localFolder, args.exptName  + "." + featureName + '.properties'), "w") as f:
+        writePropertiesLines(f, args.exptName + "." + featureName, unifiedFilePath, remoteFolder, args)
+
+
+def writePropertiesLines(f, experimentName, unifiedFilePath, experimentFolder, args):
+    f.write("########################################" + MY_NEWLINE)
+    f.write("# miRAW target prediction              #" + MY_NEWLINE)
+    f.write("#                                      #" + MY_NEWLINE)
+    f.write("#   generated from rawWrap             #" + MY_NEWLINE)
+    f.write("#  " + str(datetime.datetime.now()) + "          #" + MY_NEWLINE)
+    f.write("#                                      #" + MY_NEWLINE)
+    f.write("########################################" + MY_NEWLINE)
+    f.write("ExperimentName="+ experimentName + MY_NEWLINE)
+    f.write("ExperimentFolder=" + experimentFolder + MY_NEWLINE)
+    f.write("UnifiedFile=" + unifiedFilePath + MY_NEWLINE)
+    f.write("DLModel=" + args.dlModel + MY_NEWLINE)
+    f.write("CandidateSiteFinder.Type=" + args.cssm + MY_NEWLINE)
+    f.write("MaxSiteLength=" + str(maximumSiteLength) + MY_NEWLINE)
+    f.write("SeedAlignmentOffset=" + str(seedAlignmentOffset) + MY_NEWLINE)
+    if(filterByAccessibilityEnergy):
+        f.write(FILTER_ACCESSIBILITY_ENERGY_STRING + MY_NEWLINE)
 
 
 
 
 def processAndBuild(args):
-    if int(args.splitType)==UNIFIEDFILE_EXISTS:
+    if args.dryRun:
+        estimateRun(args)
+    elif isResplit(args):
+        resplitUnifiedFile(args)
+    elif int(args.splitType)==UNIFIEDFILE_EXISTS:
         useExistingUnifiedFile(args)
     else:
         buildNewUnifiedFile(args)
+        writeShardRecord(args)
+
+
+
+# --dry-run: stream the fastA files and report what each split mode would write
+# and cost, using the calibration from costModel.py if one is given
+def estimateRun(args):
+    logging.info("estimating the run")
+    miRNAs = costModel.FastaSummary(dryRunRecords(args.miRFile, args.miRFilter))
+    utrs = costModel.FastaSummary(dryRunRecords(args.utrFile, args.utrFilter))
+    estimate = costModel.estimateRun(miRNAs, utrs, maximumSiteLength, seedAlignmentOffset, calibration,
+                                     len(MY_NEWLINE))
+    costModel.logEstimate(estimate, args.splitType)
+    logging.info("dry run, nothing written")
+
 
+def dryRunRecords(fastaFile, recordFilter):
+    # a dry run writes nothing, so a new fasta index is only kept in memory
+    if recordFilter.active():
+        return selectedRecords(fastaFile, recordFilter, saveIndex=False)
+    return costModel.fastaRecords(fastaFile)
 
 
 def useExistingUnifiedFile(args):
 
     # build properties file
     # write script file
-    writePropertiesFile()
+    writePropertiesFile(args)
     #java -jar miRAW.jar GenePrediction predict ./Results/firstTry/firstTry.EF.properties
     with open(os.path.join(args.outFolder, args.exptName  + '.sh'), "w") as f:
         f.write("java -jar " + jarLocation + " GenePrediction predict "
@@ -700,22 +1134,69 @@ def useExistingUnifiedFile(args):
 
 
 
+# an existing unifiedFile (-u) is split when -t 3/4, --chunks or a bound is given
+def isResplit(args):
+    return bool(args.unifiedFile) and (int(args.splitType) != UNIFIEDFILE_EXISTS
+                                       or bool(args.chunks or args.maxRows or args.maxBytes))
+
+
+# stream the existing unifiedFile into one file per miRNA (-t 3), 3'UTR (-t 4)
+# or balanced chunk (-t 0 --chunks), see unifiedSplit.py
+def resplitUnifiedFile(args):
+    logging.info("resplitUnifiedFile")
+    headerLine = unifiedSplit.readHeader(args.unifiedFile)
+    if not headerLine.endswith("\n"):
+        headerLine += MY_NEWLINE
+    headerBytes = len(headerLine.encode())
+    if int(args.splitType) == SPLIT_BY_MIRNA:
+        rows = unifiedSplit.splitByFeature(args.unifiedFile, unifiedSplit.MIRNA_COLUMN, headerBytes,
+                                           args.maxRows, args.maxBytes)
+    elif int(args.splitType) == SPLIT_BY_UTR:
+        rows = unifiedSplit.splitByFeature(args.unifiedFile, unifiedSplit.UTR_COLUMN, headerBytes,
+                                           args.maxRows, args.maxBytes)
+    else:
+        rows = unifiedSplit.splitBalanced(args.unifiedFile, args.chunks or 1, headerBytes,
+                                          maximumSiteLength, seedAlignmentOffset, args.maxRows, args.maxBytes)
+
+    def localFeaturesFile(featureName):
+        return os.path.join(featureFolders(featureName, args)[0],
+                            args.exptName + "." + featureName + '.unifiedFile.csv' + unifiedFileExtension(args))
+
+    compression = compressedIO.compressionType('.unifiedFile.csv' + unifiedFileExtension(args))
+    with unifiedSplit.ChunkWriter(headerLine, localFeaturesFile, compression) as chunks:
+        for featureName, line in rows:
+            chunks.add(featureName, line)
+
+    with open(os.path.join(args.outFolder, args.exptName + '.sh'), "w") as fSh, \
+            hashedLayout.ExperimentManifestWriter(experimentManifestFile(args)) as fExpts:
+        for featureName in chunks.features:
+            localFolder, remoteFolder = featureFolders(featureName, args)
+            remoteFeaturesFile = os.path.join(remoteFolder, args.exptName  + "." + featureName + '.unifiedFile.csv' )
+            remotePropertiesFile = os.path.join(remoteFolder, args.exptName  + "." + featureName + '.properties' )
+            writePropertiesFileForFeature(featureName, args)
+            writeJavaCommand(fSh, remotePropertiesFile, remoteFeaturesFile, args)
+            fExpts.add(featureName, os.path.join(remoteFolder, args.exptName  + "." + featureName))
+    logging.info("--wrote <" + str(len(chunks.features)) + "> unifiedFiles with <"
+                 + str(sum(chunks.features.values())) + "> rows")
+    logging.info("done")
+
+
 def buildNewUnifiedFile(args):
     readMiRNAFile(args)
     readUTRFile(args)
+    startShardRecord(args)
 
     if int(args.splitType) == UNIFIEDFILE_EXISTS:
         #writePropertiesFile()
-        writeUnifiedFileBymiRNA()
+        writeUnifiedFileBymiRNA(args)
         return()
 
     if int(args.splitType) == WRITE_BY_MIRNA:
         #writePropertiesFile()
-        writeUnifiedFileBymiRNA()
+        writeUnifiedFileBymiRNA(args)
         return()
 
     if int(args.splitType) == WRITE_BY_UTR:
-        writePropertiesFile(args)
         writeUnifiedFileByUTR(args)
         return()
 
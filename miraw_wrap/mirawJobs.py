@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Helpers for running the miRAW jobs generated by miRAWbatch.py
+
+miRAWbatch writes a shell script with one line per job, e.g.
+
+    java -jar miRAW.jar GenePrediction predict /remote/expt.E1_T1_G1.properties
+
+or, for a job array manifest (miRAWbatch.py -A),
+
+    python launchMiRAWtask.py -m /remote/expt.manifest.tsv -i 0
+
+each line is one job. The .properties file (for a manifest task, the
+filled in template) tells us where miRAW writes its results:
+
+    ExperimentFolder/ExperimentName/...
+
+this module parses the scripts and properties files, runs a job and
+collects information on the files a job produced.
+"""
+
+import os
+import re
+import hashlib
+import logging
+import subprocess
+
+import jobManifest
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+PREDICT_PATTERN = re.compile(r"GenePrediction\s+predict\s+([^\s;]+)")
+LAUNCH_PATTERN = re.compile(r"launchMiRAWtask\.py\s+-m\s+(\S+)\s+-i\s+(\d+)")
+JAR_PATTERN = re.compile(r"java\s.*?-jar\s+(\S+)")
+DEFAULT_JAR = "miRAW.jar"
+PROPERTIES_EXTENSION = ".properties"
+
+# written to the experiment folder when a job finished successfully
+COMPLETION_MARKER = ".miraw_done"
+
+EXPERIMENT_NAME_KEY = "ExperimentName"
+EXPERIMENT_FOLDER_KEY = "ExperimentFolder"
+UNIFIED_FILE_KEY = "UnifiedFile"
+
+MD5_BLOCK_SIZE = 1 << 20
+
+
+class MiRAWJob(object):
+    '''a single line from a miRAWbatch shell script'''
+
+    def __init__(self, index, command):
+        self.index = index
+        self.command = command.strip()
+        match = PREDICT_PATTERN.search(self.command)
+        self.propertiesFile = match.group(1) if match else ""
+        match = LAUNCH_PATTERN.search(self.command)
+        self.manifestFile = match.group(1) if match else ""
+        self.taskIndex = int(match.group(2)) if match else None
+        self._properties = None
+
+    @property
+    def jobID(self):
+        if self.manifestFile and EXPERIMENT_NAME_KEY in self.properties:
+            return self.properties[EXPERIMENT_NAME_KEY]
+        if self.propertiesFile:
+            name = os.path.basename(self.propertiesFile)
+            if name.endswith(PROPERTIES_EXTENSION):
+                name = name[:-len(PROPERTIES_EXTENSION)]
+            return name
+        return "line_" + str(self.index)
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            if self.propertiesFile and os.path.isfile(self.propertiesFile):
+                self._properties = readPropertiesFile(self.propertiesFile)
+            elif self.manifestFile and os.path.isfile(self.manifestFile):
+                meta, task = jobManifest.readTask(self.manifestFile, self.taskIndex)
+                self._properties = parseProperties(
+                    jobManifest.taskPropertiesText(meta, task, "").splitlines())
+            else:
+                self._properties = {}
+        return self._properties
+
+    @property
+    def outputFolder(self):
+        '''folder miRAW writes results for this job to ("" if unknown)'''
+        return experimentFolder(self.properties)
+
+    def __repr__(self):
+        return "MiRAWJob(" + str(self.index) + ", " + self.jobID + ")"
+
+
+def jarLocation(job):
+    '''the miRAW jar a job runs'''
+    if job.manifestFile:
+        meta, task = jobManifest.readTask(job.manifestFile, job.taskIndex)
+        return meta[jobManifest.JAR_LOCATION_KEY]
+    match = JAR_PATTERN.search(job.command)
+    return match.group(1) if match else DEFAULT_JAR
+
+
+def readJobScript(scriptFile):
+    '''return a list of MiRAWJobs, one for each command line in the script'''
+    jobs = []
+    with open(scriptFile, 'r') as fSh:
+        for line in fSh:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            jobs.append(MiRAWJob(len(jobs), line))
+    return jobs
+
+
+def readPropertiesFile(propertiesFile):
+    '''read a miRAW .properties file into a dict'''
+    with open(propertiesFile, 'r') as fP:
+        return parseProperties(fP)
+
+
+def parseProperties(lines):
+    properties = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        properties[key.strip()] = value.strip()
+    return properties
+
+
+def experimentFolder(properties):
+    '''the folder miRAW writes to for these properties ("" if unknown)'''
+    if EXPERIMENT_FOLDER_KEY in properties and EXPERIMENT_NAME_KEY in properties:
+        return os.path.join(properties[EXPERIMENT_FOLDER_KEY], properties[EXPERIMENT_NAME_KEY])
+    return ""
+
+
+def md5sum(filePath):
+    md5 = hashlib.md5()
+    with open(filePath, 'rb') as fIn:
+        for block in iter(lambda: fIn.read(MD5_BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def collectOutputs(folder, checksums=True):
+    '''
+    return a list of {file, size, md5} entries for every file below folder
+    the completion marker is not included
+    '''
+    outputs = []
+    if not folder or not os.path.isdir(folder):
+        return outputs
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for fileName in sorted(files):
+            if fileName == COMPLETION_MARKER:
+                continue
+            filePath = os.path.join(root, fileName)
+            entry = {"file": os.path.relpath(filePath, folder), "size": os.path.getsize(filePath)}
+            if checksums:
+                entry["md5"] = md5sum(filePath)
+            outputs.append(entry)
+    return outputs
+
+
+def outputsMatch(folder, recordedOutputs, checksums=False):
+    '''True if the files in folder still match the recorded sizes (and checksums)'''
+    for entry in recordedOutputs:
+        filePath = os.path.join(folder, entry["file"])
+        if not os.path.isfile(filePath) or os.path.getsize(filePath) != entry["size"]:
+            return False
+        if checksums and "md5" in entry and md5sum(filePath) != entry["md5"]:
+            return False
+    return True
+
+
+def writeCompletionMarker(folder):
+    if folder and os.path.isdir(folder):
+        with open(os.path.join(folder, COMPLETION_MARKER), 'w') as fM:
+            fM.write("done\n")
+
+
+def isComplete(folder):
+    return os.path.isfile(os.path.join(folder, COMPLETION_MARKER))
+
+
+def runJob(job, timeout=None):
+    '''run the job's command and return the exit code'''
+    logging.info("--running job <" + job.jobID + ">")
+    try:
+        completed = subprocess.run(job.command, shell=True, timeout=timeout)
+        return completed.returncode
+    except subprocess.TimeoutExpired:
+        logging.error("--job <" + job.jobID + "> timed out after " + str(timeout) + "s")
+        return -1
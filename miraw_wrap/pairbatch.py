@@ -21,7 +21,9 @@ import sys
 import os
 import logging
 import datetime
-from Bio import SeqIO
+
+import hashedLayout
+import sharding
 
 
 __author__ = "Yafei Xing"
@@ -63,8 +65,17 @@ parser.add_argument("-n","--negativeTarget",action="store_true",
 parser.add_argument("-a","--allTarget",action="store_true",
                     help="to show pairing in .allTargetSites.csv")
 
+parser.add_argument("-M", "--manifest", dest='experimentManifest',
+                    help="experiment manifest (.experiments.tsv) listing the miRAW result folders")
+
+parser.add_argument("--shard", dest="shard",
+                    help="only write the commands for shard i of N (i/N), see sharding.py")
+
 args = parser.parse_args()
 
+# with --shard, counts the experiments this shard takes (see sharding.py)
+shardRecord = None
+
 
 def printLongHelpAndExit():
     logging.info("+" + "-" * 78 + "+")
@@ -88,6 +99,12 @@ def printLongHelpAndExit():
     logging.info("+                                                                              +")
     logging.info("+        -a, the file containing all predicted target sites,                   +")
     logging.info("+            with tail of .allTargetSites.csv                                  +")
+    logging.info("+      use -M to read the miRAW result folders from the experiment manifest    +")
+    logging.info("+      written by miRAWbatch (<exptName>.experiments.tsv) instead of listing   +")
+    logging.info("+      the folder (needed when miRAWbatch was run with -F/--fanout)            +")
+    logging.info("+                                                                              +")
+    logging.info("+      use --shard i/N to only write the commands for shard i of N. The        +")
+    logging.info("+      script is named <exptName>.shard<i>of<N>.sh (see sharding.py)           +")
     logging.info("+" + "-" * 78 + "+")
 
 
@@ -140,6 +157,18 @@ def checkOutFolder():
         # check folder exists or is creatable
 
 
+def checkShard():
+    if args.shard:
+        logging.info("checking shard:")
+        try:
+            args.shard = sharding.parseShard(args.shard)
+        except ValueError as e:
+            logging.error("----" + str(e))
+            printHelpAndExit()
+        args.exptName = sharding.shardName(args.exptName, args.shard)
+        logging.info("--OK")
+
+
 def checkArgs():
     
     if args.HelpMe :
@@ -148,14 +177,31 @@ def checkArgs():
     checkProgramLocation()
     checkExptName()
     checkOutFolder()
+    hashedLayout.checkExperimentManifest(args.experimentManifest)
+    checkShard()
+
+
+def experimentFolders(folder):
+    # with -M the result folders are read from the manifest, otherwise
+    # every subfolder of the folder is a result folder
+    # with --shard only the folders whose feature hashes to the shard are kept
+    global shardRecord
+    folders, shardRecord = sharding.shardExperiments(hashedLayout.listExperiments(folder, args.experimentManifest),
+                                                     args.shard, "pairbatch")
+    return folders
+
+
+def writeShardRecord():
+    if shardRecord is not None:
+        shardRecord.write(os.path.join(args.outFolder, args.exptName + sharding.SHARD_RECORD_EXTENSION),
+                          script=os.path.join(args.outFolder, args.exptName + '.sh'))
 
 
 def writeScript():
 
     #python functionpath/showSeedBinding.py -f folderpath/folderpath.positiveTargetSites.csv -p/-n/-a
     with open(os.path.join(args.outFolder, args.exptName  + '.sh'), "w") as f:
-        for foldername in next(os.walk(args.outFolder))[1]:
-            folderpath = os.path.join(args.outFolder, foldername)
+        for folderpath in experimentFolders(args.outFolder):
             content = "python " + funcLocation + " -f " + folderpath
             if args.positiveTarget:
                 content = content + " -p"
@@ -169,6 +215,7 @@ def writeScript():
 
 checkArgs()
 writeScript()
+writeShardRecord()
 
 
 
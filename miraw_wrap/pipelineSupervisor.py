@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Post-process miRAW experiment folders as soon as their job finishes,
+instead of generating and running the cutoffBatch, pairbatch and
+extractConflictBatch scripts after all the predictions are done
+
+    python pipelineSupervisor.py -s /remote/expt.sh -P 0.8 -E -10 -c -a -j 8
+    python pipelineSupervisor.py -M /remote/expt.experiments.tsv -c --raw gzip
+    python pipelineSupervisor.py -f /remote/results -c -a --no-marker --idle 1800
+
+which folders to watch
+  -s the shell script generated by miRAWbatch.py (the experiment folders of its jobs)
+  -M an experiment manifest (.experiments.tsv) written by miRAWbatch.py
+  -f a folder whose subfolders are experiment folders; as the number of
+     folders isn't known, the supervisor stops after --idle seconds
+     without a new folder to process
+
+With -s (or -M, if the miRAWbatch script is next to the manifest) the
+journal of runMiRAWjobs.py/resplitMiRAWjobs.py (<script>.journal) and the
+queue folder of jobQueue.py (<script>.queue) are read on each scan, and the
+folders of jobs they record as failed are counted as failed, so the
+supervisor still stops once every job has finished one way or the other.
+For jobs run some other way, give --idle to stop after that many seconds
+without a new folder with -s/-M too.
+
+the stages, run on each folder in this order
+  -P/-E  cutoffFilter.py on the --cutoffTail file (default .allTargetSites.csv)
+  -c     extractConflicts.py
+  -p/-n/-a  showPairing.py on the positive, negative and/or all target sites
+
+A folder is ready when it has a targetPredictionOutput.csv and the
+completion marker written by runMiRAWjobs.py, jobQueue.py or
+resplitMiRAWjobs.py. With --no-marker (jobs run straight from the shell
+script) it is ready once the size of targetPredictionOutput.csv hasn't
+changed between two scans. Up to -j stage commands run at the same time.
+A processed folder gets a .miraw_postprocessed marker, so a restarted
+supervisor skips it.
+
+--raw gzip|delete  compress or delete the allTargetSites file once all the
+                   stages of a folder have succeeded
+"""
+
+import os
+import sys
+import asyncio
+import logging
+import argparse
+
+import compressedIO
+import hashedLayout
+import mirawJobs
+from jobJournal import JobJournal, JOURNAL_EXTENSION, STATE_FAILED
+from jobQueue import QUEUE_EXTENSION, DONE_EXTENSION, FAILED_EXTENSION
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+POSTPROCESSED_MARKER = ".miraw_postprocessed"
+PREDICTION_TAIL = ".targetPredictionOutput.csv"
+ALL_SITES_TAIL = ".allTargetSites.csv"
+RAW_ACTIONS = ["keep", "gzip", "delete"]
+SCAN_SECONDS = 30
+IDLE_SECONDS = 600
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='post-process miRAW experiment folders as their jobs finish')
+
+    parser.add_argument("-s", "--script", dest='scriptFile',
+                        help="shell script generated by miRAWbatch")
+    parser.add_argument("-M", "--manifest", dest='experimentManifest',
+                        help="experiment manifest (.experiments.tsv) listing the miRAW result folders")
+    parser.add_argument("-f", "--folder", dest='resultFolder',
+                        help="folder whose subfolders are miRAW result folders")
+    parser.add_argument("-P", "--probCutoff", dest='probabilityCutoff',
+                        help="run cutoffFilter.py with this prediction probability cutoff")
+    parser.add_argument("-E", "--enerCutoff", dest='energyCutoff',
+                        help="run cutoffFilter.py with this free energy cutoff")
+    parser.add_argument("--cutoffTail", dest='cutoffTail', default=ALL_SITES_TAIL,
+                        help="file cutoffFilter.py is run on [default: %(default)s]")
+    parser.add_argument("-c", "--conflicts", action="store_true",
+                        help="run extractConflicts.py")
+    parser.add_argument("-p", "--positiveTarget", action="store_true",
+                        help="run showPairing.py on .positiveTargetSites.csv")
+    parser.add_argument("-n", "--negativeTarget", action="store_true",
+                        help="run showPairing.py on .negativeTargetSites.csv")
+    parser.add_argument("-a", "--allTarget", action="store_true",
+                        help="run showPairing.py on .allTargetSites.csv")
+    parser.add_argument("-j", "--jobs", dest='jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of stage commands to run in parallel [default: number of cores]")
+    parser.add_argument("--raw", dest='raw', choices=RAW_ACTIONS, default="keep",
+                        help="what to do with allTargetSites after the stages succeeded [default: keep]")
+    parser.add_argument("--no-marker", dest='noMarker', action="store_true",
+                        help="don't wait for the completion marker of the job runners")
+    parser.add_argument("-i", "--interval", dest='interval', type=float, default=SCAN_SECONDS,
+                        help="seconds between scans for finished folders [default: %(default)s]")
+    parser.add_argument("--idle", dest='idle', type=float,
+                        help="stop after this many seconds without a new folder [default: " + str(IDLE_SECONDS)
+                        + " with -f, wait for all the jobs with -s/-M]")
+    parser.add_argument("--journal", dest='journalFile',
+                        help="journal of runMiRAWjobs/resplitMiRAWjobs [default: script + " + JOURNAL_EXTENSION + "]")
+    parser.add_argument("--queue", dest='queueFolder',
+                        help="queue folder of jobQueue [default: script + " + QUEUE_EXTENSION + "]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking experiment folders:")
+    sources = [source for source in (args.scriptFile, args.experimentManifest, args.resultFolder) if source]
+    if len(sources) != 1:
+        logging.error("----you need to specify one of -s/--script, -M/--manifest or -f/--folder")
+        printHelpAndExit()
+    if not os.path.exists(sources[0]):
+        logging.error("--can't find <" + sources[0] + ">")
+        sys.exit(1)
+    logging.info("--OK")
+    logging.info("checking stages:")
+    if not stageCommands("folder", args):
+        logging.error("----you need to specify at least one stage (-P/-E, -c, -p/-n/-a)")
+        printHelpAndExit()
+    if args.jobs < 1:
+        logging.error("--the number of parallel commands (-j) needs to be at least 1")
+        sys.exit(1)
+    logging.info("--OK")
+    if args.resultFolder and args.idle is None:
+        args.idle = IDLE_SECONDS
+    checkRunnerState(args)
+
+
+def checkRunnerState(args):
+    '''find the script whose jobs fill the folders, and where its runners record failed jobs'''
+    args.jobFolders = {}
+    scriptFile = args.scriptFile
+    if args.experimentManifest and args.experimentManifest.endswith(hashedLayout.EXPERIMENT_MANIFEST_EXTENSION):
+        scriptFile = args.experimentManifest[:-len(hashedLayout.EXPERIMENT_MANIFEST_EXTENSION)] + ".sh"
+    if not scriptFile or not os.path.isfile(scriptFile):
+        if args.experimentManifest and args.idle is None:
+            logging.warning("--can't find the miRAWbatch script for <" + args.experimentManifest
+                            + ">, failed jobs aren't detected (use --idle to stop anyway)")
+        return
+    args.jobFolders = {job.jobID: job.outputFolder for job in mirawJobs.readJobScript(scriptFile) if job.outputFolder}
+    if not args.journalFile:
+        args.journalFile = scriptFile + JOURNAL_EXTENSION
+    if not args.queueFolder:
+        args.queueFolder = scriptFile + QUEUE_EXTENSION
+    logging.info("--failed jobs are read from <" + args.journalFile + "> and <" + args.queueFolder + ">")
+
+
+def stageCommands(folder, args):
+    '''(stage name, command) for each configured stage, in the order they are run'''
+    name = os.path.basename(folder.rstrip("/"))
+    commands = []
+    if args.probabilityCutoff or args.energyCutoff:
+        command = [sys.executable, os.path.join(SCRIPT_FOLDER, "cutoffFilter.py"),
+                   "-f", os.path.join(folder, name + args.cutoffTail)]
+        if args.probabilityCutoff:
+            command += ["-P", args.probabilityCutoff]
+        if args.energyCutoff:
+            command += ["-E", args.energyCutoff]
+        commands.append(("cutoff", command))
+    if args.conflicts:
+        commands.append(("conflicts", [sys.executable, os.path.join(SCRIPT_FOLDER, "extractConflicts.py"),
+                                       "-f", folder]))
+    pairing = [flag for flag, on in (("-p", args.positiveTarget), ("-n", args.negativeTarget),
+                                     ("-a", args.allTarget)) if on]
+    if pairing:
+        commands.append(("pairing", [sys.executable, os.path.join(SCRIPT_FOLDER, "showPairing.py"),
+                                     "-f", folder] + pairing))
+    return commands
+
+
+def expectedFolders(args):
+    '''the experiment folders to process, None if they are found by scanning -f'''
+    if args.scriptFile:
+        return [job.outputFolder for job in mirawJobs.readJobScript(args.scriptFile) if job.outputFolder]
+    if args.experimentManifest:
+        return hashedLayout.readExperimentFolders(args.experimentManifest)
+    return None
+
+
+def failedJobFolders(args):
+    '''the experiment folders of the jobs the job runners recorded as failed'''
+    failedJobs = set()
+    if args.journalFile and os.path.isfile(args.journalFile):
+        failedJobs.update(jobID for jobID, record in JobJournal(args.journalFile).records.items()
+                          if record["state"] == STATE_FAILED)
+    if args.queueFolder and os.path.isdir(args.queueFolder):
+        fileNames = set(os.listdir(args.queueFolder))
+        failedJobs.update(fileName[:-len(FAILED_EXTENSION)] for fileName in fileNames
+                          if fileName.endswith(FAILED_EXTENSION)
+                          and fileName[:-len(FAILED_EXTENSION)] + DONE_EXTENSION not in fileNames)
+    return set(args.jobFolders[jobID] for jobID in failedJobs if jobID in args.jobFolders)
+
+
+def scanFolders(args, known):
+    '''the folders to consider in this scan'''
+    if known is not None:
+        return known
+    return sorted(os.path.join(args.resultFolder, name) for name in os.listdir(args.resultFolder)
+                  if os.path.isdir(os.path.join(args.resultFolder, name)))
+
+
+class Supervisor(object):
+    '''finds finished experiment folders and runs the stages on them'''
+
+    def __init__(self, args):
+        self.args = args
+        self.known = expectedFolders(args)
+        self.limit = asyncio.Semaphore(args.jobs)
+        self.started = set()
+        self.processed = set()
+        self.failed = set()
+        # folders whose miRAW job failed, so they are never ready
+        self.jobFailed = set()
+        # folder -> size of targetPredictionOutput at the last scan (--no-marker)
+        self.sizes = {}
+
+    def isReady(self, folder):
+        if os.path.isfile(os.path.join(folder, POSTPROCESSED_MARKER)):
+            return False
+        name = os.path.basename(folder.rstrip("/"))
+        predictionFile = compressedIO.resolvePath(os.path.join(folder, name + PREDICTION_TAIL))
+        if not os.path.isfile(predictionFile):
+            return False
+        if not self.args.noMarker:
+            return mirawJobs.isComplete(folder)
+        size = os.path.getsize(predictionFile)
+        stable = self.sizes.get(folder) == size
+        self.sizes[folder] = size
+        return stable
+
+    def scan(self):
+        '''(folders ready to process, folders already post-processed)'''
+        ready = []
+        done = []
+        if self.args.jobFolders:
+            self.jobFailed = failedJobFolders(self.args) - self.started
+        for folder in scanFolders(self.args, self.known):
+            if folder in self.started:
+                continue
+            if os.path.isfile(os.path.join(folder, POSTPROCESSED_MARKER)):
+                done.append(folder)
+            elif self.isReady(folder):
+                ready.append(folder)
+        return ready, done
+
+    async def runStage(self, folder, stage, command):
+        async with self.limit:
+            process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL,
+                                                           stderr=asyncio.subprocess.PIPE)
+            _, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error("--" + stage + " failed for <" + folder + "> (exit code " + str(process.returncode)
+                          + "): " + stderr.decode(errors='replace').strip()[-500:])
+        return process.returncode
+
+    async def process(self, folder):
+        for stage, command in stageCommands(folder, self.args):
+            if await self.runStage(folder, stage, command) != 0:
+                self.failed.add(folder)
+                return
+        if self.args.raw != "keep":
+            await asyncio.to_thread(self.handleRawSites, folder)
+        with open(os.path.join(folder, POSTPROCESSED_MARKER), 'w') as fM:
+            fM.write("done\n")
+        self.processed.add(folder)
+        logging.info("--post-processed <" + folder + ">")
+
+    def handleRawSites(self, folder):
+        name = os.path.basename(folder.rstrip("/"))
+        sitesFile = os.path.join(folder, name + ALL_SITES_TAIL)
+        if not os.path.isfile(sitesFile):
+            return
+        if self.args.raw == "gzip":
+            compressedIO.compressFile(sitesFile, compressedIO.COMPRESSION_GZIP)
+        elif self.args.raw == "delete":
+            os.remove(sitesFile)
+
+    async def run(self):
+        tasks = set()
+        loop = asyncio.get_running_loop()
+        lastNew = loop.time()
+        while True:
+            ready, done = await asyncio.to_thread(self.scan)
+            for folder in done:
+                self.started.add(folder)
+                self.processed.add(folder)
+            for folder in ready:
+                self.started.add(folder)
+                tasks.add(asyncio.create_task(self.process(folder)))
+            if ready:
+                lastNew = loop.time()
+                logging.info("--<" + str(len(ready)) + "> new folders, <" + str(len(self.processed))
+                             + "> processed, <" + str(len(self.failed)) + "> failed")
+            tasks = set(task for task in tasks if not task.done())
+
+            if self.known is not None and not tasks:
+                if len(self.processed) + len(self.failed) + len(self.jobFailed) >= len(set(self.known)):
+                    break
+            if self.args.idle is not None and not tasks and loop.time() - lastNew > self.args.idle:
+                logging.info("--no new folders for " + str(self.args.idle) + "s, stopping")
+                break
+            await asyncio.sleep(self.args.interval)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    supervisor = Supervisor(args)
+    if supervisor.known is not None:
+        logging.info("watching <" + str(len(supervisor.known)) + "> experiment folders")
+    asyncio.run(supervisor.run())
+    logging.info("<" + str(len(supervisor.processed)) + "> folders post-processed, <"
+                 + str(len(supervisor.failed)) + "> failed")
+    if supervisor.jobFailed:
+        logging.error("<" + str(len(supervisor.jobFailed)) + "> folders weren't processed, their miRAW job failed")
+    if supervisor.known is not None:
+        waiting = (len(set(supervisor.known)) - len(supervisor.processed) - len(supervisor.failed)
+                   - len(supervisor.jobFailed))
+        if waiting > 0:
+            logging.warning("<" + str(waiting) + "> folders were never ready")
+    if supervisor.failed or supervisor.jobFailed:
+        logging.error("rerun the supervisor to retry the failed folders")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
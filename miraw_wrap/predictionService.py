@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local query service over miRAW prediction results
+
+    python predictionService.py -r /data/miRAW_targets -r /data/isos --port 8765
+
+loads every allTargetSites.csv file (miRAW output or pooled format, optionally
+compressed) found under the result folders once, indexes the sites by gene,
+miRNA and prediction score, and answers HTTP GET queries on localhost with JSON
+
+    /sites?gene=PAX4&p=0.9&e=15            sites passing the cutoffs
+    /top?miRNA=hsa-miR-30a-5p&k=20&by=mfe  k best sites by prediction (default) or MFE
+    /aggregate?gene=PAX4&groupby=miRNA     sites, best prediction and lowest MFE per miRNA (or gene)
+    /status                                loaded files and sites
+    /reload                                scan the result folders now
+
+gene matches any '|' separated field of the gene name (ENSG, ENST, symbol),
+miRNA matches the full miRNA name or a '_' or '|' separated field of it
+(MIMAT ID, common name). The cutoffs work as in miRAWResultFilterer.py (mode=filterer,
+the default: Prediction > p and MFE < -e) or as in cutoffFilter.py
+(mode=cutoff: |Prediction| >= p and |MFE| >= |e|). limit caps the number of
+rows returned (default 1000).
+
+The result folders are scanned again every -i seconds. New and changed files
+are read and the index is rebuilt in the background; queries use the
+previous index until the new one is ready.
+"""
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import compressedIO
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 60
+DEFAULT_PATTERN = "*allTargetSites.csv"
+DEFAULT_LIMIT = 1000
+DEFAULT_TOP_K = 10
+
+MODE_FILTERER = "filterer"
+MODE_CUTOFF = "cutoff"
+
+# columns kept from the result files, pooled files have FreeEnergy instead of MFE
+SITE_COLUMNS = ["GeneName", "miRNA", "SiteStart", "SiteEnd", "Prediction", "MFE"]
+COLUMN_ALIASES = {"FreeEnergy": "MFE"}
+
+
+class QueryError(Exception):
+    '''bad query parameters, returned to the client as HTTP 400'''
+
+
+def readSitesFile(sitesFile):
+    '''the site columns of a result file'''
+    sites = compressedIO.readTable(sitesFile, sep='\t').rename(columns=COLUMN_ALIASES)
+    missing = [column for column in SITE_COLUMNS if column not in sites.columns]
+    if missing:
+        raise ValueError("missing columns " + ", ".join(missing))
+    return sites[SITE_COLUMNS]
+
+
+def nameFieldIndex(names, separator):
+    '''name field (split on the separator regex) and full name -> codes of the names containing it'''
+    fields = pd.Series(names).astype(str).str.split(separator, regex=True).explode()
+    fields = pd.concat([fields, pd.Series(names, dtype=str)])
+    return {field: np.unique(codes) for field, codes in fields.groupby(fields).groups.items()}
+
+
+class SiteIndex(object):
+    '''
+    the sites of all files, sorted by decreasing prediction, with the row numbers
+    of each gene and miRNA (also sorted by decreasing prediction)
+    '''
+
+    def __init__(self, siteTables):
+        sites = pd.concat(siteTables.values(), keys=list(siteTables.keys()), names=["file", None])
+        sites = sites.reset_index(level=0)
+        sites = sites.sort_values("Prediction", ascending=False, kind="stable").reset_index(drop=True)
+        self.files = sorted(siteTables)
+        self.fileCodes = pd.Categorical(sites["file"], categories=self.files).codes
+        gene = pd.Categorical(sites["GeneName"].astype(str))
+        miRNA = pd.Categorical(sites["miRNA"].astype(str))
+        self.genes = np.asarray(gene.categories, dtype=object)
+        self.miRNAs = np.asarray(miRNA.categories, dtype=object)
+        self.geneCodes = gene.codes
+        self.miRNACodes = miRNA.codes
+        self.siteStart = sites["SiteStart"].to_numpy()
+        self.siteEnd = sites["SiteEnd"].to_numpy()
+        self.prediction = sites["Prediction"].to_numpy(dtype=np.float64)
+        self.mfe = sites["MFE"].to_numpy(dtype=np.float64)
+        # row numbers are in prediction order, so each of these lists is too
+        self.geneRows = pd.Series(self.geneCodes).groupby(self.geneCodes).indices
+        self.miRNARows = pd.Series(self.miRNACodes).groupby(self.miRNACodes).indices
+        self.geneFields = nameFieldIndex(self.genes, r"\|")
+        self.miRNAFields = nameFieldIndex(self.miRNAs, r"[_|]")
+        self.builtAt = time.time()
+
+    def __len__(self):
+        return len(self.prediction)
+
+    def rowsFor(self, codes, rowIndex):
+        rows = [rowIndex[code] for code in codes if code in rowIndex]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        # keep the prediction order
+        return np.sort(np.concatenate(rows))
+
+    def select(self, gene=None, miRNA=None, p=None, e=None, mode=MODE_FILTERER):
+        '''row numbers of the sites matching the query, in order of decreasing prediction'''
+        rows = None
+        if gene is not None:
+            rows = self.rowsFor(self.geneFields.get(gene, []), self.geneRows)
+        if miRNA is not None:
+            miRNARows = self.rowsFor(self.miRNAFields.get(miRNA, []), self.miRNARows)
+            rows = miRNARows if rows is None else np.intersect1d(rows, miRNARows, assume_unique=True)
+        if rows is None:
+            if mode == MODE_FILTERER and p is not None:
+                # sites above the probability cutoff are a prefix of the score index
+                rows = np.arange(np.searchsorted(-self.prediction, -p, side='left'))
+            else:
+                rows = np.arange(len(self))
+        keep = np.ones(len(rows), dtype=bool)
+        if mode == MODE_FILTERER:
+            if p is not None:
+                keep &= self.prediction[rows] > p
+            if e is not None:
+                keep &= self.mfe[rows] < -e
+        else:
+            if p is not None:
+                keep &= np.abs(self.prediction[rows]) >= abs(p)
+            if e is not None:
+                keep &= np.abs(self.mfe[rows]) >= abs(e)
+        return rows[keep]
+
+    def records(self, rows):
+        return [{"gene": self.genes[self.geneCodes[r]],
+                 "miRNA": self.miRNAs[self.miRNACodes[r]],
+                 "siteStart": int(self.siteStart[r]),
+                 "siteEnd": int(self.siteEnd[r]),
+                 "prediction": float(self.prediction[r]),
+                 "mfe": float(self.mfe[r]),
+                 "file": self.files[self.fileCodes[r]]} for r in rows]
+
+    def aggregate(self, rows, groupby):
+        codes, names = (self.geneCodes, self.genes) if groupby == "gene" else (self.miRNACodes, self.miRNAs)
+        groups = pd.DataFrame({"code": codes[rows], "prediction": self.prediction[rows], "mfe": self.mfe[rows]})
+        summary = groups.groupby("code").agg(sites=("prediction", "size"),
+                                             maxPrediction=("prediction", "max"),
+                                             minMFE=("mfe", "min"))
+        summary = summary.sort_values(["sites", "maxPrediction"], ascending=False, kind="stable")
+        return [{groupby: names[code], "sites": int(row.sites), "maxPrediction": float(row.maxPrediction),
+                 "minMFE": float(row.minMFE)} for code, row in zip(summary.index, summary.itertuples())]
+
+
+class PredictionStore(object):
+    '''the result files under the result folders and the current SiteIndex'''
+
+    def __init__(self, resultFolders, pattern=DEFAULT_PATTERN):
+        self.resultFolders = resultFolders
+        self.pattern = pattern
+        self.siteTables = {}
+        self.fileStamps = {}
+        self.failedFiles = {}
+        self.index = None
+        self.reloadLock = threading.Lock()
+
+    def findResultFiles(self):
+        resultFiles = {}
+        for resultFolder in self.resultFolders:
+            for folder, _, fileNames in os.walk(resultFolder):
+                for fileName in fileNames:
+                    if fnmatch.fnmatch(compressedIO.splitCompressionExtension(fileName)[0], self.pattern):
+                        resultFile = os.path.join(folder, fileName)
+                        status = os.stat(resultFile)
+                        resultFiles[resultFile] = (status.st_mtime, status.st_size)
+        return resultFiles
+
+    def reload(self):
+        '''read new and changed files and rebuild the index, returns True if anything changed'''
+        with self.reloadLock:
+            resultFiles = self.findResultFiles()
+            changed = [f for f, stamp in resultFiles.items()
+                       if self.fileStamps.get(f) != stamp and self.failedFiles.get(f) != stamp]
+            removed = [f for f in self.fileStamps if f not in resultFiles]
+            for resultFile in [f for f in self.failedFiles if f not in resultFiles]:
+                del self.failedFiles[resultFile]
+            if not changed and not removed and self.index is not None:
+                return False
+            for resultFile in removed:
+                logging.info("--removed <" + resultFile + ">")
+                del self.siteTables[resultFile]
+                del self.fileStamps[resultFile]
+            for resultFile in changed:
+                try:
+                    self.siteTables[resultFile] = readSitesFile(resultFile)
+                    self.fileStamps[resultFile] = resultFiles[resultFile]
+                    self.failedFiles.pop(resultFile, None)
+                    logging.info("--read <" + str(len(self.siteTables[resultFile])) + "> sites from <" + resultFile + ">")
+                except Exception as e:
+                    # probably still being written, try again when it changes
+                    self.failedFiles[resultFile] = resultFiles[resultFile]
+                    logging.warning("--can't read <" + resultFile + "> (" + repr(e) + ")")
+            if not self.siteTables:
+                self.index = None
+                return True
+            startTime = time.perf_counter()
+            index = SiteIndex(self.siteTables)
+            self.index = index
+            logging.info("indexed <" + str(len(index)) + "> sites from <" + str(len(index.files)) + "> files in "
+                         + "{:.2f}".format(time.perf_counter() - startTime) + "s")
+            return True
+
+    def watch(self, interval):
+        '''rescan the result folders every interval seconds (runs in a daemon thread)'''
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error("--reload failed (" + repr(e) + ")")
+
+
+def floatParameter(query, name):
+    if name not in query:
+        return None
+    try:
+        return float(query[name])
+    except ValueError:
+        raise QueryError("<" + name + "> must be a number")
+
+
+def intParameter(query, name, default):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise QueryError("<" + name + "> must be an integer")
+    if value < 1:
+        raise QueryError("<" + name + "> must be at least 1")
+    return value
+
+
+def answerQuery(store, path, query):
+    '''the JSON answer for a query path and its parameters'''
+    if path == "/reload":
+        return {"reloaded": store.reload()}
+    index = store.index
+    if path == "/status":
+        return {"folders": store.resultFolders,
+                "files": len(index.files) if index else 0,
+                "sites": len(index) if index else 0,
+                "genes": len(index.genes) if index else 0,
+                "miRNAs": len(index.miRNAs) if index else 0,
+                "indexed": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(index.builtAt)) if index else None,
+                "unreadable": sorted(store.failedFiles)}
+    if path not in ("/sites", "/top", "/aggregate"):
+        raise QueryError("unknown query <" + path + ">, use /sites, /top, /aggregate, /status or /reload")
+    mode = query.get("mode", MODE_FILTERER)
+    if mode not in (MODE_FILTERER, MODE_CUTOFF):
+        raise QueryError("<mode> must be " + MODE_FILTERER + " or " + MODE_CUTOFF)
+    if index is None:
+        return {"count": 0, "rows": []}
+    rows = index.select(gene=query.get("gene"), miRNA=query.get("miRNA"),
+                        p=floatParameter(query, "p"), e=floatParameter(query, "e"), mode=mode)
+    if path == "/aggregate":
+        groupby = query.get("groupby", "miRNA")
+        if groupby not in ("gene", "miRNA"):
+            raise QueryError("<groupby> must be gene or miRNA")
+        groups = index.aggregate(rows, groupby)
+        return {"count": len(groups), "sites": len(rows), "rows": groups[:intParameter(query, "limit", DEFAULT_LIMIT)]}
+    if path == "/top":
+        k = intParameter(query, "k", DEFAULT_TOP_K)
+        by = query.get("by", "prediction")
+        if by == "mfe":
+            rows = rows[np.argsort(index.mfe[rows], kind="stable")[:k]]
+        elif by == "prediction":
+            rows = rows[:k]
+        else:
+            raise QueryError("<by> must be prediction or mfe")
+        return {"count": len(rows), "rows": index.records(rows)}
+    limit = intParameter(query, "limit", DEFAULT_LIMIT)
+    return {"count": len(rows), "rows": index.records(rows[:limit])}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    store = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        startTime = time.perf_counter()
+        try:
+            answer = answerQuery(self.store, url.path.rstrip("/") or "/", query)
+            status = 200
+        except QueryError as e:
+            answer = {"error": str(e)}
+            status = 400
+        answer["milliseconds"] = round(1000 * (time.perf_counter() - startTime), 3)
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("--" + self.address_string() + " " + (format % args))
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='query service over miRAW prediction results')
+
+    parser.add_argument("-r", "--resultfolder", dest='resultFolders', action="append",
+                        help="folder with miRAW result files, can be given more than once")
+    parser.add_argument("-n", "--pattern", dest='pattern', default=DEFAULT_PATTERN,
+                        help="result file name pattern [default: %(default)s]")
+    parser.add_argument("--host", dest='host', default=DEFAULT_HOST,
+                        help="address to listen on [default: %(default)s]")
+    parser.add_argument("--port", dest='port', type=int, default=DEFAULT_PORT,
+                        help="port to listen on [default: %(default)s]")
+    parser.add_argument("-i", "--interval", dest='interval', type=float, default=DEFAULT_RELOAD_INTERVAL,
+                        help="seconds between scans for new result files, 0 to switch off [default: %(default)s]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking result folders:")
+    if not args.resultFolders:
+        logging.error("----you need to specify at least one result folder using the -r/--resultfolder parameter")
+        printHelpAndExit()
+    for resultFolder in args.resultFolders:
+        if not os.path.isdir(resultFolder):
+            logging.error("----can't find result folder <" + resultFolder + ">")
+            printHelpAndExit()
+    logging.info("--OK")
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    store = PredictionStore([os.path.abspath(f) for f in args.resultFolders], args.pattern)
+    store.reload()
+    if args.interval > 0:
+        threading.Thread(target=store.watch, args=(args.interval,), daemon=True).start()
+
+    QueryHandler.store = store
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    logging.info("listening on http://" + args.host + ":" + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
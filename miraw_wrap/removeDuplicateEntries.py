@@ -1,38 +1,37 @@
-from Bio import SeqIO
+import fastaReader
 
-names=[]
+names=set()
 records=[]
 sequence_count=0
 skip_count=0
 duplicate_count=0
 keep_count=0
-for record in SeqIO.parse("/home/sr/research/ensembl/ensembl_hsa_3utrs.fa", "fasta"):
+for name, description, seq in fastaReader.readFasta("/home/sr/research/ensembl/ensembl_hsa_3utrs.fa"):
     sequence_count+=1
     if(sequence_count%10000==0):
         print(str(sequence_count)+"..")
-        
-    if not "unavailable" in record.seq:
-        
-        try:
-            i= names.index(record.id.split("|")[2])
-            #print(record.id.split("|")[2] + " already exists at index <" + str(i) + ">")
+
+    if not "unavailable" in seq:
+
+        if name.split("|")[2] in names:
+            #print(name.split("|")[2] + " already exists")
             duplicate_count+=1
-            
-        except ValueError:
-            #print("add <" + str(record.id.split("|")[2]) + ">")
-            names.append(record.id.split("|")[2])
-            records.append(record)
+
+        else:
+            #print("add <" + str(name.split("|")[2]) + ">")
+            names.add(name.split("|")[2])
+            records.append((name, description, seq))
             keep_count+=1
-            
+
     else:
         skip_count+=1
-        #print("missing sequence <" + record.id + "> - skipping")
+        #print("missing sequence <" + name + "> - skipping")
 #print names
-    
+
 with open("/home/sr/research/ensembl/ensembl_hsa_3utrs.uniq.fa", 'w') as f_out:
 
-    r=SeqIO.write(records, f_out, 'fasta')    
-    
+    fastaReader.writeFasta(records, f_out)
+
 print("read " + str(sequence_count) + " records:")
 print("removed " + str(duplicate_count) + "duplicate entries")
 print("removed " + str(skip_count) + " entries without sequence")
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run the jobs in a shell script generated by miRAWbatch.py and split the
+jobs that run out of memory or time into smaller jobs
+
+    python resplitMiRAWjobs.py -s /remote/expt.sh -n 4 -T 7200
+    python resplitMiRAWjobs.py -s /remote/expt.sh -n 4 -T 7200 --resume
+
+-s the shell script generated by miRAWbatch.py (one miRAW job per line)
+-j the journal file (default: the script name + .journal)
+-w folder for the split jobs (default: the script name + .resplit)
+-n number of jobs to run at the same time
+-T maximum run time for a job in seconds
+-p number of parts a failed job is split into (default 2)
+--min-heap / --max-heap  limits of the JVM heap, in MB
+--heap-per-mwindow       heap in MB per million scan windows
+--resume, --verify       as for runMiRAWjobs.py
+
+The JVM heap of a job (-Xmx) is set from its predicted workload: the
+number of windows miRAW scans,
+
+    windows = sum over the pairs of (3'UTR length - MaxSiteLength) / SeedAlignmentOffset + 1
+
+When miRAW runs out of memory (OutOfMemoryError, or killed with exit code
+137 by the kernel or the scheduler) or out of time, the pairs of the job's
+unified file are split into parts with about the same number of windows.
+Each part runs as its own miRAW experiment in the -w folder and is split
+again if it fails the same way. A single pair that runs out of memory is
+rerun with twice the heap, up to --max-heap. When all the parts of a job
+have finished, their result files are joined (with one header line) into
+the result files the original job would have written, e.g.
+
+    ExperimentFolder/expt.E1/expt.E1.allTargetSites.csv
+
+so the later steps don't see a difference. Exit status, peak memory, heap
+and run time of every run are written to <script>.resplit.tsv.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import compressedIO
+import costModel
+import jobManifest
+import mirawJobs
+from jobJournal import JobJournal, JOURNAL_EXTENSION
+from jobJournal import STATE_RUNNING, STATE_DONE, STATE_FAILED
+from runMiRAWjobs import selectJobs, printStatus
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+RESPLIT_EXTENSION = ".resplit"
+RESPLIT_LOG_COLUMNS = ["job", "experiment", "pairs", "windows", "heapMB", "exitCode", "reason",
+                       "maxRSSMB", "seconds"]
+
+# defaults for the heap model, MB
+MIN_HEAP_MB = 1024
+MAX_HEAP_MB = 16384
+HEAP_MB_PER_MWINDOW = 512
+# miRAW defaults, used when the .properties file doesn't set them
+MAX_SITE_LENGTH = 40
+SEED_ALIGNMENT_OFFSET = 5
+UTR_COLUMN = 5
+
+EXIT_OOM_KILLED = 137
+OOM_SIGNATURES = ["java.lang.OutOfMemoryError", "GC overhead limit exceeded", "Requested array size exceeds VM limit"]
+REASON_OK = "ok"
+REASON_OOM = "oom"
+REASON_TIMEOUT = "timeout"
+REASON_ERROR = "error"
+
+
+class Part(object):
+    '''a miRAW run for some or all of the pairs of a job'''
+
+    def __init__(self, job, experimentName, experimentFolder, header, rows, windows, parent=None):
+        self.job = job
+        self.experimentName = experimentName
+        self.experimentFolder = experimentFolder
+        self.header = header
+        self.rows = rows
+        self.windows = windows
+        self.parent = parent
+        self.children = []
+        self.remaining = 0
+        self.heapMB = None
+
+    @property
+    def outputFolder(self):
+        return os.path.join(self.experimentFolder, self.experimentName)
+
+    @property
+    def workload(self):
+        return sum(self.windows)
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='run miRAW jobs, splitting jobs that run out of memory or time')
+
+    parser.add_argument("-s", "--script", dest='scriptFile',
+                        help="shell script generated by miRAWbatch")
+    parser.add_argument("-j", "--journal", dest='journalFile',
+                        help="journal file [default: script + .journal]")
+    parser.add_argument("-w", "--workFolder", dest='workFolder',
+                        help="folder for the split jobs [default: script + .resplit]")
+    parser.add_argument("-n", "--jobs", dest='jobs', type=int, default=1,
+                        help="number of jobs to run in parallel")
+    parser.add_argument("-T", "--timeout", dest='timeout', type=int,
+                        help="maximum run time for a job in seconds")
+    parser.add_argument("-p", "--parts", dest='parts', type=int, default=2,
+                        help="number of parts a failed job is split into [default: 2]")
+    parser.add_argument("--min-heap", dest='minHeap', type=int, default=MIN_HEAP_MB,
+                        help="smallest JVM heap in MB [default: " + str(MIN_HEAP_MB) + "]")
+    parser.add_argument("--max-heap", dest='maxHeap', type=int, default=MAX_HEAP_MB,
+                        help="largest JVM heap in MB [default: " + str(MAX_HEAP_MB) + "]")
+    parser.add_argument("--heap-per-mwindow", dest='heapPerMWindow', type=float, default=HEAP_MB_PER_MWINDOW,
+                        help="JVM heap in MB per million scan windows [default: " + str(HEAP_MB_PER_MWINDOW) + "]")
+    parser.add_argument("-k", "--keep", action="store_true",
+                        help="keep the split jobs after their results were joined")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip completed jobs and rerun partial ones")
+    parser.add_argument("--verify", action="store_true",
+                        help="check output checksums of completed jobs when resuming")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking script file:")
+    if not args.scriptFile:
+        logging.error("----you need to specify a script file using the -s/--script parameter")
+        printHelpAndExit()
+    if not os.path.isfile(args.scriptFile):
+        logging.error("--can't find script file at <" + args.scriptFile + ">")
+        sys.exit(1)
+    if not args.journalFile:
+        args.journalFile = args.scriptFile + JOURNAL_EXTENSION
+    if not args.workFolder:
+        args.workFolder = args.scriptFile + RESPLIT_EXTENSION
+    logging.info("--journal is <" + args.journalFile + ">, split jobs go to <" + args.workFolder + ">")
+    if args.jobs < 1:
+        logging.error("--the number of parallel jobs (-n) needs to be at least 1")
+        sys.exit(1)
+    if args.parts < 2:
+        logging.error("--a job needs to be split into at least 2 parts (-p)")
+        sys.exit(1)
+    if args.minHeap > args.maxHeap:
+        logging.error("--the smallest heap (--min-heap) is larger than the largest (--max-heap)")
+        sys.exit(1)
+    logging.info("--OK")
+
+
+def readUnifiedRows(job):
+    '''(header line, pair lines) of the job's unified file'''
+    if job.manifestFile:
+        meta, task = jobManifest.readTask(job.manifestFile, job.taskIndex)
+        lines = jobManifest.readChunk(meta, task).splitlines(True)
+    else:
+        # with miRAWbatch -Z only the compressed unified file exists
+        unifiedFile = compressedIO.resolvePath(job.properties[mirawJobs.UNIFIED_FILE_KEY])
+        with compressedIO.openFile(unifiedFile, 'r') as fU:
+            lines = fU.readlines()
+    return lines[0], [line for line in lines[1:] if line.strip()]
+
+
+def scanWindows(rows, properties):
+    '''number of windows miRAW scans for each pair'''
+    siteLength = int(properties.get("MaxSiteLength", MAX_SITE_LENGTH))
+    offset = max(1, int(properties.get("SeedAlignmentOffset", SEED_ALIGNMENT_OFFSET)))
+    windows = []
+    for row in rows:
+        fields = row.rstrip("\r\n").split("\t")
+        utrLength = len(fields[UTR_COLUMN]) if len(fields) > UTR_COLUMN else 0
+        windows.append(costModel.windowCount(utrLength, siteLength, offset))
+    return windows
+
+
+def heapFor(windows, args):
+    '''JVM heap in MB for a workload'''
+    heapMB = args.minHeap + args.heapPerMWindow * windows / 1e6
+    return int(min(args.maxHeap, max(args.minHeap, heapMB)))
+
+
+def splitRows(part, parts):
+    '''
+    split the pairs of a part into contiguous pieces with about the same
+    number of windows. A part with two or more pairs always gives at least
+    two pieces, so a piece is never the whole part again
+    '''
+    rows = len(part.rows)
+    if rows < 2:
+        return [(part.rows, part.windows)]
+    parts = max(2, min(parts, rows))
+    cumulative = [0]
+    for windows in part.windows:
+        cumulative.append(cumulative[-1] + windows)
+    total = float(cumulative[-1])
+    cuts = [0]
+    for k in range(1, parts):
+        # cut where the pieces so far come closest to their share, leaving
+        # at least one pair for this piece and for each later piece
+        share = total * k / parts
+        cuts.append(min(range(cuts[-1] + 1, rows - (parts - k) + 1),
+                        key=lambda cut: abs(cumulative[cut] - share)))
+    cuts.append(rows)
+    return [(part.rows[a:b], part.windows[a:b]) for a, b in zip(cuts, cuts[1:])]
+
+
+def writePartFiles(part, args):
+    '''write the unified file and .properties file for a part, returns the .properties file'''
+    workFolder = os.path.join(args.workFolder, part.job.jobID)
+    os.makedirs(workFolder, exist_ok=True)
+    unifiedFile = os.path.join(workFolder, part.experimentName + ".unifiedFile.csv")
+    with open(unifiedFile, 'w') as fU:
+        fU.write(part.header)
+        fU.writelines(part.rows)
+    properties = dict(part.job.properties)
+    properties[mirawJobs.EXPERIMENT_NAME_KEY] = part.experimentName
+    properties[mirawJobs.EXPERIMENT_FOLDER_KEY] = part.experimentFolder
+    properties[mirawJobs.UNIFIED_FILE_KEY] = unifiedFile
+    propertiesFile = os.path.join(workFolder, part.experimentName + mirawJobs.PROPERTIES_EXTENSION)
+    with open(propertiesFile, 'w') as fP:
+        fP.write("# written by resplitMiRAWjobs.py for <" + part.job.jobID + ">\n")
+        for key, value in properties.items():
+            fP.write(key + "=" + value + "\n")
+    return propertiesFile
+
+
+def failureReason(exitCode, timedOut, stderrFile):
+    if exitCode == 0:
+        return REASON_OK
+    if timedOut:
+        return REASON_TIMEOUT
+    if exitCode in (EXIT_OOM_KILLED, -9):
+        return REASON_OOM
+    with open(stderrFile, 'r', errors='replace') as fE:
+        stderrText = fE.read()
+    if any(signature in stderrText for signature in OOM_SIGNATURES):
+        return REASON_OOM
+    return REASON_ERROR
+
+
+def runPart(part, args):
+    '''run miRAW for a part, returns (exit code, reason, peak RSS in MB, seconds)'''
+    propertiesFile = writePartFiles(part, args)
+    os.makedirs(part.experimentFolder, exist_ok=True)
+    if os.path.isdir(part.outputFolder):
+        shutil.rmtree(part.outputFolder)
+    command = ["java", "-Xmx" + str(part.heapMB) + "m", "-XX:+ExitOnOutOfMemoryError",
+               "-jar", mirawJobs.jarLocation(part.job), "GenePrediction", "predict", propertiesFile]
+    stderrFile = propertiesFile[:-len(mirawJobs.PROPERTIES_EXTENSION)] + ".stderr.log"
+    logging.info("--running <" + part.experimentName + ">: " + str(len(part.rows)) + " pairs, "
+                 + str(part.workload) + " windows, heap " + str(part.heapMB) + "MB")
+    started = time.time()
+    timedOut = threading.Event()
+    with open(stderrFile, 'w') as fE:
+        process = subprocess.Popen(command, stderr=fE)
+
+        def stop():
+            timedOut.set()
+            process.kill()
+
+        timer = threading.Timer(args.timeout, stop) if args.timeout else None
+        if timer:
+            timer.start()
+        # wait4 gives the peak memory of this process, which the pool threads can't get otherwise
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if timer:
+            timer.cancel()
+    exitCode = process.returncode
+    reason = failureReason(exitCode, timedOut.is_set(), stderrFile)
+    return exitCode, reason, usage.ru_maxrss / 1024.0, time.time() - started
+
+
+def joinPartResults(part):
+    '''join the result files of the parts into the result files of part'''
+    # anything the failed run of part left behind
+    if os.path.isdir(part.outputFolder):
+        shutil.rmtree(part.outputFolder)
+    os.makedirs(part.outputFolder)
+    first = part.children[0]
+    for fileName in sorted(os.listdir(first.outputFolder)):
+        if not fileName.startswith(first.experimentName) or fileName == mirawJobs.COMPLETION_MARKER:
+            continue
+        suffix = fileName[len(first.experimentName):]
+        header = None
+        with open(os.path.join(part.outputFolder, part.experimentName + suffix), 'w') as fOut:
+            for child in part.children:
+                childFile = os.path.join(child.outputFolder, child.experimentName + suffix)
+                if not os.path.isfile(childFile):
+                    continue
+                with open(childFile, 'r') as fIn:
+                    firstLine = fIn.readline()
+                    if header is None:
+                        header = firstLine
+                        fOut.write(firstLine)
+                    elif firstLine != header:
+                        fOut.write(firstLine)
+                    shutil.copyfileobj(fIn, fOut)
+    logging.info("--joined <" + str(len(part.children)) + "> parts into <" + part.outputFolder + ">")
+
+
+def writeResplitLog(fLog, part, exitCode, reason, maxRSS, seconds):
+    fLog.write("\t".join([part.job.jobID, part.experimentName, str(len(part.rows)), str(part.workload),
+                          str(part.heapMB), str(exitCode), reason, "%.0f" % maxRSS, "%.1f" % seconds]) + "\n")
+    fLog.flush()
+
+
+def supervise(jobs, journal, args):
+    '''run the jobs, splitting the ones that run out of memory or time. Returns the number of failed jobs'''
+    failedJobs = set()
+    logFile = args.scriptFile + RESPLIT_EXTENSION + ".tsv"
+    writeHeader = not os.path.isfile(logFile)
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor, open(logFile, 'a') as fLog:
+        if writeHeader:
+            fLog.write("\t".join(RESPLIT_LOG_COLUMNS) + "\n")
+        running = {}
+
+        def submit(part):
+            if part.heapMB is None:
+                part.heapMB = heapFor(part.workload, args)
+            running[executor.submit(runPart, part, args)] = part
+
+        for job in jobs:
+            if not job.outputFolder:
+                logging.error("--can't find the experiment folder for <" + job.jobID + ">, skipping it")
+                failedJobs.add(job.jobID)
+                continue
+            header, rows = readUnifiedRows(job)
+            part = Part(job, job.properties[mirawJobs.EXPERIMENT_NAME_KEY],
+                        job.properties[mirawJobs.EXPERIMENT_FOLDER_KEY], header, rows,
+                        scanWindows(rows, job.properties))
+            journal.record(job.jobID, STATE_RUNNING)
+            submit(part)
+
+        while running:
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                part = running.pop(future)
+                job = part.job
+                try:
+                    exitCode, reason, maxRSS, seconds = future.result()
+                except Exception as e:
+                    logging.error("--<" + part.experimentName + "> could not be run: " + str(e))
+                    exitCode, reason, maxRSS, seconds = -1, REASON_ERROR, 0, 0
+                writeResplitLog(fLog, part, exitCode, reason, maxRSS, seconds)
+                if job.jobID in failedJobs:
+                    continue
+
+                if reason == REASON_OK:
+                    finishPart(part, journal, args)
+                    continue
+                if reason == REASON_OOM and len(part.rows) == 1 and part.heapMB < args.maxHeap:
+                    logging.info("--<" + part.experimentName + "> ran out of memory, retrying with a larger heap")
+                    part.heapMB = min(args.maxHeap, part.heapMB * 2)
+                    submit(part)
+                    continue
+                pieces = splitRows(part, args.parts) if reason in (REASON_OOM, REASON_TIMEOUT) else []
+                # never submit a piece with all the rows of the part again
+                if len(pieces) > 1 and all(len(rows) < len(part.rows) for rows, _ in pieces):
+                    logging.info("--<" + part.experimentName + "> failed (" + reason + "), splitting <"
+                                 + str(len(part.rows)) + "> pairs into <" + str(len(pieces)) + "> parts")
+                    partFolder = os.path.join(args.workFolder, job.jobID)
+                    for i, (rows, windows) in enumerate(pieces):
+                        child = Part(job, part.experimentName + ".part" + str(i), partFolder,
+                                     part.header, rows, windows, parent=part)
+                        part.children.append(child)
+                    part.remaining = len(part.children)
+                    for child in part.children:
+                        submit(child)
+                    continue
+
+                logging.error("--job <" + job.jobID + "> failed (" + reason + ", exit code "
+                              + str(exitCode) + ") in <" + part.experimentName + ">")
+                failedJobs.add(job.jobID)
+                journal.record(job.jobID, STATE_FAILED, exitCode)
+    return len(failedJobs)
+
+
+def finishPart(part, journal, args):
+    '''a part has its results, join them into its parent once all its siblings are done'''
+    while part.parent is not None:
+        parent = part.parent
+        parent.remaining -= 1
+        if parent.remaining:
+            return
+        joinPartResults(parent)
+        part = parent
+    job = part.job
+    mirawJobs.writeCompletionMarker(part.outputFolder)
+    journal.record(job.jobID, STATE_DONE, 0, mirawJobs.collectOutputs(part.outputFolder))
+    logging.info("--job <" + job.jobID + "> done")
+    workFolder = os.path.join(args.workFolder, job.jobID)
+    if not args.keep and os.path.isdir(workFolder):
+        shutil.rmtree(workFolder)
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+
+    jobs = mirawJobs.readJobScript(args.scriptFile)
+    logging.info("read <" + str(len(jobs)) + "> jobs from <" + args.scriptFile + ">")
+    journal = JobJournal(args.journalFile)
+
+    queue = selectJobs(jobs, journal, args.resume, args.verify)
+    failures = supervise(queue, journal, args)
+    printStatus(jobs, journal)
+    if failures:
+        logging.error("<" + str(failures) + "> jobs failed, rerun with --resume to retry them")
+        return 1
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run the jobs in a shell script generated by miRAWbatch.py and keep
+track of their state in a journal, so that an interrupted run can be resumed
+
+    python runMiRAWjobs.py -s /remote/expt.sh -n 4
+    python runMiRAWjobs.py -s /remote/expt.sh -n 4 --resume
+
+-s the shell script generated by miRAWbatch.py (one miRAW job per line)
+-j the journal file (default: the script name + .journal)
+-n number of jobs to run at the same time
+--resume skip jobs that finished in an earlier run and whose output files
+         are unchanged. Jobs that were running or failed when the run
+         stopped have their partial output removed and are run again
+--verify when resuming, also compare the md5 checksums of the output files
+--status print the state of the jobs in the journal and stop
+--stage [folder] run each job on node-local scratch (default: $TMPDIR) and
+         copy the compressed results back, see scratchStaging.py
+"""
+
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import mirawJobs
+import scratchStaging
+from jobJournal import JobJournal, JOURNAL_EXTENSION
+from jobJournal import STATE_RUNNING, STATE_DONE, STATE_FAILED
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='run miRAW jobs with a job-state journal')
+
+    parser.add_argument("-s", "--script", dest='scriptFile',
+                        help="shell script generated by miRAWbatch")
+    parser.add_argument("-j", "--journal", dest='journalFile',
+                        help="journal file [default: script + .journal]")
+    parser.add_argument("-n", "--jobs", dest='jobs', type=int, default=1,
+                        help="number of jobs to run in parallel")
+    parser.add_argument("-T", "--timeout", dest='timeout', type=int,
+                        help="maximum run time for a job in seconds")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip completed jobs and rerun partial ones")
+    parser.add_argument("--verify", action="store_true",
+                        help="check output checksums of completed jobs when resuming")
+    parser.add_argument("--status", action="store_true",
+                        help="print the job states and stop")
+    parser.add_argument("--stage", dest='scratchFolder', nargs="?", const="",
+                        help="run the jobs on node-local scratch [default folder: $TMPDIR]")
+    parser.add_argument("--stageCompress", dest='stageCompress', choices=sorted(scratchStaging.COMPRESSIONS),
+                        default="gz", help="compression of the results copied back from scratch [default: gz]")
+    parser.add_argument("--transfers", dest='transfers', type=int, default=scratchStaging.TRANSFERS,
+                        help="number of parallel copies back from scratch [default: "
+                             + str(scratchStaging.TRANSFERS) + "]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking script file:")
+    if not args.scriptFile:
+        logging.error("----you need to specify a script file using the -s/--script parameter")
+        printHelpAndExit()
+    if not os.path.isfile(args.scriptFile):
+        logging.error("--can't find script file at <" + args.scriptFile + ">")
+        sys.exit(1)
+    if not args.journalFile:
+        args.journalFile = args.scriptFile + JOURNAL_EXTENSION
+    logging.info("--journal is <" + args.journalFile + ">")
+    if args.jobs < 1:
+        logging.error("--the number of parallel jobs (-n) needs to be at least 1")
+        sys.exit(1)
+    if args.scratchFolder is not None:
+        if not args.scratchFolder:
+            args.scratchFolder = os.environ.get("TMPDIR", tempfile.gettempdir())
+        os.makedirs(args.scratchFolder, exist_ok=True)
+        if args.transfers < 1:
+            logging.error("--the number of transfers (--transfers) needs to be at least 1")
+            sys.exit(1)
+        logging.info("--staging jobs in <" + args.scratchFolder + ">")
+    logging.info("--OK")
+
+
+def selectJobs(jobs, journal, resume, verify):
+    '''
+    return the jobs that still need to run. When resuming, completed jobs
+    with unchanged outputs are skipped and partial outputs are removed
+    '''
+    if not resume:
+        return jobs
+
+    queue = []
+    for job in jobs:
+        record = journal.records.get(job.jobID)
+        if record is None:
+            queue.append(job)
+            continue
+        if record["state"] == STATE_DONE \
+                and mirawJobs.outputsMatch(job.outputFolder, record["outputs"], checksums=verify):
+            continue
+        # the job was interrupted, failed, or its output changed since it finished
+        if job.outputFolder and os.path.isdir(job.outputFolder):
+            logging.info("--removing partial output for <" + job.jobID + ">")
+            shutil.rmtree(job.outputFolder)
+        queue.append(job)
+
+    logging.info("--skipping <" + str(len(jobs) - len(queue)) + "> completed jobs")
+    return queue
+
+
+def recordDone(job, journal):
+    mirawJobs.writeCompletionMarker(job.outputFolder)
+    journal.record(job.jobID, STATE_DONE, 0, mirawJobs.collectOutputs(job.outputFolder))
+    logging.info("--job <" + job.jobID + "> done")
+
+
+def runAndRecord(job, journal, timeout=None, stager=None):
+    journal.record(job.jobID, STATE_RUNNING)
+    if stager is None:
+        exitCode = mirawJobs.runJob(job, timeout)
+    else:
+        exitCode = stager.runJob(job, timeout)
+    if exitCode == 0:
+        if stager is None:
+            recordDone(job, journal)
+        else:
+            # the results are copied back in the background, so the next job can start
+            stager.copyBack(job, lambda: recordDone(job, journal),
+                            lambda: journal.record(job.jobID, STATE_FAILED))
+    else:
+        journal.record(job.jobID, STATE_FAILED, exitCode)
+        logging.error("--job <" + job.jobID + "> failed with exit code <" + str(exitCode) + ">")
+    return exitCode
+
+
+def runJobs(jobs, journal, nJobs, timeout=None, stager=None):
+    logging.info("running <" + str(len(jobs)) + "> jobs, <" + str(nJobs) + "> at a time")
+    with ThreadPoolExecutor(max_workers=nJobs) as executor:
+        exitCodes = list(executor.map(lambda job: runAndRecord(job, journal, timeout, stager), jobs))
+    failures = sum(1 for exitCode in exitCodes if exitCode != 0)
+    if stager is not None:
+        failures += stager.finish()
+    return failures
+
+
+def printStatus(jobs, journal):
+    counts = {}
+    for job in jobs:
+        state = journal.state(job.jobID)
+        counts[state] = counts.get(state, 0) + 1
+    for state in sorted(counts):
+        logging.info("--" + state + "\t" + str(counts[state]))
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+
+    jobs = mirawJobs.readJobScript(args.scriptFile)
+    logging.info("read <" + str(len(jobs)) + "> jobs from <" + args.scriptFile + ">")
+    journal = JobJournal(args.journalFile)
+
+    if args.status:
+        printStatus(jobs, journal)
+        return 0
+
+    queue = selectJobs(jobs, journal, args.resume, args.verify)
+    stager = None
+    if args.scratchFolder is not None:
+        stager = scratchStaging.ScratchStager(args.scratchFolder, scratchStaging.COMPRESSIONS[args.stageCompress],
+                                              args.transfers)
+    failures = runJobs(queue, journal, args.jobs, args.timeout, stager)
+    printStatus(jobs, journal)
+    if failures:
+        logging.error("<" + str(failures) + "> jobs failed, rerun with --resume to retry them")
+        return 1
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run miRAW jobs on node-local scratch instead of the shared remoteFolder
+
+With runMiRAWjobs.py --stage, each job
+
+  1. copies its unified file (unpacked, if miRAWbatch -Z compressed it, or
+     the chunk of a job array task) to <scratch>/<jobID>/
+  2. writes a .properties file there, with UnifiedFile and ExperimentFolder
+     pointing to the scratch folder, and runs miRAW on it
+  3. hands the results to a small pool of transfer threads and goes on with
+     the next job. A transfer compresses each result file while copying it
+     to <ExperimentFolder>/<ExperimentName>.staging.<host>.<pid> on the
+     shared filesystem, and renames that folder to
+     <ExperimentFolder>/<ExperimentName> once all the files are there
+
+so miRAW's many small reads and writes stay on the local disk, the shared
+filesystem only sees one sequential copy per file, and the experiment
+folder either doesn't exist or is complete. At most 2 x --transfers
+results wait for a transfer at any time, so a slow filesystem can't fill
+the scratch disk.
+"""
+
+import os
+import shutil
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import compressedIO
+import jobManifest
+import mirawJobs
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+STAGING_EXTENSION = ".staging"
+STAGED_OUTPUT_FOLDER = "results"
+# --stageCompress option -> compressedIO compression type
+COMPRESSIONS = {"gz": compressedIO.COMPRESSION_GZIP,
+                "bgz": compressedIO.COMPRESSION_BGZIP,
+                "zst": compressedIO.COMPRESSION_ZSTD,
+                "none": compressedIO.COMPRESSION_NONE}
+TRANSFERS = 2
+
+
+def stageInputs(job, jobScratch):
+    '''copy the job's unified file to jobScratch and write its .properties file there'''
+    if os.path.isdir(jobScratch):
+        shutil.rmtree(jobScratch)
+    os.makedirs(os.path.join(jobScratch, STAGED_OUTPUT_FOLDER))
+    unifiedFile = os.path.join(jobScratch, job.jobID + ".unifiedFile.csv")
+    if job.manifestFile:
+        meta, task = jobManifest.readTask(job.manifestFile, job.taskIndex)
+        with open(unifiedFile, 'w') as fU:
+            fU.write(jobManifest.readChunk(meta, task))
+    else:
+        with compressedIO.openFile(job.properties[mirawJobs.UNIFIED_FILE_KEY], 'rb') as fIn, \
+                open(unifiedFile, 'wb') as fU:
+            shutil.copyfileobj(fIn, fU, compressedIO.BLOCK_SIZE)
+
+    properties = dict(job.properties)
+    properties[mirawJobs.UNIFIED_FILE_KEY] = unifiedFile
+    properties[mirawJobs.EXPERIMENT_FOLDER_KEY] = os.path.join(jobScratch, STAGED_OUTPUT_FOLDER)
+    propertiesFile = os.path.join(jobScratch, job.jobID + mirawJobs.PROPERTIES_EXTENSION)
+    with open(propertiesFile, 'w') as fP:
+        fP.write("# staged by runMiRAWjobs.py for <" + job.jobID + ">\n")
+        for key, value in properties.items():
+            fP.write(key + "=" + value + "\n")
+    return propertiesFile
+
+
+def copyBack(stagedFolder, outputFolder, compression):
+    '''
+    copy (and compress) the files in stagedFolder to a temporary folder next to
+    outputFolder, then rename it to outputFolder
+    '''
+    stagingFolder = outputFolder + STAGING_EXTENSION + "." + socket.gethostname() + "." + str(os.getpid())
+    if os.path.isdir(stagingFolder):
+        shutil.rmtree(stagingFolder)
+    ext = [e for e, c in compressedIO.COMPRESSION_EXTENSIONS.items() if c == compression][0] if compression else ""
+    for root, dirs, files in os.walk(stagedFolder):
+        targetRoot = os.path.join(stagingFolder, os.path.relpath(root, stagedFolder))
+        os.makedirs(targetRoot, exist_ok=True)
+        for fileName in files:
+            with open(os.path.join(root, fileName), 'rb') as fIn, \
+                    compressedIO.openFile(os.path.join(targetRoot, fileName + ext), 'wb') as fOut:
+                shutil.copyfileobj(fIn, fOut, compressedIO.BLOCK_SIZE)
+    # a partial folder from an interrupted, unstaged run of the job
+    if os.path.isdir(outputFolder):
+        shutil.rmtree(outputFolder)
+    os.rename(stagingFolder, outputFolder)
+
+
+class ScratchStager(object):
+    '''runs jobs in scratchFolder and copies their results back in the background'''
+
+    def __init__(self, scratchFolder, compression=compressedIO.COMPRESSION_GZIP, transfers=TRANSFERS):
+        self.scratchFolder = scratchFolder
+        self.compression = compression
+        self.pool = ThreadPoolExecutor(max_workers=transfers)
+        self.pending = threading.BoundedSemaphore(2 * transfers)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.failures = 0
+
+    def jobScratch(self, job):
+        return os.path.join(self.scratchFolder, job.jobID)
+
+    def runJob(self, job, timeout=None):
+        '''run the job on scratch and return the exit code, the results stay on scratch'''
+        if not job.outputFolder:
+            logging.error("--can't find the experiment folder for <" + job.jobID + ">, can't stage it")
+            return -1
+        jobScratch = self.jobScratch(job)
+        try:
+            propertiesFile = stageInputs(job, jobScratch)
+        except (IOError, OSError, KeyError, IndexError) as e:
+            logging.error("--could not stage <" + job.jobID + ">: " + str(e))
+            shutil.rmtree(jobScratch, ignore_errors=True)
+            return -1
+        stagedJob = mirawJobs.MiRAWJob(job.index, "java -jar " + mirawJobs.jarLocation(job)
+                                       + " GenePrediction predict " + propertiesFile)
+        exitCode = mirawJobs.runJob(stagedJob, timeout)
+        if exitCode != 0:
+            shutil.rmtree(jobScratch, ignore_errors=True)
+        return exitCode
+
+    def copyBack(self, job, onDone, onFailed):
+        '''copy the results of a finished job back in the transfer pool'''
+        self.pending.acquire()
+        stagedFolder = os.path.join(self.jobScratch(job), STAGED_OUTPUT_FOLDER,
+                                    job.properties[mirawJobs.EXPERIMENT_NAME_KEY])
+
+        def transfer():
+            try:
+                copyBack(stagedFolder, job.outputFolder, self.compression)
+                onDone()
+            except (IOError, OSError) as e:
+                logging.error("--copying the results of <" + job.jobID + "> back failed: " + str(e))
+                with self.lock:
+                    self.failures += 1
+                onFailed()
+            finally:
+                shutil.rmtree(self.jobScratch(job), ignore_errors=True)
+                self.pending.release()
+
+        with self.lock:
+            self.futures.append(self.pool.submit(transfer))
+
+    def finish(self):
+        '''wait for the transfers, returns the number that failed'''
+        self.pool.shutdown(wait=True)
+        return self.failures
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deterministic --shard i/N partitioning for the batch scripts, and the
+merge step that checks the shards of a run are complete.
+
+With --shard i/N (i = 0 .. N-1) miRAWbatch.py only writes the (miRNA, 3'UTR)
+pairs (split 1/2) or the features (split 3/4, job arrays) with
+
+    md5(key) mod N == i
+
+and cutoffBatch.py, pairbatch.py and extractConflictBatch.py only write
+commands for the experiments whose feature name hashes to shard i. The
+feature name is the FEATURE column of the -M manifest, or without -M the
+folder name, less the <exptName>.shard<i>of<N>. prefix a sharded miRAWbatch
+run puts in front of it. The assignment depends only on the key and N, so
+every node can work out its slice without coordination, and with the same
+N a feature is post-processed in the same shard it was generated in
+(without -M, only for the folders of a sharded run, as the prefix of an
+unsharded run can't be told apart from the feature name). The outputs of
+shard i are named <exptName>.shard<i>of<N>.*, and each shard writes a record
+
+    <exptName>.shard<i>of<N>.shard.tsv
+
+with the shard, the number of keys it took, the total number of keys and a
+digest of the full key list. Merge the records with
+
+    python sharding.py -o merged expt.shard*of4.shard.tsv
+
+which fails unless all N shards of the same key list are there and
+together cover every key, and concatenates the experiment manifests of the
+shards into merged.experiments.tsv.
+"""
+
+import os
+import re
+import sys
+import glob
+import hashlib
+import logging
+import argparse
+
+import hashedLayout
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+SHARD_RECORD_EXTENSION = ".shard.tsv"
+RECORD_KEYS = ["TOOL", "SHARD", "SHARDS", "KEYS", "TOTAL", "UNIVERSE", "EXPERIMENT_MANIFEST", "SCRIPT"]
+PAIR_DELIMITER = "\t"
+# <exptName>.shard<i>of<N>. in front of the feature in the name of an experiment folder
+SHARD_PREFIX_PATTERN = re.compile(r"^.*?\.shard\d+of\d+\.")
+
+
+def parseShard(shardString):
+    '''"i/N" -> (i, N), with 0 <= i < N'''
+    try:
+        index, count = [int(part) for part in shardString.split("/")]
+    except ValueError:
+        raise ValueError("shard must be given as i/N, e.g. 0/4, not <" + shardString + ">")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("shard index must be between 0 and N-1 in <" + shardString + ">")
+    return index, count
+
+
+def shardTag(shard):
+    return "shard" + str(shard[0]) + "of" + str(shard[1])
+
+
+def shardName(name, shard):
+    '''name for the outputs of a shard, name itself if shard is None'''
+    if shard is None:
+        return name
+    return name + "." + shardTag(shard)
+
+
+def shardOf(key, count):
+    '''the shard (0 .. count-1) a key belongs to'''
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16) % count
+
+
+def inShard(key, shard):
+    '''True if key belongs to shard, or if there is no sharding'''
+    return shard is None or shardOf(key, shard[1]) == shard[0]
+
+
+def pairKey(miRNAName, utrName):
+    return miRNAName + PAIR_DELIMITER + utrName
+
+
+class ShardRecord(object):
+    '''counts the keys a shard takes, and writes the shard record'''
+
+    def __init__(self, tool, shard, universe):
+        '''universe: the list(s) of names the keys are built from, in order'''
+        self.tool = tool
+        self.shard = shard
+        self.keys = 0
+        self.total = 0
+        digest = hashlib.md5()
+        for names in universe:
+            # sorted, so the digest doesn't depend on e.g. the order of a folder listing
+            for name in sorted(names):
+                digest.update(name.encode() + b"\n")
+            digest.update(b"\x00")
+        self.universe = digest.hexdigest()
+
+    def take(self, key):
+        '''True if key belongs to this shard'''
+        self.total += 1
+        if inShard(key, self.shard):
+            self.keys += 1
+            return True
+        return False
+
+    def write(self, recordFile, experimentManifest="", script=""):
+        values = [self.tool, self.shard[0], self.shard[1], self.keys, self.total, self.universe,
+                  os.path.abspath(experimentManifest) if experimentManifest else "",
+                  os.path.abspath(script) if script else ""]
+        with open(recordFile, 'w') as fR:
+            for key, value in zip(RECORD_KEYS, values):
+                fR.write(key + "\t" + str(value) + "\n")
+        logging.info("--shard " + shardTag(self.shard) + " has <" + str(self.keys) + "> of <"
+                     + str(self.total) + "> keys, record written to <" + recordFile + ">")
+
+
+def featureKey(feature):
+    '''
+    the key miRAWbatch sharded a feature on: the feature itself, or for a
+    folder name <exptName>.shard<i>of<N>.<feature> of a sharded run, <feature>
+    '''
+    return SHARD_PREFIX_PATTERN.sub("", feature, count=1)
+
+
+def shardExperiments(experiments, shard, tool):
+    '''
+    (feature, folder) pairs -> (the folders in the shard, ShardRecord), all the
+    folders and None without sharding
+    '''
+    if shard is None:
+        return [folder for feature, folder in experiments], None
+    keys = [featureKey(feature) for feature, folder in experiments]
+    record = ShardRecord(tool, shard, [keys])
+    return [folder for key, (feature, folder) in zip(keys, experiments) if record.take(key)], record
+
+
+def readShardRecord(recordFile):
+    record = {}
+    with open(recordFile, 'r') as fR:
+        for line in fR:
+            if line.strip():
+                key, _, value = line.rstrip("\n").partition("\t")
+                record[key] = value
+    missing = [key for key in RECORD_KEYS if key not in record]
+    if missing:
+        raise ValueError("<" + recordFile + "> is not a shard record (missing " + ", ".join(missing) + ")")
+    for key in ["SHARD", "SHARDS", "KEYS", "TOTAL"]:
+        record[key] = int(record[key])
+    record["FILE"] = recordFile
+    return record
+
+
+def checkShards(records):
+    '''list of problems that keep the shard records from making up a complete run'''
+    problems = []
+    if not records:
+        return ["no shard records"]
+    first = records[0]
+    for record in records[1:]:
+        for key in ["TOOL", "SHARDS", "TOTAL", "UNIVERSE"]:
+            if record[key] != first[key]:
+                problems.append("<" + record["FILE"] + "> has " + key + " " + str(record[key]) + ", <"
+                                + first["FILE"] + "> has " + str(first[key]))
+    if problems:
+        return problems
+    seen = {}
+    for record in records:
+        if record["SHARD"] in seen:
+            problems.append("shard " + str(record["SHARD"]) + " is in both <" + seen[record["SHARD"]]
+                            + "> and <" + record["FILE"] + ">")
+        seen[record["SHARD"]] = record["FILE"]
+    missing = [str(i) for i in range(first["SHARDS"]) if i not in seen]
+    if missing:
+        problems.append("missing shard(s) " + ", ".join(missing) + " of " + str(first["SHARDS"]))
+    covered = sum(record["KEYS"] for record in records)
+    if not problems and covered != first["TOTAL"]:
+        problems.append("the shards cover " + str(covered) + " of " + str(first["TOTAL"]) + " keys")
+    return problems
+
+
+def mergeExperimentManifests(records, mergedManifest):
+    '''concatenate the experiment manifests of the shards, returns the number of experiments'''
+    experiments = 0
+    with hashedLayout.ExperimentManifestWriter(mergedManifest) as fMerged:
+        for record in sorted(records, key=lambda r: r["SHARD"]):
+            for featureName, experimentFolder in hashedLayout.readExperiments(record["EXPERIMENT_MANIFEST"]):
+                fMerged.add(featureName, experimentFolder)
+                experiments += 1
+    return experiments
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='check and merge the shards of a sharded run')
+
+    parser.add_argument("records", nargs="*",
+                        help="shard records (<exptName>.shard<i>of<N>.shard.tsv), or glob patterns")
+    parser.add_argument("-o", "--out", dest='out',
+                        help="prefix for the merged experiment manifest (<out>.experiments.tsv)")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def main():
+    args = parseArgs()
+    recordFiles = sorted(set(f for pattern in args.records for f in (glob.glob(pattern) or [pattern])))
+    if not recordFiles:
+        logging.error("----you need to specify the shard records to merge")
+        printHelpAndExit()
+    records = [readShardRecord(recordFile) for recordFile in recordFiles]
+    problems = checkShards(records)
+    for problem in problems:
+        logging.error("--" + problem)
+    if problems:
+        logging.error("shards are not complete")
+        return 1
+    logging.info("all <" + str(records[0]["SHARDS"]) + "> shards are there and cover the <"
+                 + str(records[0]["TOTAL"]) + "> keys")
+
+    if args.out:
+        if all(record["EXPERIMENT_MANIFEST"] for record in records):
+            mergedManifest = args.out + hashedLayout.EXPERIMENT_MANIFEST_EXTENSION
+            experiments = mergeExperimentManifests(records, mergedManifest)
+            logging.info("--wrote <" + str(experiments) + "> experiments to <" + mergedManifest + ">")
+        else:
+            logging.info("--the shards have no experiment manifests to merge")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,8 @@ import csv
 import datetime
 import re
 
+import compressedIO
+
 __author__ = "Yafei Xing"
 __copyright__ = "Copyright 2018, AMG-OUS"
 __version__ = "1.0.1"
@@ -84,17 +86,18 @@ def checkTargetsFile(): #check the validity of the commanded files
     global foldername, targetFiles
     logging.info("check target file")
     if args.fileToProcess:
-        foldername=args.fileToProcess
-        ind = foldername.rfind("/")
-        filename = foldername[ind+1:len(foldername)]
-        ind_dot = foldername.rfind(".")
-        file_tail = foldername[ind_dot+1:len(foldername)]
+        foldername=compressedIO.resolvePath(args.fileToProcess)
+        basename, compressionExt = compressedIO.splitCompressionExtension(foldername)
+        ind = basename.rfind("/")
+        filename = basename[ind+1:len(basename)]
+        ind_dot = basename.rfind(".")
+        file_tail = basename[ind_dot+1:len(basename)]
         
         if not os.path.isfile(foldername):
-            logging.error("--can't find sites file at <" + file + ">")
+            logging.error("--can't find sites file at <" + foldername + ">")
             exit()
 
-        targetFiles=foldername[0:ind_dot]+".BindingAt."+file_tail
+        targetFiles=basename[0:ind_dot]+".BindingAt."+file_tail+compressionExt
     logging.info("--OK") 
 
 def checkPosition():
@@ -110,12 +113,12 @@ def procPair(): #process the positions
     logging.info("looking for bindings at given location")
     global foldername, targetFiles
 
-    with open(foldername, 'r') as fin:
+    with compressedIO.openFile(foldername, 'r') as fin:
         reader = csv.reader(fin, delimiter='\t')
-        with open(targetFiles, 'w') as fout:
+        with compressedIO.openFile(targetFiles, 'w') as fout:
             writer = csv.writer(fout, delimiter='\t')
             # set headers here, grabbing headers from reader first
-            head = reader.next()
+            head = next(reader)
             head.append('BindingAtPos_'+args.position_1)
             writer.writerow(head)
             for row in reader:
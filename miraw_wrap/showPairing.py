@@ -18,6 +18,9 @@ import csv
 import datetime
 import re
 
+import compressedIO
+import hotPathLog
+
 __author__ = "Yafei Xing"
 __copyright__ = "Copyright 2018, AMG-OUS"
 __version__ = "1.0.1"
@@ -54,6 +57,9 @@ parser.add_argument("-n","--negativeTarget",action="store_true",
 parser.add_argument("-a","--allTarget",action="store_true",
                     help="to show pairing in .allTargetSites.csv")
 
+parser.add_argument("--trace",action="store_true",
+                    help="log every row (slow on large files)")
+
 args = parser.parse_args()
 
 
@@ -74,6 +80,9 @@ def printLongHelpAndExit():
     logging.info("+                                                                              +")
     logging.info("+        -a, the file containing all predicted target sites,                   +")
     logging.info("+            with tail of .allTargetSites.csv                                  +")
+    logging.info("+                                                                              +")
+    logging.info("+      log the pairing of every row         (--trace)                          +")
+    logging.info("+        (by default only progress lines and a summary are logged)             +")
     logging.info("+" + "-" * 78 + "+")
 
 
@@ -97,7 +106,7 @@ def checkTargetsFile(): #check the validity of the commanded files
         if args.allTarget:
             file_tail.append(".allTargetSites.csv")
 
-        targetFiles=[filename + tail for tail in file_tail]
+        targetFiles=[compressedIO.resolvePath(filename + tail) for tail in file_tail]
         for file in targetFiles:
             if not os.path.isfile(file):
                 logging.error("--can't find sites file at <" + file + ">")
@@ -107,19 +116,21 @@ def checkTargetsFile(): #check the validity of the commanded files
       
 def pairbyBracketNotation(): #read and process the commanded files 
     logging.info("process all target files")
-    global filename, file_tail
 
-    for filetail in file_tail:
-        currentFile = filename + filetail
-        with open(currentFile, 'r') as fin:
+    for filetail, currentFile in zip(file_tail, targetFiles):
+        # the pairing file is written with the same compression as the input
+        pairingFile = compressedIO.deriveOutputPath(currentFile, filename+".pairing"+filetail)
+        with compressedIO.openFile(currentFile, 'r') as fin:
             reader = csv.reader(fin, delimiter='\t')
-            with open(filename+".pairing"+filetail, 'w') as fout:
+            with compressedIO.openFile(pairingFile, 'w') as fout:
                 writer = csv.writer(fout, delimiter='\t')
                 # set headers here, grabbing headers from reader first
-                head = reader.next()
+                head = next(reader)
                 head.append('Pairing')
                 writer.writerow(head)
+                progress = hotPathLog.HotPathCounter("pairing " + os.path.basename(currentFile))
                 for row in reader:
+                    progress.tick()
                     #get the needed parameters
                     pair_start_in_site = 39-int(row[5])
                     utr = row[13]
@@ -138,20 +149,27 @@ def pairbyBracketNotation(): #read and process the commanded files
                     new_value = pairing(utr_re,mirna,bknotation_utr,bknotation_mirna)
                     row.append(new_value)
                     writer.writerow(row)
+                    if progress.sampled():
+                        logging.debug("--row " + str(progress.rows) + " " + row[0] + ":" + row[1] + "\n" + new_value)
+                progress.finish()
 
     logging.info("--done")  
 
 def preprocessUtr(utr):         #reverse the 3utr sequence and replace T by U, starting from the binding site
-    logging.info(" preprocess 3utr transcript")
+    # the per-step lines are only logged with --trace, they are written for every row
+    if hotPathLog.tracing:
+        logging.info(" preprocess 3utr transcript")
 
     re_utr=utr[::-1]
     processedUtr=re_utr.replace("T","U")
 
-    logging.info("--done")
+    if hotPathLog.tracing:
+        logging.info("--done")
     return processedUtr
 
 def preprocessBN(notation):     #remove secondary structure in the 3'utr transcript
-    logging.info(" preprocess bracket notation")
+    if hotPathLog.tracing:
+        logging.info(" preprocess bracket notation")
 
     while notation.find(")")>0:
         listBN = list(notation)
@@ -161,22 +179,26 @@ def preprocessBN(notation):     #remove secondary structure in the 3'utr transcr
         listBN[ind_re] ="."
         notation = ''.join(listBN)
 
-    logging.info("--done")
+    if hotPathLog.tracing:
+        logging.info("--done")
     return notation[::-1]    
 
 def alignAndExtendBN(bnmirna,bnutr,pairstart): #reform the bracket notation according to the aligned mRNA transcript
-    logging.info("reform bracket notation")
+    if hotPathLog.tracing:
+        logging.info("reform bracket notation")
 
     ind_1st_pair = bnutr.find("(")
     if ind_1st_pair<pairstart:
         re_bnutr = "."*(pairstart-ind_1st_pair)+bnutr[0:(len(bnutr)-(pairstart-ind_1st_pair))]       
     else:
         re_bnutr = bnutr[(ind_1st_pair-pairstart) : len(bnutr)]+ "."*(ind_1st_pair-pairstart)
-    logging.info("--done")
+    if hotPathLog.tracing:
+        logging.info("--done")
     return re_bnutr
 
 def pairing(re_utr,mirnaseq,bnotation_utr,bnotation_mirna):
-    logging.info("start the pairing process for each mirna:mrna")
+    if hotPathLog.tracing:
+        logging.info("start the pairing process for each mirna:mrna")
 
     strline1 = mirnaseq
     strline2 = ""
@@ -201,7 +223,8 @@ def pairing(re_utr,mirnaseq,bnotation_utr,bnotation_mirna):
                 strline3 = strline3[0:ind]+"-"+strline3[ind:len(strline3)]  
     str_pairing = "5' "+strline1+"  3' miRNA"+"\r\n"+"   "+strline2 +"\r\n"+"3' "+strline3+"  5' mRNA"
 
-    logging.info("--done")
+    if hotPathLog.tracing:
+        logging.info("--done")
     return str_pairing
             
             
@@ -211,6 +234,8 @@ def checkArgs():
     if args.HelpMe :
         printLongHelpAndExit() 
         exit()       
+    if args.trace:
+        hotPathLog.enableTrace()
     checkTargetsFile()
 
     
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-stage timing and memory counters for the filtering scripts.
+
+Stages are marked with the @stage decorator and cost nothing unless
+profiling was switched on with enable() (the --profile option of
+miRAWResultFilterer.py, filterAndPoolMiRAWpredictions.py and
+filterMiRAWpredictionsByDMRs.py). For each stage the report records
+
+    wall      elapsed time (s)
+    cpu       process cpu time (s)
+    peakRSS   peak resident memory of the process at the end of the stage (kB)
+    rssGrowth increase of the peak during the stage (kB)
+    rows      rows processed, as reported by the stage with addRows()
+
+and is written by writeReport() as a JSON file next to the log file
+
+    logfiles/<name>__<date>__<md5>.profile.json
+
+With --cprofile each top level stage is also run under cProfile and the
+stats are dumped to logfiles/<name>__<date>__<md5>.<stage>.prof
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+REPORT_EXTENSION = ".profile.json"
+CPROFILE_EXTENSION = ".prof"
+
+enabled = False
+useCProfile = False
+reportBase = None
+program = None
+startTime = None
+stages = []
+openStages = []
+
+
+def peakRSS():
+    '''peak resident memory of this process in kB (0 if not available)'''
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # reported in bytes on macOS
+        peak = peak // 1024
+    return peak
+
+
+def enable(logFile, cprofile=False):
+    '''switch profiling on, the report is written next to logFile'''
+    global enabled, useCProfile, reportBase, program, startTime
+    enabled = True
+    useCProfile = cprofile
+    reportBase = os.path.splitext(logFile)[0]
+    program = os.path.basename(sys.argv[0])
+    startTime = time.perf_counter()
+    del stages[:]
+
+
+def addRows(rows):
+    '''add to the row count of the stage that is running'''
+    if enabled and openStages:
+        openStages[-1]["rows"] += rows
+
+
+def stage(func):
+    '''decorator that records the counters for each call of func'''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        entry = {"stage": func.__name__, "depth": len(openStages), "rows": 0}
+        profiler = None
+        if useCProfile and not openStages:
+            profiler = cProfile.Profile()
+        openStages.append(entry)
+        rssStart = peakRSS()
+        cpuStart = time.process_time()
+        wallStart = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+            entry["wall"] = time.perf_counter() - wallStart
+            entry["cpu"] = time.process_time() - cpuStart
+            entry["peakRSS"] = peakRSS()
+            entry["rssGrowth"] = entry["peakRSS"] - rssStart
+            openStages.pop()
+            stages.append(entry)
+            if profiler:
+                entry["cprofile"] = reportBase + "." + func.__name__ + CPROFILE_EXTENSION
+                profiler.dump_stats(entry["cprofile"])
+    return wrapper
+
+
+def writeReport():
+    '''write the JSON run report and return its path (None if profiling is off)'''
+    if not enabled:
+        return None
+    reportFile = reportBase + REPORT_EXTENSION
+    report = {"program": program,
+              "arguments": sys.argv[1:],
+              "time": str(datetime.now()),
+              "wall": time.perf_counter() - startTime,
+              "cpu": time.process_time(),
+              "peakRSS": peakRSS(),
+              "stages": stages}
+    with open(reportFile, 'w') as fR:
+        json.dump(report, fR, indent=2)
+    return reportFile
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Generate a deterministic synthetic data set for every stage of the
+miRAW wrapper pipeline
+
+    python syntheticData.py -o /tmp/synth -s small
+    python syntheticData.py -o /tmp/synth --mirnas 50 --utrs 400 --seed 7
+
+-o output folder
+-s scale (tiny, small, medium, large), sets the number of miRNAs and 3'UTRs
+--mirnas / --utrs override the number of miRNAs / 3'UTRs for the scale
+--seed random seed. The same seed and scale always give the same files
+
+files written to the output folder (prefix 'synthetic'):
+
+    synthetic.miRNAs.fa, synthetic.3UTRs.fa         input for miRAWbatch
+    synthetic.unifiedFile.csv                       miRAW input (all pairs)
+    synthetic/synthetic.targetPredictionOutput.csv  miRAW results, input for
+    synthetic/synthetic.allTargetSites.csv          miRAWResultFilterer, cutoffFilter,
+    synthetic/synthetic.positiveTargetSites.csv     showPairing and extractConflicts
+    synthetic/synthetic.negativeTargetSites.csv
+    pool/synthetic.<miRNA>/allTargetSites.csv       one result file per miRNA, listed in
+    synthetic.resultfiles.tsv                       (input for filterAndPoolMiRAWpredictions)
+    synthetic_allfilteredGrouped.tsv                grouped predictions, the miRBase GFF3,
+    synthetic.miRBase.gff3                          the SNV tables and the DMR table are
+    synthetic.miRNASNVs.tsv                         the input for filterMiRAWpredictionsByDMRs
+    synthetic.3UTRSNVs.tsv
+    synthetic.DMRs.tsv
+"""
+
+import os
+import sys
+import json
+import random
+import logging
+import argparse
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+PREFIX = "synthetic"
+
+# (number of miRNAs, number of 3'UTRs)
+SCALES = {
+    "tiny": (4, 20),
+    "small": (20, 200),
+    "medium": (50, 1000),
+    "large": (200, 5000),
+}
+DEFAULT_SCALE = "small"
+DEFAULT_SEED = 17
+
+MIRNA_LENGTH = (20, 24)
+UTR_LENGTH = (200, 1500)
+SITE_LENGTH = 40
+SEED_LENGTH = 7
+TARGET_FRACTION = 0.3       # fraction of miRNA/3'UTR pairs with at least one site
+MAX_SITES_PER_PAIR = 4
+CHROMOSOMES = ["chr" + str(c) for c in range(1, 23)]
+CHROMOSOME_LENGTH = 50000000
+POPULATIONS = ["EUR", "EAS", "AMR", "SAS", "AFR"]
+DMR_DISTANCE = 10000        # DMRs placed near a miRNA end within this distance
+
+NUCLEOTIDES = "ACGT"
+UNIFIED_HEADER = "miRNA\tgene_name\tEnsemblId\tPositive_Negative\tMature_mirna_transcript\t3UTR_transcript"
+TARGET_PREDICTION_HEADER = ["GeneName", "GeneId", "miRNA", "Prediction", "HighestPredVal", "LowestPredVal",
+                            "PosSites", "NegSites", "RemovedSites"]
+TARGET_SITES_HEADER = ["GeneName", "miRNA", "SiteStart", "SiteEnd", "Prediction", "PairStartInSite",
+                       "SeedStart", "SeedEnd", "Pairs", "WC", "Wob", "MFE", "Canonical", "SiteTranscript",
+                       "MatureMiRNATranscript", "BracketNotation", "Filtered", "Filtering", "Reason",
+                       "AdditionalProperties"]
+POOLED_SITES_HEADER = ["GeneName", "miRNA", "SiteStart", "SiteEnd", "Prediction", "Filtered",
+                       "PostfilterPrediction", "PairsInSeed", "FreeEnergy", "SiteTranscript",
+                       "MatureMiRNATranscript", "Filtering Reason", "Canonical", "Additional properties"]
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='generate synthetic miRAW pipeline data')
+
+    parser.add_argument("-o", "--outFolder", dest='outFolder',
+                        help="folder to write the data to")
+    parser.add_argument("-s", "--scale", dest='scale', default=DEFAULT_SCALE, choices=sorted(SCALES),
+                        help="size of the data set [default: %(default)s]")
+    parser.add_argument("--mirnas", dest='mirnas', type=int,
+                        help="number of miRNAs (overrides the scale)")
+    parser.add_argument("--utrs", dest='utrs', type=int,
+                        help="number of 3'UTRs (overrides the scale)")
+    parser.add_argument("--seed", dest='seed', type=int, default=DEFAULT_SEED,
+                        help="random seed [default: %(default)s]")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking output folder:")
+    if not args.outFolder:
+        logging.error("----you need to specify an output folder using the -o/--outFolder parameter")
+        printHelpAndExit()
+    logging.info("--OK")
+
+
+class SyntheticData(object):
+    '''
+    builds the miRNAs, 3'UTRs and predicted sites once and writes
+    them out in the format expected by each stage
+    '''
+
+    def __init__(self, outFolder, nMiRNAs, nUTRs, seed=DEFAULT_SEED):
+        self.outFolder = outFolder
+        if not os.path.isdir(outFolder):
+            os.makedirs(outFolder)
+        self.nMiRNAs = nMiRNAs
+        self.nUTRs = nUTRs
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.files = {}
+        self.miRNAs = [self._makeMiRNA(m) for m in range(nMiRNAs)]
+        self.utrs = [self._makeUTR(u) for u in range(nUTRs)]
+        self.sites = self._makeSites()
+
+    def _sequence(self, length):
+        return "".join(self.random.choice(NUCLEOTIDES) for i in range(length))
+
+    def _makeMiRNA(self, m):
+        chrom = self.random.choice(CHROMOSOMES)
+        start = self.random.randint(DMR_DISTANCE, CHROMOSOME_LENGTH - DMR_DISTANCE)
+        return {"name": "hsa-miR-" + str(m + 1) + "-5p",
+                "mimat": "MIMAT" + str(m + 1).zfill(7),
+                "mi": "MI" + str(m + 1).zfill(7),
+                "chr": chrom,
+                "start": start,
+                "seq": self._sequence(self.random.randint(*MIRNA_LENGTH))}
+
+    def _makeUTR(self, u):
+        chrom = self.random.choice(CHROMOSOMES)
+        seq = self._sequence(self.random.randint(*UTR_LENGTH))
+        start = self.random.randint(1, CHROMOSOME_LENGTH - len(seq))
+        ensg = "ENSG" + str(u + 1).zfill(11)
+        return {"ensg": ensg,
+                "gene": "GENE" + str(u + 1),
+                "header": "|".join([ensg, "ENST" + str(u + 1).zfill(11), "GENE" + str(u + 1),
+                                    str(start), str(start + len(seq))]),
+                "chr": chrom,
+                "start": start,
+                "seq": seq}
+
+    def _makeSites(self):
+        '''list of (miRNA index, 3'UTR index, [site dicts])'''
+        sites = []
+        for m, miRNA in enumerate(self.miRNAs):
+            for u, utr in enumerate(self.utrs):
+                if self.random.random() >= TARGET_FRACTION:
+                    continue
+                pairSites = []
+                for s in range(self.random.randint(1, MAX_SITES_PER_PAIR)):
+                    siteStart = self.random.randint(0, len(utr["seq"]) - SITE_LENGTH)
+                    pairStart = self.random.randint(0, SITE_LENGTH - SEED_LENGTH - 1)
+                    pairSites.append({
+                        "start": siteStart,
+                        "end": siteStart + SITE_LENGTH,
+                        "prediction": round(self.random.uniform(0.0, 1.0), 6),
+                        "pairStart": pairStart,
+                        "pairs": self.random.randint(SEED_LENGTH - 1, SEED_LENGTH + 1),
+                        "mfe": round(self.random.uniform(-30.0, -2.0), 1),
+                        "canonical": self.random.randint(0, 1),
+                        "transcript": utr["seq"][siteStart:siteStart + SITE_LENGTH]})
+                sites.append((m, u, pairSites))
+        return sites
+
+    def _bracketNotation(self, site, miRNASeq):
+        # SEED_LENGTH pairs between the site and the start of the miRNA
+        pairAt = SITE_LENGTH - SEED_LENGTH - site["pairStart"]
+        utrPart = "." * pairAt + "(" * SEED_LENGTH + "." * (SITE_LENGTH - pairAt - SEED_LENGTH)
+        miRNAPart = "." + ")" * SEED_LENGTH + "." * (len(miRNASeq) - SEED_LENGTH - 1)
+        return utrPart + "&" + miRNAPart
+
+    def _path(self, name):
+        return os.path.join(self.outFolder, name)
+
+    def _register(self, key, filePath, rows):
+        self.files[key] = {"file": filePath, "rows": rows}
+        logging.info("--wrote <" + str(rows) + "> rows to <" + filePath + ">")
+
+    def writeFasta(self):
+        with open(self._path(PREFIX + ".miRNAs.fa"), 'w') as fM:
+            for miRNA in self.miRNAs:
+                fM.write(">" + miRNA["name"] + "|" + miRNA["mimat"] + "\n" + miRNA["seq"] + "\n")
+        self._register("miRNAFasta", self._path(PREFIX + ".miRNAs.fa"), len(self.miRNAs))
+        with open(self._path(PREFIX + ".3UTRs.fa"), 'w') as fU:
+            for utr in self.utrs:
+                fU.write(">" + utr["header"] + "\n" + utr["seq"] + "\n")
+        self._register("utrFasta", self._path(PREFIX + ".3UTRs.fa"), len(self.utrs))
+
+    def writeUnifiedFile(self):
+        filePath = self._path(PREFIX + ".unifiedFile.csv")
+        with open(filePath, 'w') as fU:
+            fU.write(UNIFIED_HEADER + "\n")
+            for miRNA in self.miRNAs:
+                mHeader = miRNA["name"] + "|" + miRNA["mimat"]
+                for utr in self.utrs:
+                    fU.write("\t".join([mHeader, utr["header"], utr["header"], "?",
+                                        miRNA["seq"], utr["seq"]]) + "\n")
+        self._register("unifiedFile", filePath, len(self.miRNAs) * len(self.utrs))
+
+    def writeTargetSites(self):
+        experimentFolder = self._path(PREFIX)
+        if not os.path.isdir(experimentFolder):
+            os.makedirs(experimentFolder)
+        basePath = os.path.join(experimentFolder, PREFIX)
+        counts = {"all": 0, "positive": 0, "negative": 0}
+        with open(basePath + ".targetPredictionOutput.csv", 'w') as fT, \
+                open(basePath + ".allTargetSites.csv", 'w') as fA, \
+                open(basePath + ".positiveTargetSites.csv", 'w') as fP, \
+                open(basePath + ".negativeTargetSites.csv", 'w') as fN:
+            fT.write("\t".join(TARGET_PREDICTION_HEADER) + "\n")
+            for fOut in (fA, fP, fN):
+                fOut.write("\t".join(TARGET_SITES_HEADER) + "\n")
+            for m, u, pairSites in self.sites:
+                miRNA = self.miRNAs[m]
+                utr = self.utrs[u]
+                mHeader = miRNA["name"] + "|" + miRNA["mimat"]
+                predictions = [site["prediction"] for site in pairSites]
+                positives = sum(1 for p in predictions if p > 0.5)
+                fT.write("\t".join([utr["header"], utr["header"], mHeader,
+                                    "1" if positives else "-1", str(max(predictions)), str(min(predictions)),
+                                    str(positives), str(len(predictions) - positives), "0"]) + "\n")
+                for site in pairSites:
+                    line = "\t".join([utr["header"], mHeader, str(site["start"]), str(site["end"]),
+                                      str(site["prediction"]), str(site["pairStart"]),
+                                      str(site["pairStart"]), str(site["pairStart"] + SEED_LENGTH),
+                                      str(site["pairs"]), str(site["pairs"] - 1), "1", str(site["mfe"]),
+                                      str(site["canonical"]), site["transcript"], miRNA["seq"],
+                                      self._bracketNotation(site, miRNA["seq"]), "0", "", "", ""]) + "\n"
+                    fA.write(line)
+                    counts["all"] += 1
+                    if site["prediction"] > 0.5:
+                        fP.write(line)
+                        counts["positive"] += 1
+                    else:
+                        fN.write(line)
+                        counts["negative"] += 1
+        self._register("experimentFolder", experimentFolder, len(self.sites))
+        self._register("targetPredictionOutput", basePath + ".targetPredictionOutput.csv", len(self.sites))
+        self._register("allTargetSites", basePath + ".allTargetSites.csv", counts["all"])
+        self._register("positiveTargetSites", basePath + ".positiveTargetSites.csv", counts["positive"])
+        self._register("negativeTargetSites", basePath + ".negativeTargetSites.csv", counts["negative"])
+
+    def writePooledResults(self):
+        '''one allTargetSites.csv per miRNA plus the result file list'''
+        sitesByMiRNA = {}
+        for m, u, pairSites in self.sites:
+            sitesByMiRNA.setdefault(m, []).append((u, pairSites))
+        resultFiles = self._path(PREFIX + ".resultfiles.tsv")
+        rows = 0
+        with open(resultFiles, 'w') as fR:
+            fR.write("INDEX\tCHANGE\tFILE\n")
+            for m, miRNA in enumerate(self.miRNAs):
+                folder = self._path(os.path.join("pool", PREFIX + "." + miRNA["name"]))
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                predFile = os.path.join(folder, "allTargetSites.csv")
+                with open(predFile, 'w') as fP:
+                    fP.write("\t".join(POOLED_SITES_HEADER) + "\n")
+                    for u, pairSites in sitesByMiRNA.get(m, []):
+                        for site in pairSites:
+                            prediction = str(site["prediction"])
+                            fP.write("\t".join([self.utrs[u]["header"], miRNA["name"] + "|" + miRNA["mimat"],
+                                                str(site["start"]), str(site["end"]), prediction, "0",
+                                                prediction, str(site["pairs"]), str(site["mfe"]),
+                                                site["transcript"], miRNA["seq"], "",
+                                                str(site["canonical"]), ""]) + "\n")
+                            rows += 1
+                fR.write(str(m) + "\t" + ("U" if m % 2 else "D") + "\t" + predFile + "\n")
+        self._register("resultFiles", resultFiles, len(self.miRNAs))
+        self._register("pooledSites", self._path("pool"), rows)
+
+    def writeGroupedPredictions(self):
+        filePath = self._path(PREFIX + "_allfilteredGrouped.tsv")
+        with open(filePath, 'w') as fG:
+            fG.write("\tshortGeneName\tshortmiRName\tcount\n")
+            for index, (m, u, pairSites) in enumerate(self.sites):
+                fG.write(str(index) + "\t" + self.utrs[u]["ensg"] + "|" + self.utrs[u]["gene"] + "\t"
+                         + self.miRNAs[m]["name"] + "|" + self.miRNAs[m]["mimat"] + "\t"
+                         + str(len(pairSites)) + "\n")
+        self._register("groupedPredictions", filePath, len(self.sites))
+
+    def writeMiRBaseGFF3(self):
+        filePath = self._path(PREFIX + ".miRBase.gff3")
+        with open(filePath, 'w') as fG:
+            fG.write("##gff-version 3\n")
+            fG.write("# synthetic miRBase annotation\n")
+            for c in range(12):
+                fG.write("#\n")
+            for miRNA in self.miRNAs:
+                end = miRNA["start"] + 80
+                fG.write("\t".join([miRNA["chr"], ".", "miRNA_primary_transcript", str(miRNA["start"]), str(end),
+                                    ".", "+", ".", "ID=" + miRNA["mi"] + ";Alias=" + miRNA["mi"]
+                                    + ";Name=" + miRNA["name"].replace("miR", "mir")]) + "\n")
+                fG.write("\t".join([miRNA["chr"], ".", "miRNA", str(miRNA["start"] + 10),
+                                    str(miRNA["start"] + 10 + len(miRNA["seq"])), ".", "+", ".",
+                                    "ID=" + miRNA["mimat"] + ";Alias=" + miRNA["mimat"] + ";Name=" + miRNA["name"]
+                                    + ";Derives_from=" + miRNA["mi"]]) + "\n")
+        self._register("miRBaseGFF3", filePath, 2 * len(self.miRNAs))
+
+    def _populationColumns(self):
+        values = [str(self.random.randint(0, 3) if self.random.random() < 0.5 else 0) for p in POPULATIONS]
+        values += [str(round(self.random.uniform(0.0, 0.1), 4)) for i in range(3)]
+        return values
+
+    def writeSNVTables(self):
+        populationHeader = POPULATIONS + ["SNVsPerNT", "SubPopsPerNT", "SupPopsPerNT"]
+        miRFile = self._path(PREFIX + ".miRNASNVs.tsv")
+        with open(miRFile, 'w') as fS:
+            fS.write("\t".join(["LOC"] + populationHeader) + "\n")
+            for miRNA in self.miRNAs:
+                fS.write("\t".join([miRNA["chr"] + ":" + str(miRNA["start"]) + "-" + str(miRNA["start"] + 80)]
+                                   + self._populationColumns()) + "\n")
+        self._register("miRNASNVs", miRFile, len(self.miRNAs))
+        utrFile = self._path(PREFIX + ".3UTRSNVs.tsv")
+        with open(utrFile, 'w') as fS:
+            fS.write("\t".join(["ENSGID", "LOC"] + populationHeader) + "\n")
+            for utr in self.utrs:
+                fS.write("\t".join([utr["ensg"], utr["chr"] + ":" + str(utr["start"]) + "-"
+                                    + str(utr["start"] + len(utr["seq"]))] + self._populationColumns()) + "\n")
+        self._register("utrSNVs", utrFile, len(self.utrs))
+
+    def writeDMRs(self):
+        '''half the DMRs end just upstream of a miRNA, the rest are placed at random'''
+        filePath = self._path(PREFIX + ".DMRs.tsv")
+        rows = 0
+        with open(filePath, 'w') as fD:
+            fD.write("# synthetic DMR table\n#\n#\n")
+            fD.write("Chr\tStart position\tEnd position\tLength\tMean difference\n")
+            for miRNA in self.miRNAs:
+                for near in (True, False):
+                    if near:
+                        chrom = miRNA["chr"]
+                        end = miRNA["start"] + self.random.randint(0, DMR_DISTANCE)
+                    else:
+                        chrom = self.random.choice(CHROMOSOMES)
+                        end = self.random.randint(1000, CHROMOSOME_LENGTH)
+                    length = self.random.randint(50, 1000)
+                    fD.write("\t".join([chrom, str(end - length), str(end), str(length),
+                                        str(round(self.random.uniform(-0.5, 0.5), 3))]) + "\n")
+                    rows += 1
+        self._register("DMRs", filePath, rows)
+
+    def writeAll(self):
+        self.writeFasta()
+        self.writeUnifiedFile()
+        self.writeTargetSites()
+        self.writePooledResults()
+        self.writeGroupedPredictions()
+        self.writeMiRBaseGFF3()
+        self.writeSNVTables()
+        self.writeDMRs()
+        return self.files
+
+    def writeIndex(self):
+        '''write a JSON index of the generated files next to the data'''
+        indexFile = self._path(PREFIX + ".index.json")
+        with open(indexFile, 'w') as fI:
+            json.dump({"mirnas": self.nMiRNAs, "utrs": self.nUTRs, "seed": self.seed,
+                       "files": self.files}, fI, indent=2)
+        return indexFile
+
+
+def scaleSize(scale, mirnas=None, utrs=None):
+    '''number of miRNAs and 3'UTRs for a scale, with optional overrides'''
+    nMiRNAs, nUTRs = SCALES[scale]
+    return mirnas or nMiRNAs, utrs or nUTRs
+
+
+def generate(outFolder, scale=DEFAULT_SCALE, mirnas=None, utrs=None, seed=DEFAULT_SEED):
+    nMiRNAs, nUTRs = scaleSize(scale, mirnas, utrs)
+    logging.info("generating <" + str(nMiRNAs) + "> miRNAs x <" + str(nUTRs) + "> 3'UTRs (seed "
+                 + str(seed) + ") in <" + outFolder + ">")
+    data = SyntheticData(outFolder, nMiRNAs, nUTRs, seed)
+    data.writeAll()
+    data.writeIndex()
+    return data
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    generate(args.outFolder, args.scale, args.mirnas, args.utrs, args.seed)
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Enrichment of a protein list (e.g. up- or down-regulated proteins) among
+the targets of each miRNA in a pooled interaction matrix.
+
+For every miRNA at once, with
+
+    N  genes in the matrix (the universe)
+    K  of these in the protein list
+    n  genes targeted by the miRNA
+    k  targeted genes in the protein list
+
+the p-value is P(X >= k) for the hypergeometric distribution (one sided,
+over-representation), or the two sided Fisher exact test of the 2x2 table.
+q-values are Benjamini-Hochberg adjusted over the miRNAs.
+
+A gene is in the protein list if one of its '|' separated name fields
+(ENSG|ENST|symbol|...) is in the list.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import hypergeom
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+TESTS = ["hypergeometric", "fisher"]
+# relative tolerance when comparing table probabilities in the Fisher test (as in R fisher.test)
+FISHER_TOLERANCE = 1 + 1e-7
+
+
+def geneSetMask(genes, proteins):
+    '''boolean array, True for the genes with a name field in proteins'''
+    proteins = set(p.strip() for p in proteins if p.strip())
+    fields = pd.Series(genes).astype(str).str.split("|").explode()
+    inSet = fields.isin(proteins)
+    return inSet.groupby(level=0).any().reindex(range(len(genes)), fill_value=False).to_numpy()
+
+
+def benjaminiHochberg(pValues):
+    '''Benjamini-Hochberg q-values'''
+    pValues = np.asarray(pValues, dtype=np.float64)
+    m = len(pValues)
+    if m == 0:
+        return pValues
+    order = np.argsort(pValues, kind="stable")
+    ranked = pValues[order] * m / np.arange(1, m + 1)
+    # q-values are monotone in the p-values
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    qValues = np.empty(m)
+    qValues[order] = np.minimum(ranked, 1.0)
+    return qValues
+
+
+def fisherTwoSided(k, N, K, n):
+    '''two sided Fisher exact p-values for arrays of (k, n) with the same N and K'''
+    pValues = np.empty(len(k))
+    # miRNAs with the same number of targets share the null distribution
+    for targets in np.unique(n):
+        rows = np.flatnonzero(n == targets)
+        support = np.arange(max(0, targets + K - N), min(targets, K) + 1)
+        pmf = hypergeom.pmf(support, N, K, targets)
+        observed = hypergeom.pmf(k[rows], N, K, targets)
+        pValues[rows] = np.array([pmf[pmf <= p * FISHER_TOLERANCE].sum() for p in observed])
+    return np.minimum(pValues, 1.0)
+
+
+def enrichment(interactions, inSet, test=TESTS[0]):
+    '''
+    per miRNA enrichment of the genes flagged in inSet among its targets,
+    ranked by p-value
+    '''
+    targets = interactions.binary()
+    N = targets.shape[1]
+    K = int(inSet.sum())
+    n = np.diff(targets.indptr).astype(np.int64)
+    k = np.asarray(targets @ inSet.astype(np.int64)).ravel()
+    if test == "fisher":
+        pValues = fisherTwoSided(k, N, K, n)
+    else:
+        pValues = hypergeom.sf(k - 1, N, K, n)
+    expected = n * K / N if N else np.zeros(len(n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fold = np.where(expected > 0, k / expected, np.nan)
+    dfEnrichment = pd.DataFrame({"miRNA": interactions.miRNAs,
+                                 "targets": n,
+                                 "targetsInSet": k,
+                                 "setSize": K,
+                                 "genes": N,
+                                 "expected": expected,
+                                 "foldEnrichment": fold,
+                                 "pValue": pValues,
+                                 "qValue": benjaminiHochberg(pValues)})
+    return dfEnrichment.sort_values(["pValue", "foldEnrichment", "miRNA"], ascending=[True, False, True],
+                                    kind="stable").reset_index(drop=True)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare the target gene sets of pooled miRNAs (e.g. canonical miRNAs
+and their isomiRs)
+
+    python targetSimilarity.py -i results -k 100
+    python targetSimilarity.py -g results_allfilteredGrouped.tsv -m overlap -q _iso -j 4 -M
+
+-i prefix of the interaction matrix written by filterAndPoolMiRAWpredictions.py -N
+-g or the grouped predictions (_allfilteredGrouped.tsv) written by filterAndPoolMiRAWpredictions.py
+-m similarity, jaccard (shared / union) or overlap (shared / smaller set)
+-k number of most similar pairs to write
+-q only compare the miRNAs whose name matches this regular expression against all the others
+-j number of processes
+-M also write the full similarity matrix
+
+The target set of each miRNA is packed into a bitset over the genes, so the
+number of shared genes of two miRNAs is the popcount of the AND of their
+bitsets. The miRNAs are compared in blocks of rows against all others.
+
+files written (prefix from -i, or from -g without _allfilteredGrouped.tsv):
+
+    <prefix>_<metric>TopPairs.tsv     the k most similar pairs
+    <prefix>_<metric>Matrix.tsv       similarity matrix (-M)
+"""
+
+import os
+import re
+import sys
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import compressedIO
+import interactionMatrix
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+METRICS = ["jaccard", "overlap"]
+DEFAULT_METRIC = "jaccard"
+DEFAULT_TOP_K = 100
+GROUPED_SUFFIX = "_allfilteredGrouped.tsv"
+# size of the AND of one block of query rows with all other rows
+BLOCK_BYTES = 16 << 20
+# rows of the interaction matrix converted to bitsets at a time
+PACK_BLOCK_ROWS = 1024
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words):
+        '''number of set bits along the last axis'''
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+else:
+    # numpy < 2.0
+    BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        '''number of set bits along the last axis'''
+        return BYTE_COUNTS[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+# bitsets of the miRNAs, set before the worker processes are forked
+targetBits = None
+
+
+def parseArgs():
+    global parser
+    parser = argparse.ArgumentParser(description='compare the target sets of pooled miRNAs')
+
+    parser.add_argument("-i", "--interactions", dest='interactions',
+                        help="prefix of the interaction matrix files (filterAndPoolMiRAWpredictions.py -N)")
+    parser.add_argument("-g", "--grouped", dest='grouped',
+                        help="grouped predictions file (_allfilteredGrouped.tsv)")
+    parser.add_argument("-m", "--metric", dest='metric', default=DEFAULT_METRIC, choices=METRICS,
+                        help="similarity of two target sets [default: %(default)s]")
+    parser.add_argument("-k", "--topk", dest='topk', type=int, default=DEFAULT_TOP_K,
+                        help="number of most similar pairs to write [default: %(default)s]")
+    parser.add_argument("-q", "--query", dest='query',
+                        help="only compare the miRNAs matching this regular expression against all others")
+    parser.add_argument("-j", "--jobs", dest='jobs', type=int, default=1,
+                        help="number of processes [default: %(default)s]")
+    parser.add_argument("-M", "--matrix", dest='matrix', action="store_true",
+                        help="also write the full similarity matrix")
+    return parser.parse_args()
+
+
+def printHelpAndExit():
+    parser.print_help()
+    logging.info("stopping")
+    sys.exit()
+
+
+def checkArgs(args):
+    logging.info("checking input:")
+    if bool(args.interactions) == bool(args.grouped):
+        logging.error("----you need to specify either an interaction matrix (-i/--interactions) "
+                      "or a grouped predictions file (-g/--grouped)")
+        printHelpAndExit()
+    if args.interactions and not os.path.isfile(args.interactions + interactionMatrix.MATRIX_SUFFIX):
+        logging.error("----can't find <" + args.interactions + interactionMatrix.MATRIX_SUFFIX + ">")
+        printHelpAndExit()
+    if args.grouped and not os.path.isfile(args.grouped):
+        logging.error("----can't find <" + args.grouped + ">")
+        printHelpAndExit()
+    if args.topk < 1 or args.jobs < 1:
+        logging.error("-----k/--topk and -j/--jobs must be at least 1")
+        printHelpAndExit()
+    logging.info("--OK")
+
+
+def loadInteractions(args):
+    '''the interaction matrix and the prefix for the output files'''
+    if args.interactions:
+        return interactionMatrix.InteractionMatrix.load(args.interactions), args.interactions
+    grouped = compressedIO.readTable(args.grouped, sep='\t')
+    prefix = compressedIO.splitCompressionExtension(args.grouped)[0]
+    if prefix.endswith(GROUPED_SUFFIX):
+        prefix = prefix[:-len(GROUPED_SUFFIX)]
+    else:
+        prefix = os.path.splitext(prefix)[0]
+    interactions = interactionMatrix.InteractionMatrix.fromPredictions(
+        grouped['shortmiRName'], grouped['shortGeneName'], grouped['count'])
+    return interactions, prefix
+
+
+def packTargetSets(interactions):
+    '''one row of 64 bit words per miRNA, with bit g set if the miRNA targets gene g'''
+    nMiRNAs, nGenes = interactions.shape
+    nWords = max(1, -(-nGenes // 64))
+    bits = np.zeros((nMiRNAs, nWords * 8), dtype=np.uint8)
+    for start in range(0, nMiRNAs, PACK_BLOCK_ROWS):
+        block = interactions.matrix[start:start + PACK_BLOCK_ROWS].toarray() > 0
+        packed = np.packbits(block, axis=1, bitorder='little')
+        bits[start:start + len(block), :packed.shape[1]] = packed
+    return bits.view(np.uint64)
+
+
+def sharedTargets(task):
+    '''number of shared genes of the query rows with the rows from firstColumn on'''
+    queryRows, firstColumn = task
+    queries = targetBits[queryRows]
+    return popcount(queries[:, None, :] & targetBits[None, firstColumn:, :])
+
+
+def similarity(metric, shared, sizes1, sizes2):
+    if metric == "jaccard":
+        denominator = sizes1 + sizes2 - shared
+    else:
+        denominator = np.minimum(sizes1, sizes2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, shared / np.maximum(denominator, 1), 0.0)
+
+
+def compareTargetSets(bits, sizes, queryRows, metric, topk, jobs=1, keepMatrix=False):
+    '''
+    compare the query rows against all rows. If all rows are queries only the upper
+    triangle is calculated. Returns the top pairs (row1, row2, shared, similarity) and
+    the similarity matrix (queries x all rows, None unless keepMatrix)
+    '''
+    global targetBits
+    targetBits = bits
+    nRows, nWords = bits.shape
+    allRows = len(queryRows) == nRows
+    isQuery = np.zeros(nRows, dtype=bool)
+    isQuery[queryRows] = True
+    blockRows = max(1, BLOCK_BYTES // max(1, nRows * nWords * 8))
+    tasks = []
+    for start in range(0, len(queryRows), blockRows):
+        rows = queryRows[start:start + blockRows]
+        tasks.append((rows, int(rows[0]) if allRows else 0))
+
+    matrix = np.zeros((len(queryRows), nRows), dtype=np.float32) if keepMatrix else None
+    best = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64))
+
+    if jobs > 1 and len(tasks) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context("fork").Pool(min(jobs, len(tasks)))
+        results = pool.imap(sharedTargets, tasks)
+    else:
+        pool = None
+        results = map(sharedTargets, tasks)
+
+    queryStart = 0
+    for (rows, firstColumn), shared in zip(tasks, results):
+        columns = np.arange(firstColumn, nRows)
+        scores = similarity(metric, shared, sizes[rows][:, None], sizes[columns][None, :])
+        if keepMatrix:
+            matrix[queryStart:queryStart + len(rows), firstColumn:] = scores
+        queryStart += len(rows)
+        # each pair once, and no miRNA paired with itself
+        if allRows:
+            keep = columns[None, :] > rows[:, None]
+        else:
+            # pairs of two queries only from the first of the two
+            keep = (columns[None, :] != rows[:, None]) & ~(isQuery[columns][None, :] & (columns[None, :] < rows[:, None]))
+        row1 = np.broadcast_to(rows[:, None], keep.shape)[keep]
+        row2 = np.broadcast_to(columns[None, :], keep.shape)[keep]
+        best = topPairs(best, (row1, row2, shared[keep], scores[keep]), topk)
+
+    if pool:
+        pool.close()
+        pool.join()
+    if keepMatrix and allRows:
+        # only the upper triangle was calculated
+        matrix = np.maximum(matrix, matrix.T)
+    return best, matrix
+
+
+def topPairs(best, candidates, topk):
+    '''the topk pairs of best and candidates, by decreasing similarity, then shared genes, then row'''
+    row1, row2, shared, scores = [np.concatenate(pair) for pair in zip(best, candidates)]
+    if len(scores) > topk:
+        keep = np.argpartition(-scores, topk - 1)[:topk]
+        # keep every pair tied with the last one, so the order below decides which are kept
+        keep = np.flatnonzero(scores >= scores[keep].min())
+        row1, row2, shared, scores = row1[keep], row2[keep], shared[keep], scores[keep]
+    order = np.lexsort((row2, row1, -shared, -scores))[:topk]
+    return row1[order], row2[order], shared[order], scores[order]
+
+
+def writeTopPairs(interactions, sizes, best, metric, topFile):
+    row1, row2, shared, scores = best
+    dfTop = pd.DataFrame({"miRNA1": interactions.miRNAs[row1],
+                          "miRNA2": interactions.miRNAs[row2],
+                          "genes1": sizes[row1],
+                          "genes2": sizes[row2],
+                          "sharedGenes": shared,
+                          metric: scores})
+    dfTop.to_csv(topFile, sep='\t', index=False)
+
+
+def main():
+    args = parseArgs()
+    checkArgs(args)
+    interactions, prefix = loadInteractions(args)
+    logging.info("read <" + str(interactions.shape[0]) + "> miRNAs and <" + str(interactions.shape[1]) + "> genes")
+
+    bits = packTargetSets(interactions)
+    sizes = np.diff(interactions.matrix.indptr).astype(np.int64)
+    queryRows = np.arange(interactions.shape[0])
+    if args.query:
+        pattern = re.compile(args.query)
+        queryRows = np.array([row for row, miRNA in enumerate(interactions.miRNAs) if pattern.search(str(miRNA))],
+                             dtype=np.int64)
+        logging.info("<" + str(len(queryRows)) + "> miRNAs match <" + args.query + ">")
+        if len(queryRows) == 0:
+            logging.info("nothing to compare")
+            return 0
+
+    best, matrix = compareTargetSets(bits, sizes, queryRows, args.metric, args.topk, args.jobs, args.matrix)
+
+    topFile = prefix + "_" + args.metric + "TopPairs.tsv"
+    writeTopPairs(interactions, sizes, best, args.metric, topFile)
+    logging.info("wrote top <" + str(len(best[0])) + "> pairs to <" + topFile + ">")
+    if args.matrix:
+        matrixFile = prefix + "_" + args.metric + "Matrix.tsv"
+        pd.DataFrame(matrix, index=pd.Index(interactions.miRNAs[queryRows], name="miRNA"),
+                     columns=interactions.miRNAs).to_csv(matrixFile, sep='\t')
+        logging.info("wrote similarity matrix to <" + matrixFile + ">")
+    logging.info("finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Split an existing unified file into smaller unified files, one row at a time
+
+used by miRAWbatch.py when it is given an existing unified file (-u):
+
+    -t 3            one file per miRNA
+    -t 4            one file per 3'UTR
+    -t 0 --chunks N N chunks with about the same number of windows (the
+                    work miRAW does for a pair grows with the number of
+                    windows it scans on the 3'UTR, see costModel.py)
+
+--maxRows / --maxBytes put an upper bound on the rows or (uncompressed)
+bytes of each file. A miRNA or 3'UTR with more rows than that continues in
+<feature>.part2, <feature>.part3, ..., and a balanced chunk is closed early.
+
+The rows are copied as they are, so each file only holds the 3'UTR
+sequences of its own rows. The input is never held in memory: rows are
+collected in per-file buffers and appended to their file (as separate gzip
+members or zstd frames, if the output is compressed) whenever the buffers
+together pass BUFFER_BYTES, so only a few files are open at any time, even
+for a split with tens of thousands of files. The balanced split reads the
+input twice, once to add up the windows.
+"""
+
+import compressedIO
+import costModel
+
+
+__version__ = "1.0.1"
+__status__ = "Production"
+
+
+MIRNA_COLUMN = 0
+UTR_COLUMN = 1
+UTR_SEQUENCE_COLUMN = 5
+PART_SEPARATOR = ".part"
+CHUNK_PREFIX = "chunk"
+BUFFER_BYTES = 64 << 20
+
+
+def readHeader(unifiedFile):
+    with compressedIO.openFile(unifiedFile, 'r') as fU:
+        return fU.readline()
+
+
+def unifiedRows(unifiedFile):
+    '''the rows of a unified file, without the header line'''
+    with compressedIO.openFile(unifiedFile, 'r') as fU:
+        fU.readline()
+        for line in fU:
+            if line.strip():
+                yield line
+
+
+def rowWindows(line, maxSiteLength, seedAlignmentOffset):
+    fields = line.rstrip("\r\n").split("\t")
+    utrLength = len(fields[UTR_SEQUENCE_COLUMN]) if len(fields) > UTR_SEQUENCE_COLUMN else 0
+    return costModel.windowCount(utrLength, maxSiteLength, seedAlignmentOffset)
+
+
+class Bound(object):
+    '''the rows and bytes of the file being filled, against --maxRows/--maxBytes'''
+
+    def __init__(self, headerBytes, maxRows=None, maxBytes=None):
+        self.headerBytes = headerBytes
+        self.maxRows = maxRows
+        self.maxBytes = maxBytes
+        self.rows = 0
+        self.bytes = headerBytes
+
+    def full(self, rowBytes):
+        '''would the row go over a bound? (a file always takes at least one row)'''
+        if self.rows == 0:
+            return False
+        return ((self.maxRows is not None and self.rows + 1 > self.maxRows)
+                or (self.maxBytes is not None and self.bytes + rowBytes > self.maxBytes))
+
+    def add(self, rowBytes):
+        self.rows += 1
+        self.bytes += rowBytes
+
+    def reset(self):
+        self.rows = 0
+        self.bytes = self.headerBytes
+
+
+def featureName(name, part):
+    name = name.replace("|", "_")
+    if part == 1:
+        return name
+    return name + PART_SEPARATOR + str(part)
+
+
+def splitByFeature(unifiedFile, column, headerBytes, maxRows=None, maxBytes=None):
+    '''(feature name, row) for each row, the feature being its miRNA or 3'UTR'''
+    # name -> [part, Bound of the part]
+    parts = {}
+    for line in unifiedRows(unifiedFile):
+        name = line.split("\t", column + 1)[column]
+        if name not in parts:
+            parts[name] = [1, Bound(headerBytes, maxRows, maxBytes)]
+        part = parts[name]
+        rowBytes = len(line.encode())
+        if part[1].full(rowBytes):
+            part[0] += 1
+            part[1].reset()
+        part[1].add(rowBytes)
+        yield featureName(name, part[0]), line
+
+
+def splitBalanced(unifiedFile, chunks, headerBytes, maxSiteLength, seedAlignmentOffset,
+                  maxRows=None, maxBytes=None):
+    '''
+    (chunk name, row) for each row. The rows are cut into contiguous chunks
+    with about 1/chunks of the windows each, or less if a bound is reached
+    '''
+    totalWindows = sum(rowWindows(line, maxSiteLength, seedAlignmentOffset) for line in unifiedRows(unifiedFile))
+    target = totalWindows / float(max(1, chunks))
+    chunk = 1
+    # chunks started to keep to the bounds don't count towards the N chunks
+    balancedChunk = 1
+    cumulative = 0
+    bound = Bound(headerBytes, maxRows, maxBytes)
+    for line in unifiedRows(unifiedFile):
+        windows = rowWindows(line, maxSiteLength, seedAlignmentOffset)
+        rowBytes = len(line.encode())
+        if bound.rows and balancedChunk < chunks and cumulative + windows / 2.0 > balancedChunk * target:
+            balancedChunk += 1
+            chunk += 1
+            bound.reset()
+        elif bound.full(rowBytes):
+            chunk += 1
+            bound.reset()
+        cumulative += windows
+        bound.add(rowBytes)
+        yield CHUNK_PREFIX + str(chunk), line
+
+
+class ChunkWriter(object):
+    '''
+    collects the rows for many unified files and appends them to their
+    file in blocks, so memory use and open files stay bounded
+    '''
+
+    def __init__(self, headerLine, pathFor, compression=compressedIO.COMPRESSION_NONE, bufferBytes=BUFFER_BYTES):
+        '''pathFor(featureName) is the file (with compression extension) a feature is written to'''
+        self.headerLine = headerLine
+        self.pathFor = pathFor
+        self.compression = compression
+        self.bufferBytes = bufferBytes
+        self.buffers = {}
+        self.buffered = 0
+        self.paths = {}
+        # features whose file has been created (and truncated)
+        self.started = set()
+        # feature -> rows, in the order the features were first seen
+        self.features = {}
+
+    def add(self, featureName, line):
+        if featureName not in self.features:
+            self.features[featureName] = 0
+            self.paths[featureName] = self.pathFor(featureName)
+            self.buffers[featureName] = [self.headerLine]
+            self.buffered += len(self.headerLine)
+        elif featureName not in self.buffers:
+            self.buffers[featureName] = []
+        self.buffers[featureName].append(line)
+        self.buffered += len(line)
+        self.features[featureName] += 1
+        if self.buffered >= self.bufferBytes:
+            self.flush()
+
+    def flush(self):
+        for featureName, lines in self.buffers.items():
+            block = compressedIO.compressBlock("".join(lines).encode(), self.compression)
+            with open(self.paths[featureName], 'ab' if featureName in self.started else 'wb') as fOut:
+                fOut.write(block)
+            self.started.add(featureName)
+        self.buffers = {}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False